@@ -0,0 +1,72 @@
+"""Compares chunk blob sizes and decode speed of the version 1 map format and the plane codec.
+
+Pages: a few scattered notes, a full page of prose, a page of rendered tables with colored
+headers, and a noisy colored page. The version 1 format only keeps characters, so its numbers
+are a lower bound for what storing colors and owners that way would cost.
+
+    python benchmarks/bench_chunk_codec.py --repeat 200
+"""
+import argparse
+import random
+import time
+
+import msgpack
+
+from asciicanvas.database import compress_data
+from asciicanvas.model import CHUNK_SIZE, Cell, Chunk, Table
+
+WORDS = "the quick brown fox jumps over a lazy dog while notes and tables fill the page".split()
+
+def notes_page() -> Chunk:
+    chunk, rng = Chunk(0, 0), random.Random(1)
+    for _ in range(12):
+        x, y = rng.randrange(CHUNK_SIZE - 20), rng.randrange(CHUNK_SIZE)
+        for i, ch in enumerate(" ".join(rng.sample(WORDS, 3))): chunk.set_cell(x + i, y, Cell(ch=ch))
+    return chunk
+
+def prose_page() -> Chunk:
+    chunk, rng = Chunk(0, 0), random.Random(2)
+    for y in range(CHUNK_SIZE):
+        line = ""
+        while len(line) < CHUNK_SIZE - 8: line += rng.choice(WORDS) + " "
+        for x, ch in enumerate(line): chunk.set_cell(x, y, Cell(ch=ch))
+    return chunk
+
+def tables_page() -> Chunk:
+    chunk = Chunk(0, 0)
+    for ty in range(0, CHUNK_SIZE - 20, 22):
+        table = Table(2, ty, rows=5, cols=6, cell_w=18, cell_h=3)
+        for x, y, cell in table.render():
+            if 0 <= x < CHUNK_SIZE and 0 <= y < CHUNK_SIZE:
+                chunk.set_cell(x, y, cell._replace(fg=4 if y - ty < 4 else None, bg=1 if y - ty < 4 else None))
+    return chunk
+
+def noise_page() -> Chunk:
+    chunk, rng = Chunk(0, 0), random.Random(3)
+    for y in range(CHUNK_SIZE):
+        for x in range(CHUNK_SIZE):
+            chunk.set_cell(x, y, Cell(ch=chr(rng.randrange(33, 127)), fg=rng.randrange(8), bg=rng.randrange(8)))
+    return chunk
+
+def legacy_blob(chunk: Chunk) -> bytes:
+    data = {'chars': {(lx, ly): c.ch for lx, ly, c in chunk.iter_cells() if c.ch != ' '}}
+    return compress_data(msgpack.packb(data, use_bin_type=True))
+
+def time_decode(blob: bytes, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat): Chunk.deserialize(0, 0, blob)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'page':8} {'v1 bytes':>9} {'v1 ms':>7} {'v2 bytes':>9} {'v2 ms':>7}")
+    for name, make in (("notes", notes_page), ("prose", prose_page), ("tables", tables_page), ("noise", noise_page)):
+        chunk = make()
+        legacy, planes = legacy_blob(chunk), chunk.serialize()
+        print(f"{name:8} {len(legacy):9} {time_decode(legacy, args.repeat):7.2f} {len(planes):9} {time_decode(planes, args.repeat):7.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Measures chunk blob sizes and load speed with and without a trained zstd dictionary.
+
+Builds a document of sparse chunks (a few short notes each), checkpoints it without a
+dictionary, then trains one and compares the total size of the `chunks` table and the time to
+decode every chunk. Also times one-shot `zstandard` calls against the cached contexts.
+
+    python benchmarks/bench_compression.py --chunks 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import zstandard
+
+from asciicanvas.database import BlobCompressor
+from asciicanvas.model import CHUNK_SIZE, Canvas, Cell, Chunk
+
+def build(db_path: str, chunks: int, level: int):
+    canvas, rng = Canvas(db_path, compression_level=level), random.Random(0)
+    canvas.load()
+    canvas.dict_train_threshold = float("inf")
+    for k in range(chunks):
+        cx, cy = k % 64, k // 64
+        for j in range(rng.randrange(2, 8)):
+            x, y = cx * CHUNK_SIZE + rng.randrange(100), cy * CHUNK_SIZE + rng.randrange(CHUNK_SIZE)
+            for i, ch in enumerate(f"item {j}: {rng.random():.3f}"): canvas.set_cell(x + i, y, Cell(ch=ch, fg=j % 3 or None))
+    canvas.save_all_dirty_chunks()
+    return canvas
+
+def load_all(canvas: Canvas) -> float:
+    rows = canvas.db.get_chunks_in_rect(-10**6, -10**6, 10**6, 10**6)
+    start = time.perf_counter()
+    for cx, cy, data in rows: Chunk.deserialize(cx, cy, data, canvas.db.decompress)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--level", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        canvas = build(os.path.join(tmp, "bench.asciicanvas"), args.chunks, args.level)
+        table_bytes = lambda: canvas.db.conn.execute("SELECT SUM(LENGTH(data)) FROM chunks").fetchone()[0]
+        plain_bytes, plain_load = table_bytes(), load_all(canvas)
+        start = time.perf_counter()
+        canvas.db.train_compression_dictionary()
+        trained = time.perf_counter() - start
+        dict_bytes, dict_load = table_bytes(), load_all(canvas)
+        print(f"no dictionary: {plain_bytes / args.chunks:7.1f} bytes/chunk, load {plain_load * 1000:7.1f} ms")
+        print(f"dictionary:    {dict_bytes / args.chunks:7.1f} bytes/chunk, load {dict_load * 1000:7.1f} ms (trained in {trained * 1000:.0f} ms)")
+
+        payloads = [canvas.db.decompress(data) for _, _, data in canvas.db.get_chunks_in_rect(-10**6, -10**6, 10**6, 10**6)]
+        start = time.perf_counter()
+        for payload in payloads: zstandard.ZstdCompressor(level=args.level).compress(payload)
+        one_shot = time.perf_counter() - start
+        cached = BlobCompressor(args.level)
+        start = time.perf_counter()
+        for payload in payloads: cached.compress(payload)
+        reused = time.perf_counter() - start
+        print(f"compress:      new context {one_shot * 1000:7.1f} ms, cached context {reused * 1000:7.1f} ms")
+        canvas.db.close()
+
+if __name__ == "__main__":
+    main()
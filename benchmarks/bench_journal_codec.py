@@ -0,0 +1,55 @@
+"""Compares journal op sizes and encode/decode speed of msgpack and the compact op codec.
+
+The workload mixes plain typing (with the old cell kept for undo), colored cells owned by an
+object, and one object creation per thousand edits, roughly what an editing session journals.
+
+    python benchmarks/bench_journal_codec.py --ops 200000
+"""
+import argparse
+import time
+import uuid
+
+import msgpack
+
+from asciicanvas.model import Cell
+from asciicanvas.opcodec import OpCodec
+
+BLANK = list(Cell())
+
+def make_ops(count: int):
+    ops, owner = [], str(uuid.uuid4())
+    for i in range(count):
+        line, x = divmod(i, 80)
+        if i % 1000 == 999:
+            owner = str(uuid.uuid4())
+            ops.append({"type": "BATCH", "ops": [
+                {"type": "CREATE_OBJECT", "obj_data": {"id": owner, "type": "Table", "x": x, "y": line}, "old_cells": []},
+                {"type": "SET_CELL", "x": x, "y": line, "new_cell": ["+", 2, None, owner], "old_cell": BLANK}]})
+        elif i % 5 == 0:
+            ops.append({"type": "SET_CELL", "x": x, "y": line, "new_cell": ["-", 2, 4, owner], "old_cell": BLANK})
+        else:
+            ops.append({"type": "SET_CELL", "x": x, "y": line, "new_cell": [chr(97 + i % 26), None, None, None], "old_cell": BLANK})
+    return ops
+
+def measure(name: str, ops, encode, decode):
+    start = time.perf_counter()
+    rows = [encode(op) for op in ops]
+    encoded = time.perf_counter() - start
+    start = time.perf_counter()
+    for row in rows: decode(row)
+    decoded = time.perf_counter() - start
+    size = sum(map(len, rows))
+    print(f"{name:8} {size / len(ops):6.1f} bytes/op  encode {len(ops) / encoded:>11,.0f} ops/s  decode {len(ops) / decoded:>11,.0f} ops/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=200_000)
+    args = parser.parse_args()
+
+    ops = make_ops(args.ops)
+    measure("msgpack", ops, lambda op: msgpack.packb(op, use_bin_type=True), lambda row: msgpack.unpackb(row, raw=False))
+    encoder, decoder = OpCodec(), OpCodec()
+    measure("compact", ops, encoder.encode, decoder.decode)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measures how long Canvas.load takes to replay a long journal.
+
+Writes a synthetic journal of typing runs that are repeatedly typed and backspaced, then opens
+the document with the coalescing replay and, optionally, with the naive one-op-at-a-time path.
+
+    python benchmarks/bench_replay.py --ops 1000000 --naive
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from asciicanvas.database import Database
+from asciicanvas.model import Canvas, Cell
+from asciicanvas.opcodec import FORMAT_VERSION, OpCodec
+
+BLANK = list(Cell())
+
+def write_journal(db_path: str, ops: int):
+    db = Database(db_path)
+    db.connect()
+    db.create_tables()
+    rows, codec = [], OpCodec()
+    for i in range(ops):
+        # Lines of 80 columns, each typed and erased again ten times before moving on.
+        line, step = divmod(i, 1600)
+        x, erasing = step % 80, (step // 80) % 2 == 1
+        new_cell = BLANK if erasing else ['a', None, None, None]
+        old_cell = ['a', None, None, None] if erasing else BLANK
+        rows.append((0, codec.encode({"type": "SET_CELL", "x": x, "y": line % 4000, "new_cell": new_cell, "old_cell": old_cell})))
+    db.set_meta('version', str(FORMAT_VERSION).encode())
+    with db.conn:
+        db.conn.executemany("INSERT INTO journal (ts, op) VALUES (?, ?)", rows)
+    db.close()
+
+def naive_replay(canvas: Canvas):
+    codec = OpCodec()
+    for rows in canvas.db.iter_journal_ops_after(canvas.last_checkpoint_seq):
+        for _, op_data in rows:
+            canvas.apply_operation(codec.decode(op_data))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=1_000_000)
+    parser.add_argument("--naive", action="store_true", help="also time one apply_operation per op")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.asciicanvas")
+        write_journal(db_path, args.ops)
+
+        canvas = Canvas(db_path)
+        start = time.perf_counter()
+        canvas.load()
+        elapsed = time.perf_counter() - start
+        print(f"coalesced replay: {args.ops} ops in {elapsed:.2f}s ({args.ops / elapsed:,.0f} ops/s), undo groups: {len(canvas.history.groups)}")
+        canvas.db.close()
+
+        if args.naive:
+            # Loading checkpoints a long journal, so the naive pass gets a fresh copy.
+            db_path = os.path.join(tmp, "bench-naive.asciicanvas")
+            write_journal(db_path, args.ops)
+            canvas = Canvas(db_path)
+            canvas.db.connect()
+            start = time.perf_counter()
+            naive_replay(canvas)
+            elapsed = time.perf_counter() - start
+            print(f"naive replay:     {args.ops} ops in {elapsed:.2f}s ({args.ops / elapsed:,.0f} ops/s)")
+            canvas.db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Generates a large, realistic document: a grid of page frames filled with prose, tables and math.
+
+Each page is a 100x60 cell `PageFrame` holding a few paragraphs, a `Table` and a `Math` object,
+about 3,000 non-blank cells per page, so 1000 pages give a document of roughly 3 million cells.
+Text is written with `Canvas.set_cell` and objects with `Canvas.create_object`, then the document
+is checkpointed, as if it had been edited and saved.
+
+    python benchmarks/gen_document.py out.asciicanvas --pages 1000
+"""
+import argparse
+import random
+
+from asciicanvas.model import Canvas, Cell, Math, PageFrame, Table
+
+PAGE_W, PAGE_H, GAP = 100, 60, 10
+WORDS = ("the of and to in is that for it as was with be by on not he this are or his from at which but have an "
+         "they you were her she there been one all we their has would when if so no will more can who out up said "
+         "integral matrix lemma proof table column value sample result figure note draft idea review").split()
+FORMULAS = ["x^2 + y^2 = r^2", "e^(i*pi) + 1 = 0", "sqrt(a*b) <= (a+b)/2", "1/(1-x) = sum x^n", "a/b + c/d"]
+
+def write_paragraph(canvas: Canvas, rng: random.Random, x: int, y: int, width: int, lines: int, fg=None):
+    for line in range(lines):
+        text = ""
+        while len(text) < width - 12: text += rng.choice(WORDS) + " "
+        for i, ch in enumerate(text.rstrip()): canvas.set_cell(x + i, y + line, Cell(ch=ch, fg=fg))
+
+def add_page(canvas: Canvas, rng: random.Random, x: int, y: int):
+    canvas.create_object(PageFrame(x, y, PAGE_W, PAGE_H))
+    write_paragraph(canvas, rng, x + 3, y + 2, PAGE_W - 6, 1, fg=1)
+    write_paragraph(canvas, rng, x + 3, y + 4, PAGE_W - 6, 14)
+    canvas.create_object(Table(x + 3, y + 20, rows=4, cols=4, cell_w=12, cell_h=2))
+    canvas.create_object(Math(x + 60, y + 24, rng.choice(FORMULAS)))
+    write_paragraph(canvas, rng, x + 3, y + 32, PAGE_W - 6, 24)
+
+def generate(path: str, pages: int, columns: int = 10, seed: int = 0) -> Canvas:
+    """Builds the document at `path` and returns the canvas, still open."""
+    canvas, rng = Canvas(path), random.Random(seed)
+    canvas.load()
+    for page in range(pages):
+        row, col = divmod(page, columns)
+        add_page(canvas, rng, col * (PAGE_W + GAP), row * (PAGE_H + GAP))
+    canvas.perform_checkpoint()
+    return canvas
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    canvas = generate(args.path, args.pages, seed=args.seed)
+    chunks = canvas.db.count_chunks()
+    canvas.close()
+    print(f"wrote {args.pages} pages in {chunks} chunks to {args.path}")
+
+if __name__ == "__main__":
+    main()
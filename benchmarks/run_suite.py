@@ -0,0 +1,172 @@
+"""Runs the benchmark suite and compares the results with a stored baseline.
+
+Cases: cell edits (`set_cell`, a filled 500x200 `draw_rect`, `log_and_apply_operation` with the
+synchronous and background journal), `Canvas.load` against journal length and against chunk
+count, chunk serialize and deserialize, `paintEvent` frame time under the offscreen Qt platform
+at text and LOD zoom levels and for a one-cell damage rectangle, and PDF export of a generated document (see gen_document.py).
+
+    python benchmarks/run_suite.py --quick                     # compare with baseline.json
+    python benchmarks/run_suite.py --quick --save-baseline     # record a new baseline
+    python benchmarks/run_suite.py --only load --json out.json
+
+A metric counts as a regression when it is more than --tolerance worse than the baseline.
+Baselines are machine-specific: record one on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from asciicanvas.drawing_utils import draw_rect
+from asciicanvas.model import Canvas, Cell, Chunk
+
+from bench_chunk_codec import notes_page, prose_page
+from bench_replay import write_journal
+from gen_document import generate
+
+BASELINE = Path(__file__).with_name("baseline.json")
+
+# name -> (value, "lower" or "higher" is better, unit)
+Results = Dict[str, Tuple[float, str, str]]
+
+def timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def bench_edits(tmp: str, scale: int) -> Results:
+    results: Results = {}
+    canvas = Canvas(os.path.join(tmp, "edits.asciicanvas"))
+    canvas.load()
+    cells = 100_000 * scale
+    elapsed = timed(lambda: [canvas.set_cell(i % 1000, i // 1000, Cell(ch='e')) for i in range(cells)])
+    results["edit.set_cell"] = (cells / elapsed, "higher", "cells/s")
+    results["edit.draw_rect_500x200"] = (timed(lambda: draw_rect(canvas, 0, 2000, 499, 2199, filled=True)) * 1000, "lower", "ms")
+    canvas.close()
+    for background in (False, True):
+        canvas = Canvas(os.path.join(tmp, f"ops-{background}.asciicanvas"), background_journal=background)
+        canvas.load()
+        ops = 5_000 * scale
+        elapsed = timed(lambda: [canvas.log_and_apply_operation({"type": "SET_CELL", "x": i % 200, "y": i // 200, "new_cell": ['o', None, None, None]})
+                                 for i in range(ops)])
+        results["edit.log_op." + ("background" if background else "sync")] = (ops / elapsed, "higher", "ops/s")
+        canvas.close()
+    return results
+
+def bench_load(tmp: str, scale: int) -> Results:
+    results: Results = {}
+    for ops in (10_000 * scale, 100_000 * scale):
+        path = os.path.join(tmp, f"journal-{ops}.asciicanvas")
+        write_journal(path, ops)
+        canvas = Canvas(path)
+        results[f"load.journal_{ops}"] = (timed(canvas.load) * 1000, "lower", "ms")
+        canvas.db.close()
+    for pages in (20 * scale, 200 * scale):
+        path = os.path.join(tmp, f"pages-{pages}.asciicanvas")
+        generate(path, pages).close()
+        canvas = Canvas(path)
+        results[f"load.pages_{pages}"] = (timed(canvas.load) * 1000, "lower", "ms")
+        cx0, cy0, cx1, cy1 = canvas.db.get_chunk_bounds()
+        results[f"load.pages_{pages}.read_all_chunks"] = (timed(lambda: canvas.load_chunks(cx0, cy0, cx1, cy1)) * 1000, "lower", "ms")
+        canvas.close()
+    return results
+
+def bench_chunks(tmp: str, scale: int) -> Results:
+    results: Results = {}
+    repeat = 50 * scale
+    for name, make in (("prose", prose_page), ("notes", notes_page)):
+        chunk = make()
+        blob = chunk.serialize()
+        results[f"chunk.{name}.serialize"] = (timed(lambda: [chunk.serialize() for _ in range(repeat)]) / repeat * 1e6, "lower", "us")
+        results[f"chunk.{name}.deserialize"] = (timed(lambda: [Chunk.deserialize(0, 0, blob) for _ in range(repeat)]) / repeat * 1e6, "lower", "us")
+        results[f"chunk.{name}.bytes"] = (len(blob), "lower", "bytes")
+    return results
+
+def bench_paint(tmp: str, scale: int) -> Results:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PySide6.QtWidgets import QApplication, QStatusBar
+        from asciicanvas.ui import CanvasWidget
+    except ImportError:
+        print("paint: PySide6 is not installed, skipped", file=sys.stderr)
+        return {}
+    app = QApplication.instance() or QApplication([])
+    path = os.path.join(tmp, "paint.asciicanvas")
+    generate(path, 12).close()
+    canvas = Canvas(path)
+    canvas.load()
+    status_bar = QStatusBar()
+    widget = CanvasWidget(canvas, status_bar)
+    widget.resize(1600, 1000)
+    results: Results = {}
+    for zoom in (1.0, 0.25, 0.05):
+        widget.zoom_level_index = widget.ZOOM_STEPS.index(zoom)
+        widget.tile_cache.clear(); widget.lod_cache.clear()
+        results[f"paint.zoom_{zoom}.cold"] = (timed(widget.grab) * 1000, "lower", "ms")
+        frames = [timed(widget.grab) * 1000 for _ in range(10 * scale)]
+        results[f"paint.zoom_{zoom}.warm"] = (statistics.median(frames), "lower", "ms")
+    widget.zoom_level_index = widget.ZOOM_STEPS.index(1.0)
+    frames = [timed(lambda: widget.grab(widget.cell_rect(10, 10, 11, 11))) * 1000 for _ in range(10 * scale)]
+    results["paint.damage_one_cell"] = (statistics.median(frames), "lower", "ms")
+    widget.deleteLater(); status_bar.deleteLater()
+    app.processEvents()
+    canvas.close()
+    return results
+
+def bench_export(tmp: str, scale: int) -> Results:
+    from asciicanvas.pdf_export import export_to_pdf
+    pages = 20 * scale
+    path = os.path.join(tmp, "export.asciicanvas")
+    generate(path, pages).close()
+    canvas = Canvas(path)
+    canvas.load(read_only=True)
+    elapsed = timed(lambda: export_to_pdf(canvas, os.path.join(tmp, "export.pdf"), workers=1))
+    canvas.close()
+    return {"export.pdf.serial": (elapsed / pages * 1000, "lower", "ms/page")}
+
+CASES = {"edits": bench_edits, "load": bench_load, "chunks": bench_chunks, "paint": bench_paint, "export": bench_export}
+
+def compare(results: Results, baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    regressions = []
+    for name, (value, better, unit) in sorted(results.items()):
+        base = baseline.get(name, {}).get("value")
+        change = "" if not base else f"{(value - base) / base * 100:+7.1f}%"
+        worse = bool(base) and (value > base * (1 + tolerance) if better == "lower" else value < base / (1 + tolerance))
+        if worse: regressions.append(name)
+        print(f"{name:42} {value:14,.2f} {unit:8} {change:>9}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="small inputs, for CI and the stored baseline")
+    parser.add_argument("--only", nargs="*", choices=sorted(CASES), help="run only these cases")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    scale = 1 if args.quick else 5
+    results: Results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.only or CASES:
+            results.update(CASES[name](tmp, scale))
+    data = {name: {"value": round(value, 3), "better": better, "unit": unit} for name, (value, better, unit) in results.items()}
+    if args.json: args.json.write_text(json.dumps(data, indent=2, sort_keys=True))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+        print(f"baseline written to {args.baseline}")
+        return
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,7 @@ setup(
         'msgpack-python',
         'zstandard',
         'reportlab',
+        'pypdf',
     ],
     python_requires='>=3.12',
 )
@@ -1,21 +1,29 @@
 import sys
-from PySide6.QtWidgets import QApplication
 
-from .ui import MainWindow
-from . import config
+from . import config, metrics
 
 def main():
     """
     Main function to run the AsciiCanvas application.
+
+    `asciicanvas export ...` runs the headless CLI instead; PySide6 is only imported for the GUI.
     """
+    if sys.argv[1:2] == ['export']:
+        from .cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
+    from PySide6.QtWidgets import QApplication
+    from .ui import MainWindow
+
     # FIX: Call the new, non-recursive setup function once at startup
     config.ensure_config_and_dirs_exist()
-    
+    metrics.configure_from_env()
+
     app = QApplication(sys.argv)
-    
+
     window = MainWindow()
     window.show()
-    
+
     sys.exit(app.exec())
 
 if __name__ == "__main__":
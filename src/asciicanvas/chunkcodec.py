@@ -0,0 +1,85 @@
+import sys
+from array import array
+from itertools import groupby
+from typing import List, NamedTuple, Optional
+
+import msgpack
+
+CHUNK_CODEC_VERSION = 2
+
+PLANE_RAW = 1
+PLANE_RLE = 2
+# A plane is run-length encoded only if it has at most one run per this many cells; busier planes
+# are stored raw, which decodes with a single `frombytes` and compresses about as well.
+RLE_MIN_CELLS_PER_RUN = 16
+
+class ChunkPlanes(NamedTuple):
+    occupancy: bytes
+    chars: Optional[array]
+    fg: Optional[array]
+    bg: Optional[array]
+    owner_ids: Optional[array]
+    owners: List[Optional[str]]
+
+def _le(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values); values.byteswap()
+    return values.tobytes()
+
+def _from_le(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big': values.byteswap()
+    return values
+
+def _runs(plane: array):
+    """Returns the run values and lengths of `plane`, or None once it has too many runs."""
+    values, lengths = array(plane.typecode), array('H')
+    limit = len(plane) // RLE_MIN_CELLS_PER_RUN
+    for value, run in groupby(plane):
+        length = len(list(run))
+        # Region blocks can hold more cells than a run length field; longer runs are split.
+        while length > 0xFFFF:
+            values.append(value); lengths.append(0xFFFF)
+            length -= 0xFFFF
+        values.append(value); lengths.append(length)
+        if len(values) >= limit: return None
+    return values, lengths
+
+def _encode_plane(plane: Optional[array], default: int) -> Optional[list]:
+    if plane is None: return None
+    runs = _runs(plane)
+    if runs is None: return [PLANE_RAW, _le(plane)]
+    values, lengths = runs
+    if len(values) == 1 and values[0] == default: return None
+    return [PLANE_RLE, _le(values), _le(lengths)]
+
+def _decode_plane(encoded: Optional[list], typecode: str) -> Optional[array]:
+    if encoded is None: return None
+    if encoded[0] == PLANE_RAW: return _from_le(typecode, encoded[1])
+    if encoded[0] != PLANE_RLE: raise ValueError(f"Unknown chunk plane encoding {encoded[0]}")
+    values, lengths = _from_le(typecode, encoded[1]), _from_le('H', encoded[2])
+    plane = array(typecode)
+    for value, length in zip(values, lengths): plane.extend(array(typecode, (value,)) * length)
+    return plane
+
+def encode_planes(planes: ChunkPlanes, blank: int, no_color: int) -> bytes:
+    """Packs the planes of a chunk or region block, before compression.
+
+    The payload is a version byte followed by a msgpack array of the occupancy bitmap, the
+    chars, fg, bg and owner index planes, and the owner table. Each plane is stored row-major
+    as little-endian values, either raw or, when it has few runs, as run values plus run lengths.
+    Planes holding only their default value are omitted.
+    """
+    body = [planes.occupancy, _encode_plane(planes.chars, blank), _encode_plane(planes.fg, no_color),
+            _encode_plane(planes.bg, no_color), _encode_plane(planes.owner_ids, 0), planes.owners[1:]]
+    return bytes((CHUNK_CODEC_VERSION,)) + msgpack.packb(body, use_bin_type=True)
+
+def is_plane_payload(payload: bytes) -> bool:
+    # Version 1 payloads are msgpack maps, whose first byte is never a small integer.
+    return bool(payload) and payload[0] == CHUNK_CODEC_VERSION
+
+def decode_planes(payload: bytes) -> ChunkPlanes:
+    occupancy, chars, fg, bg, owner_ids, owners = msgpack.unpackb(payload[1:], raw=False)
+    return ChunkPlanes(occupancy, _decode_plane(chars, 'I'), _decode_plane(fg, 'h'), _decode_plane(bg, 'h'),
+                       _decode_plane(owner_ids, 'H'), [None] + owners)
@@ -0,0 +1,98 @@
+"""Headless commands. Nothing here imports PySide6.
+
+    asciicanvas export FOLDER --out DIR [--formats text,ansi,html,pdf] [--jobs N] [--force]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .database import Database
+
+FORMATS = {'text': '.txt', 'ansi': '.ans', 'html': '.html', 'pdf': '.pdf'}
+STATE_FILE = '.asciicanvas-export.json'
+
+def document_seq(path: Path) -> int:
+    db = Database(str(path))
+    db.connect(read_only=True)
+    try: return db.get_document_seq()
+    finally: db.close()
+
+def export_document(path: str, out_dir: str, formats: List[str]) -> int:
+    """Writes every requested format of one document and returns the document seq it reflects."""
+    from .model import Canvas
+    from . import pdf_export, text_export
+    canvas = Canvas(path)
+    canvas.load(read_only=True)
+    try:
+        seq = canvas.db.get_document_seq()
+        stem = os.path.join(out_dir, Path(path).stem)
+        for fmt in formats:
+            target = stem + FORMATS[fmt]
+            if fmt == 'pdf':
+                pdf_export.export_to_pdf(canvas, target, workers=1)
+                continue
+            writer = {'text': text_export.write_text, 'ansi': text_export.write_ansi, 'html': text_export.write_html}[fmt]
+            with open(target, 'w', encoding='utf-8') as out: writer(canvas, out)
+        return seq
+    finally:
+        canvas.close()
+
+def _load_state(path: Path) -> Dict[str, Dict]:
+    try: return json.loads(path.read_text())
+    except (OSError, ValueError): return {}
+
+def run_export(folder: Path, out_dir: Path, formats: List[str], jobs: int, force: bool = False) -> Tuple[int, int, int]:
+    """Exports every document in `folder` that changed since the last run; returns (exported, skipped, failed).
+
+    The seq of each exported document is kept in a state file in `out_dir`; a document whose seq
+    and requested formats are unchanged is skipped. Documents are spread across `jobs` processes.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state_path = out_dir / STATE_FILE
+    state = {} if force else _load_state(state_path)
+    todo, skipped, failed = [], 0, 0
+    for path in sorted(folder.glob('*.asciicanvas')):
+        try: seq = document_seq(path)
+        except Exception as e:
+            print(f"{path.name}: {e}", file=sys.stderr); failed += 1
+            continue
+        previous = state.get(path.name)
+        if previous and previous.get('seq') == seq and set(formats) <= set(previous.get('formats', [])): skipped += 1
+        else: todo.append(path)
+
+    exported = 0
+    with ProcessPoolExecutor(max(1, jobs), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(export_document, str(path), str(out_dir), formats): path for path in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try: seq = future.result()
+            except Exception as e:
+                print(f"{path.name}: {e}", file=sys.stderr); failed += 1
+                continue
+            state[path.name] = {'seq': seq, 'formats': sorted(formats)}
+            exported += 1
+    state_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+    return exported, skipped, failed
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='asciicanvas', description="Headless AsciiCanvas commands.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="export every document in a folder")
+    export.add_argument('folder', type=Path)
+    export.add_argument('--out', type=Path, required=True, help="output directory")
+    export.add_argument('--formats', default=','.join(FORMATS), help="comma-separated subset of: " + ', '.join(FORMATS))
+    export.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    export.add_argument('--force', action='store_true', help="export documents even if they did not change")
+    args = parser.parse_args(argv)
+
+    formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if unknown: parser.error(f"unknown format(s): {', '.join(unknown)}")
+    exported, skipped, failed = run_export(args.folder, args.out, formats, args.jobs, args.force)
+    print(f"exported {exported}, skipped {skipped} unchanged, failed {failed}")
+    return 1 if failed else 0
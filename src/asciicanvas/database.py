@@ -1,30 +1,131 @@
+import queue
 import sqlite3
+import threading
+import time
 import zlib
-from typing import Dict, Any, Tuple, Optional, List
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Tuple, Optional, List, Iterator
 
 try:
-    import zstd
+    import zstandard
 except ImportError:
-    zstd = None
+    zstandard = None
+
+from . import metrics
+
+COMPRESSION_LEVEL = 3
+DICT_SIZE = 16 * 1024
+DICT_TRAIN_MIN_CHUNKS = 64
+DICT_TRAIN_MAX_SAMPLES = 2000
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# chunk_text rowids pack a chunk's zig-zag coordinates above its row number (CHUNK_SIZE = 2 ** TEXT_ROW_BITS).
+TEXT_ROW_BITS = 7
+TEXT_COORD_BITS = 28
+
+class BlobCompressor:
+    """Compresses document blobs with zstd, optionally using a dictionary trained on the document.
+
+    Compression and decompression contexts are created once per thread and reused, since the
+    prefetcher decodes chunks on its own thread. Frames record the id of the dictionary they were
+    written with, so blobs written before a document had a dictionary keep decoding without it.
+    Data that is not a zstd frame is tried as zlib and otherwise returned as it is, which is how
+    documents written without zstd are read.
+    """
+    def __init__(self, level: int = COMPRESSION_LEVEL, dictionary: Optional[bytes] = None):
+        self.level = level
+        self.dict_id = 0
+        self._dict = None
+        self._local = threading.local()
+        if dictionary: self.set_dictionary(dictionary)
+
+    def set_dictionary(self, dictionary: Optional[bytes]):
+        if zstandard is None: return
+        self._dict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        self.dict_id = self._dict.dict_id() if self._dict else 0
+        self._local = threading.local()
+
+    def _contexts(self):
+        local = self._local
+        if not hasattr(local, 'cctx'):
+            local.cctx = zstandard.ZstdCompressor(level=self.level, dict_data=self._dict)
+            local.plain_dctx = zstandard.ZstdDecompressor()
+            local.dict_dctx = zstandard.ZstdDecompressor(dict_data=self._dict) if self._dict else None
+        return local
+
+    def compress(self, data: bytes) -> bytes:
+        if zstandard is None: return zlib.compress(data)
+        return self._contexts().cctx.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        if data[:4] != _ZSTD_MAGIC:
+            try: return zlib.decompress(data)
+            except zlib.error: return data
+        if zstandard is None: raise RuntimeError("zstandard is required to read this document.")
+        contexts = self._contexts()
+        params = zstandard.get_frame_parameters(data)
+        if params.dict_id == 0: dctx = contexts.plain_dctx
+        elif params.dict_id == self.dict_id: dctx = contexts.dict_dctx
+        else: raise ValueError(f"Blob was compressed with unknown dictionary {params.dict_id}.")
+        if params.content_size == zstandard.CONTENTSIZE_UNKNOWN: return dctx.decompressobj().decompress(data)
+        return dctx.decompress(data)
+
+    def train(self, samples: List[bytes]) -> Optional[bytes]:
+        """Trains a dictionary from uncompressed samples; returns None when there is too little data."""
+        if zstandard is None or len(samples) < DICT_TRAIN_MIN_CHUNKS: return None
+        try: return zstandard.train_dictionary(DICT_SIZE, samples, level=self.level).as_bytes()
+        except zstandard.ZstdError: return None
+
+_default_compressor = BlobCompressor()
 
 def compress_data(data: bytes) -> bytes:
-    return zstd.compress(data) if zstd else zlib.compress(data)
+    return _default_compressor.compress(data)
 
 def decompress_data(data: bytes) -> bytes:
-    try:
-        return zstd.decompress(data) if zstd else zlib.decompress(data)
-    except (zlib.error, RuntimeError):
-        return data
+    return _default_compressor.decompress(data)
+
+def _connect(db_path: str, read_only: bool = False, **kwargs) -> sqlite3.Connection:
+    if read_only:
+        # A read-only connection never changes the journal mode; WAL lets it read while the
+        # editor's connections keep writing.
+        return sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True, **kwargs)
+    conn = sqlite3.connect(db_path, **kwargs)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    return conn
+
+def _text_rowid(cx: int, cy: int, ly: int = 0) -> int:
+    zx, zy = (cx << 1) ^ (cx >> 63), (cy << 1) ^ (cy >> 63)
+    return (((zx << TEXT_COORD_BITS) | zy) << TEXT_ROW_BITS) | ly
+
+def _text_key(rowid: int) -> Tuple[int, int, int]:
+    ly, zy, zx = rowid & ((1 << TEXT_ROW_BITS) - 1), (rowid >> TEXT_ROW_BITS) & ((1 << TEXT_COORD_BITS) - 1), rowid >> (TEXT_ROW_BITS + TEXT_COORD_BITS)
+    return (zx >> 1) ^ -(zx & 1), (zy >> 1) ^ -(zy & 1), ly
 
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, compression_level: int = COMPRESSION_LEVEL):
         self.db_path = db_path
         self.conn = None
+        self._in_transaction = False
+        self.compressor = BlobCompressor(compression_level)
+        self.text_fts = False
+
+    def connect(self, read_only: bool = False, snapshot: bool = False):
+        """Opens the connection; with `snapshot`, every read until `close` sees the document as it was here."""
+        self.conn = _connect(self.db_path, read_only=read_only)
+        # A read transaction held open pins one WAL snapshot, so writers committing meanwhile stay invisible.
+        if snapshot: self.conn.execute("BEGIN")
+        try: row = self.conn.execute("SELECT value FROM meta WHERE key = 'zstd_dict'").fetchone()
+        except sqlite3.OperationalError: row = None
+        if row: self.compressor.set_dictionary(row[0])
+        row = self.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'chunk_text'").fetchone()
+        self.text_fts = bool(row) and 'fts5' in row[0].lower()
 
-    def connect(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute("PRAGMA journal_mode = WAL;")
-        self.conn.execute("PRAGMA synchronous = NORMAL;")
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.compressor.decompress(data)
 
     def close(self):
         if self.conn:
@@ -36,8 +137,34 @@ class Database:
         with self.conn:
             self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB);")
             self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (cx INT, cy INT, data BLOB, PRIMARY KEY(cx, cy));")
-            self.conn.execute("CREATE TABLE IF NOT EXISTS objects (id TEXT PRIMARY KEY, type TEXT NOT NULL, data BLOB);")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS objects (id TEXT PRIMARY KEY, type TEXT NOT NULL, data BLOB, x0 INT, y0 INT, x1 INT, y1 INT);")
+            # Documents created before objects stored their bounding boxes get the columns added empty.
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(objects)")}
+            for column in ("x0", "y0", "x1", "y1"):
+                if column not in columns: self.conn.execute(f"ALTER TABLE objects ADD COLUMN {column} INT")
             self.conn.execute("CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, ts INT NOT NULL, op BLOB);")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS undo (seq INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB);")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS chunk_summary (cx INT, cy INT, count INT, bitmap BLOB, PRIMARY KEY(cx, cy));")
+            # Substring search index over chunk rows; a plain table searched with LIKE where FTS5 or its trigram tokenizer is missing.
+            try:
+                self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunk_text USING fts5(text, tokenize = 'trigram');")
+                self.text_fts = True
+            except sqlite3.OperationalError:
+                self.conn.execute("CREATE TABLE IF NOT EXISTS chunk_text (id INTEGER PRIMARY KEY, text TEXT);")
+
+    @contextmanager
+    def transaction(self):
+        """Groups every write made inside the block into a single commit. Re-entrant."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        if self._in_transaction:
+            yield
+            return
+        self._in_transaction = True
+        try:
+            with self.conn:
+                yield
+        finally:
+            self._in_transaction = False
 
     def get_meta(self, key: str) -> Optional[bytes]:
         if not self.conn: raise ConnectionError("Database not connected")
@@ -48,7 +175,7 @@ class Database:
 
     def set_meta(self, key: str, value: bytes):
         if not self.conn: raise ConnectionError("Database not connected")
-        with self.conn:
+        with self.transaction():
             self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
 
     def get_chunk(self, cx: int, cy: int) -> Optional[bytes]:
@@ -58,11 +185,79 @@ class Database:
         row = cursor.fetchone()
         return row[0] if row else None
 
+    def get_chunks_in_rect(self, cx0: int, cy0: int, cx1: int, cy1: int) -> List[Tuple[int, int, bytes]]:
+        """Returns `(cx, cy, data)` for every stored chunk in the inclusive chunk rectangle."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT cx, cy, data FROM chunks WHERE cx BETWEEN ? AND ? AND cy BETWEEN ? AND ?", (cx0, cx1, cy0, cy1))
+        return cursor.fetchall()
+
     def put_chunk(self, cx: int, cy: int, data: bytes):
         if not self.conn: raise ConnectionError("Database not connected.")
-        with self.conn:
+        with self.transaction():
             self.conn.execute("INSERT OR REPLACE INTO chunks (cx, cy, data) VALUES (?, ?, ?)", (cx, cy, data))
 
+    def delete_chunk(self, cx: int, cy: int):
+        if not self.conn: raise ConnectionError("Database not connected.")
+        with self.transaction():
+            self.conn.execute("DELETE FROM chunks WHERE cx = ? AND cy = ?", (cx, cy))
+
+    def iter_chunks(self, batch_size: int = 256) -> Iterator[List[Tuple[int, int, bytes]]]:
+        """Yields every stored `(cx, cy, data)`, `batch_size` rows at a time."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT cx, cy, data FROM chunks")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows: return
+            yield rows
+
+    def put_chunk_summary(self, cx: int, cy: int, count: int, bitmap: bytes):
+        if not self.conn: raise ConnectionError("Database not connected.")
+        with self.transaction():
+            self.conn.execute("INSERT OR REPLACE INTO chunk_summary (cx, cy, count, bitmap) VALUES (?, ?, ?, ?)", (cx, cy, count, bitmap))
+
+    def delete_chunk_summary(self, cx: int, cy: int):
+        if not self.conn: raise ConnectionError("Database not connected.")
+        with self.transaction():
+            self.conn.execute("DELETE FROM chunk_summary WHERE cx = ? AND cy = ?", (cx, cy))
+
+    def get_chunk_summaries(self) -> List[Tuple[int, int, int, bytes]]:
+        """Returns `(cx, cy, count, bitmap)` for every stored chunk, or nothing for documents without summaries."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        try: return self.conn.execute("SELECT cx, cy, count, bitmap FROM chunk_summary").fetchall()
+        except sqlite3.OperationalError: return []
+
+    def put_chunk_text(self, cx: int, cy: int, rows: List[Tuple[int, str]]):
+        """Replaces the indexed `(ly, text)` rows of a chunk."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        with self.transaction():
+            self.delete_chunk_text(cx, cy)
+            self.conn.executemany("INSERT INTO chunk_text (rowid, text) VALUES (?, ?)", [(_text_rowid(cx, cy, ly), text) for ly, text in rows])
+
+    def delete_chunk_text(self, cx: int, cy: int):
+        if not self.conn: raise ConnectionError("Database not connected.")
+        base = _text_rowid(cx, cy)
+        with self.transaction():
+            self.conn.execute("DELETE FROM chunk_text WHERE rowid BETWEEN ? AND ?", (base, base + (1 << TEXT_ROW_BITS) - 1))
+
+    def search_text(self, query: str, limit: int) -> List[Tuple[int, int, int, str]]:
+        """Returns `(cx, cy, ly, text)` for up to `limit` indexed rows containing `query`, ignoring case."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        if self.text_fts and len(query) >= 3:
+            # Trigram MATCH finds substrings through the index; shorter queries fall back to LIKE.
+            rows = self.conn.execute("SELECT rowid, text FROM chunk_text WHERE chunk_text MATCH ? LIMIT ?",
+                                     ('"' + query.replace('"', '""') + '"', limit)).fetchall()
+        else:
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = self.conn.execute("SELECT rowid, text FROM chunk_text WHERE text LIKE ? ESCAPE '\\' LIMIT ?", (pattern, limit)).fetchall()
+        return [_text_key(rowid) + (text,) for rowid, text in rows]
+
+    def delete_object(self, obj_id: str):
+        if not self.conn: raise ConnectionError("Database not connected.")
+        with self.transaction():
+            self.conn.execute("DELETE FROM objects WHERE id = ?", (obj_id,))
+
     def get_all_objects(self) -> List[Tuple[str, str, bytes]]:
         """Retrieves all objects from the database."""
         if not self.conn: raise ConnectionError("Database not connected.")
@@ -70,17 +265,35 @@ class Database:
         cursor.execute("SELECT id, type, data FROM objects")
         return cursor.fetchall()
 
-    def put_object(self, obj_id: str, obj_type: str, data: bytes):
+    def get_object(self, obj_id: str) -> Optional[Tuple[str, bytes]]:
+        """Retrieves the type and data of a single object."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT type, data FROM objects WHERE id = ?", (obj_id,))
+        return cursor.fetchone()
+
+    def get_object_bounds(self) -> List[Tuple[str, str, Optional[int], Optional[int], Optional[int], Optional[int]]]:
+        """Retrieves the id, type and bounding box of every object without reading its data."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, type, x0, y0, x1, y1 FROM objects")
+        return cursor.fetchall()
+
+    def put_object(self, obj_id: str, obj_type: str, data: bytes, bbox: Optional[Tuple[int, int, int, int]] = None):
         """Inserts or updates an object in the database."""
         if not self.conn: raise ConnectionError("Database not connected.")
-        with self.conn:
-            self.conn.execute("INSERT OR REPLACE INTO objects (id, type, data) VALUES (?, ?, ?)", (obj_id, obj_type, data))
+        x0, y0, x1, y1 = bbox or (None, None, None, None)
+        with self.transaction():
+            self.conn.execute("INSERT OR REPLACE INTO objects (id, type, data, x0, y0, x1, y1) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (obj_id, obj_type, data, x0, y0, x1, y1))
 
     def append_journal_op(self, timestamp: int, op_data: bytes) -> int:
         if not self.conn: raise ConnectionError("Database not connected.")
-        with self.conn:
+        t0 = metrics.start()
+        with self.transaction():
             cursor = self.conn.execute("INSERT INTO journal (ts, op) VALUES (?, ?)", (timestamp, op_data))
-            return cursor.lastrowid
+        metrics.stop('journal.append', t0)
+        return cursor.lastrowid
 
     def get_journal_ops_after(self, seq: int) -> List[Tuple[int, bytes]]:
         if not self.conn: raise ConnectionError("Database not connected.")
@@ -88,6 +301,16 @@ class Database:
         cursor.execute("SELECT seq, op FROM journal WHERE seq > ? ORDER BY seq ASC", (seq,))
         return cursor.fetchall()
 
+    def iter_journal_ops_after(self, seq: int, batch_size: int = 4096) -> Iterator[List[Tuple[int, bytes]]]:
+        """Yields the journal entries after `seq` in order, `batch_size` rows at a time."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT seq, op FROM journal WHERE seq > ? ORDER BY seq ASC", (seq,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows: return
+            yield rows
+
     def get_last_journal_seq(self) -> int:
         if not self.conn: raise ConnectionError("Database not connected.")
         cursor = self.conn.cursor()
@@ -95,7 +318,163 @@ class Database:
         row = cursor.fetchone()
         return row[0] if row and row[0] is not None else 0
 
+    def get_document_seq(self) -> int:
+        """Returns the seq of the newest journaled op, counting ops a checkpoint already compacted."""
+        checkpoint = self.get_meta('last_checkpoint_seq')
+        return max(self.get_last_journal_seq(), int(checkpoint.decode()) if checkpoint else 0)
+
+    def get_chunk_bounds(self) -> Optional[Tuple[int, int, int, int]]:
+        """Returns the inclusive `(cx0, cy0, cx1, cy1)` range of the stored chunks, or None if there are none."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        row = self.conn.execute("SELECT MIN(cx), MIN(cy), MAX(cx), MAX(cy) FROM chunks").fetchone()
+        return None if row[0] is None else row
+
+    def append_undo_group(self, data: bytes) -> int:
+        if not self.conn: raise ConnectionError("Database not connected.")
+        with self.transaction():
+            return self.conn.execute("INSERT INTO undo (data) VALUES (?)", (data,)).lastrowid
+
+    def delete_undo_group(self, seq: int):
+        if not self.conn: raise ConnectionError("Database not connected.")
+        with self.transaction():
+            self.conn.execute("DELETE FROM undo WHERE seq = ?", (seq,))
+
+    def get_undo_groups_before(self, seq: int, limit: int) -> List[Tuple[int, bytes]]:
+        """Returns up to `limit` stored undo groups with a smaller seq, newest first."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT seq, data FROM undo WHERE seq < ? ORDER BY seq DESC LIMIT ?", (seq, limit))
+        return cursor.fetchall()
+
+    def count_chunks(self) -> int:
+        if not self.conn: raise ConnectionError("Database not connected.")
+        return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def sample_chunk_payloads(self, limit: int = DICT_TRAIN_MAX_SAMPLES) -> List[bytes]:
+        """Returns up to `limit` random chunk payloads, decompressed, as dictionary training samples."""
+        if not self.conn: raise ConnectionError("Database not connected.")
+        rows = self.conn.execute("SELECT data FROM chunks WHERE rowid IN (SELECT rowid FROM chunks ORDER BY RANDOM() LIMIT ?)", (limit,))
+        return [self.decompress(data) for data, in rows]
+
+    def set_compression_dictionary(self, dictionary: bytes):
+        """Stores the dictionary in `meta` under `zstd_dict` and compresses later writes with it."""
+        self.set_meta('zstd_dict', dictionary)
+        self.compressor.set_dictionary(dictionary)
+
+    def train_compression_dictionary(self) -> bool:
+        """Trains a zstd dictionary on the stored chunks and recompresses chunks and objects with it.
+
+        The dictionary and the rewritten rows share one transaction. This rewrites the whole file;
+        `Canvas` trains in the background instead and lets blobs adopt the dictionary as they are
+        rewritten. Returns False, changing nothing, when there is too little data to train on.
+        """
+        dictionary = self.compressor.train(self.sample_chunk_payloads())
+        if dictionary is None: return False
+        trained = BlobCompressor(self.compressor.level, dictionary)
+        with self.transaction():
+            for table, key in (("chunks", "cx, cy"), ("objects", "id")):
+                where = " AND ".join(f"{column} = ?" for column in key.split(", "))
+                # Only the data column changes, so updating rows while the read cursor walks the table is safe.
+                for row in self.conn.cursor().execute(f"SELECT {key}, data FROM {table} WHERE data IS NOT NULL"):
+                    self.conn.execute(f"UPDATE {table} SET data = ? WHERE {where}", (trained.compress(self.decompress(row[-1])),) + tuple(row[:-1]))
+            self.set_meta('zstd_dict', dictionary)
+        self.compressor.set_dictionary(dictionary)
+        return True
+
     def truncate_journal_before(self, seq: int):
         if not self.conn: raise ConnectionError("Database not connected.")
-        with self.conn:
+        with self.transaction():
             self.conn.execute("DELETE FROM journal WHERE seq <= ?", (seq,))
+
+class DictionaryTrainer(threading.Thread):
+    """Trains a dictionary from sampled payloads on a background thread.
+
+    `dictionary` is None until the thread finishes, and stays None when there was too little data.
+    Training only touches the samples, never the connection.
+    """
+    def __init__(self, compressor: BlobCompressor, samples: List[bytes]):
+        super().__init__(name="asciicanvas-dict-trainer", daemon=True)
+        self.compressor, self.samples = compressor, samples
+        self.dictionary: Optional[bytes] = None
+    def run(self):
+        self.dictionary, self.samples = self.compressor.train(self.samples), []
+
+_STOP = object()
+
+class JournalWriter:
+    """Appends journal ops from a background thread, committing them in groups.
+
+    Ops are queued by `append` and written by a thread that owns its own connection. A group is
+    committed once `max_batch` ops are pending or `max_delay_ms` has passed since the first one,
+    so a held key costs one commit per group instead of one per character. `flush` blocks until
+    everything queued before it is committed.
+    """
+    def __init__(self, db_path: str, max_batch: int = 256, max_delay_ms: float = 5.0):
+        self.db_path = db_path
+        self.max_batch, self.max_delay = max_batch, max_delay_ms / 1000
+        self.last_seq, self.commits = 0, 0
+        self.error: Optional[BaseException] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread: return
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def append(self, timestamp: int, op_data: bytes):
+        if self.error: raise self.error
+        if not self._thread: raise ConnectionError("Journal writer is not running.")
+        self._queue.put((timestamp, op_data))
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        """Waits until every op queued so far is committed and returns the last written seq."""
+        if self._thread:
+            barrier = threading.Event()
+            self._queue.put(barrier)
+            if not barrier.wait(timeout): raise TimeoutError("Journal writer did not flush in time.")
+        if self.error: raise self.error
+        return self.last_seq
+
+    def close(self):
+        if not self._thread: return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        if self.error: raise self.error
+
+    def _run(self):
+        conn = _connect(self.db_path)
+        try:
+            stop = False
+            while not stop:
+                batch, barriers = [], []
+                item = self._queue.get()
+                deadline = time.monotonic() + self.max_delay
+                while True:
+                    if item is _STOP: stop = True; break
+                    if isinstance(item, threading.Event): barriers.append(item); break
+                    batch.append(item)
+                    if len(batch) >= self.max_batch: break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    try: item = self._queue.get(timeout=remaining)
+                    except queue.Empty: break
+                if batch and not self.error:
+                    try:
+                        t0 = metrics.start()
+                        with conn:
+                            conn.executemany("INSERT INTO journal (ts, op) VALUES (?, ?)", batch)
+                            self.last_seq = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                        metrics.stop('journal.commit', t0)
+                        metrics.count('journal.ops', len(batch))
+                        self.commits += 1
+                    except sqlite3.Error as e:
+                        self.error = e
+                for barrier in barriers: barrier.set()
+        finally:
+            conn.close()
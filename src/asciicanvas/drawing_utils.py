@@ -1,41 +1,27 @@
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
-from .model import Cell
+from .model import Canvas, Cell, Span
 
-def get_line_cells(x1: int, y1: int, x2: int, y2: int) -> List[Tuple[int, int, Cell]]:
-    """
-    Returns the cells for a line using Bresenham's algorithm with box-drawing characters.
-    """
-    cells = []
+def _line_char(x1: int, y1: int, x2: int, y2: int) -> str:
+    # This is a simplified character selection.
+    # A real implementation would need to check neighbors to select the correct junction characters.
+    if x1 != x2 and y1 != y2: return '╲' if (x2 > x1) == (y2 > y1) else '╱'
+    return '│' if abs(y2 - y1) > abs(x2 - x1) else '─'
+
+def _line_points(x1: int, y1: int, x2: int, y2: int) -> Iterator[Tuple[int, int]]:
+    """Yields the points of a line using Bresenham's algorithm."""
     dx = abs(x2 - x1)
     dy = -abs(y2 - y1)
     sx = 1 if x1 < x2 else -1
     sy = 1 if y1 < y2 else -1
     err = dx + dy
 
-    # Determine dominant axis for character choice
-    is_steep = abs(y2 - y1) > abs(x2 - x1)
-
     x, y = x1, y1
     while True:
-        # This is a simplified character selection.
-        # A real implementation would need to check neighbors to select the correct junction characters.
-        if is_steep:
-            char = '│'
-        else:
-            char = '─'
-        
-        # For diagonal lines, a simple approximation
-        if dx != 0 and dy != 0:
-            if sx > 0 and sy > 0: char = '╲'
-            elif sx < 0 and sy < 0: char = '╲'
-            else: char = '╱'
-
-        cells.append((x, y, Cell(ch=char)))
-
+        yield x, y
         if x == x2 and y == y2:
             break
-        
+
         e2 = 2 * err
         if e2 >= dy:
             err += dy
@@ -43,30 +29,67 @@ def get_line_cells(x1: int, y1: int, x2: int, y2: int) -> List[Tuple[int, int, C
         if e2 <= dx:
             err += dx
             y += sy
-            
-    return cells
+
+def get_line_cells(x1: int, y1: int, x2: int, y2: int) -> List[Tuple[int, int, Cell]]:
+    """
+    Returns the cells for a line using Bresenham's algorithm with box-drawing characters.
+    """
+    cell = Cell(ch=_line_char(x1, y1, x2, y2))
+    return [(x, y, cell) for x, y in _line_points(x1, y1, x2, y2)]
+
+def iter_line_spans(x1: int, y1: int, x2: int, y2: int) -> Iterator[Span]:
+    """
+    Yields the cells of `get_line_cells` as spans, one per row the line crosses.
+    """
+    ch = _line_char(x1, y1, x2, y2)
+    if y1 == y2:
+        yield Span(min(x1, x2), y1, ch * (abs(x2 - x1) + 1))
+        return
+    row, lo, hi = None, 0, 0
+    for x, y in _line_points(x1, y1, x2, y2):
+        if y == row:
+            lo, hi = min(lo, x), max(hi, x)
+            continue
+        if row is not None: yield Span(lo, row, ch * (hi - lo + 1))
+        row, lo, hi = y, x, x
+    yield Span(lo, row, ch * (hi - lo + 1))
+
+def iter_rect_spans(x1: int, y1: int, x2: int, y2: int, filled: bool) -> Iterator[Span]:
+    """
+    Yields a rectangle as spans: the border rows whole, then the sides and the fill of each inner row.
+    """
+    min_x, max_x = min(x1, x2), max(x1, x2)
+    min_y, max_y = min(y1, y2), max(y1, y2)
+    inner = max_x - min_x - 1
+
+    yield Span(min_x, min_y, '┌' + '─' * inner + '┐' if inner >= 0 else '┌')
+    for y in range(min_y + 1, max_y):
+        yield Span(min_x, y, '│')
+        if filled and inner > 0: yield Span(min_x + 1, y, ' ' * inner, bg=1) # Use color 1 for fill
+        if inner >= 0: yield Span(max_x, y, '│')
+    if max_y > min_y: yield Span(min_x, max_y, '└' + '─' * inner + '┘' if inner >= 0 else '└')
 
 def get_rect_cells(x1: int, y1: int, x2: int, y2: int, filled: bool) -> List[Tuple[int, int, Cell]]:
     """
     Returns the cells for a rectangle.
     """
-    cells = []
+    return [(x + i, y, Cell(ch, fg, bg)) for x, y, text, fg, bg, _ in iter_rect_spans(x1, y1, x2, y2, filled) for i, ch in enumerate(text)]
+
+def draw_line(canvas: Canvas, x1: int, y1: int, x2: int, y2: int):
+    """
+    Draws a line on the canvas as one journaled op.
+    """
+    canvas.draw_spans(iter_line_spans(x1, y1, x2, y2))
+
+def draw_rect(canvas: Canvas, x1: int, y1: int, x2: int, y2: int, filled: bool):
+    """
+    Draws a rectangle on the canvas as one journal record and one undo step.
+
+    The fill goes through `Canvas.fill_rect`, so large boxes do not build a span per inner row.
+    """
     min_x, max_x = min(x1, x2), max(x1, x2)
     min_y, max_y = min(y1, y2), max(y1, y2)
-
-    for y in range(min_y, max_y + 1):
-        for x in range(min_x, max_x + 1):
-            is_border = (y == min_y or y == max_y or x == min_x or x == max_x)
-            
-            if not is_border and filled:
-                cells.append((x, y, Cell(bg=1))) # Use color 1 for fill
-            elif is_border:
-                char = ''
-                if (x, y) == (min_x, min_y): char = '┌'
-                elif (x, y) == (max_x, min_y): char = '┐'
-                elif (x, y) == (min_x, max_y): char = '└'
-                elif (x, y) == (max_x, max_y): char = '┘'
-                elif y == min_y or y == max_y: char = '─'
-                elif x == min_x or x == max_x: char = '│'
-                cells.append((x, y, Cell(ch=char)))
-    return cells
+    with canvas.batch():
+        if filled and max_x - min_x > 1 and max_y - min_y > 1:
+            canvas.fill_rect(min_x + 1, min_y + 1, max_x, max_y, Cell(bg=1))
+        canvas.draw_spans(iter_rect_spans(x1, y1, x2, y2, filled=False))
@@ -0,0 +1,89 @@
+"""Process-wide timing histograms and counters.
+
+Instrumented code brackets a section with `start()` and `stop(name, t0)`. While metrics are
+disabled `start` returns 0 and `stop` returns at once, so each probe costs two function calls.
+Enable them with `enable()`, the stats overlay in the editor, or `ASCIICANVAS_METRICS=1`;
+`ASCIICANVAS_METRICS=<path>` additionally appends a JSON snapshot to that file periodically.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+BUCKETS = 40
+LOG_INTERVAL_MS = 10_000
+
+enabled = False
+log_path: Optional[str] = None
+_lock = threading.Lock()
+
+class Histogram:
+    """Durations in power-of-two microsecond buckets: bucket i holds values below 2**i us."""
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def add(self, seconds: float):
+        self.counts[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Returns the upper bound, in seconds, of the bucket holding the given fraction of values."""
+        target, seen = fraction * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n: return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        ms = lambda seconds: round(seconds * 1000, 3)
+        return {'count': self.count, 'total_ms': ms(self.total), 'mean_ms': ms(self.total / self.count) if self.count else 0.0,
+                'p50_ms': ms(self.percentile(0.5)), 'p95_ms': ms(self.percentile(0.95)), 'p99_ms': ms(self.percentile(0.99)), 'max_ms': ms(self.max)}
+
+histograms: Dict[str, Histogram] = {}
+counters: Dict[str, int] = {}
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+def reset():
+    with _lock:
+        histograms.clear()
+        counters.clear()
+
+def start() -> float:
+    return time.perf_counter() if enabled else 0.0
+
+def stop(name: str, t0: float):
+    if not t0: return
+    elapsed = time.perf_counter() - t0
+    with _lock:
+        histogram = histograms.get(name)
+        if histogram is None: histogram = histograms[name] = Histogram()
+        histogram.add(elapsed)
+
+def count(name: str, n: int = 1):
+    if not enabled: return
+    with _lock: counters[name] = counters.get(name, 0) + n
+
+def snapshot() -> Dict:
+    with _lock:
+        return {'time': time.time(), 'histograms': {name: h.summary() for name, h in sorted(histograms.items())},
+                'counters': dict(sorted(counters.items()))}
+
+def dump(path: str):
+    """Appends the current snapshot to `path` as one JSON line."""
+    with open(path, 'a', encoding='utf-8') as f: f.write(json.dumps(snapshot()) + '\n')
+
+def configure_from_env():
+    global log_path
+    value = os.environ.get('ASCIICANVAS_METRICS')
+    if not value or value == '0': return
+    enable()
+    if value != '1': log_path = value
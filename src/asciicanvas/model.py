@@ -1,15 +1,37 @@
+import sys
 import uuid
-from typing import Dict, Tuple, Optional, NamedTuple, Any, List
+from array import array
+from itertools import count, groupby, repeat
+from typing import Dict, Tuple, Optional, NamedTuple, Any, List, Iterator, Iterable, Callable
 import msgpack
 import time
-from collections import deque
+from collections import OrderedDict
+from contextlib import contextmanager
 
-from .database import Database, compress_data, decompress_data
+from . import metrics
+from .chunkcodec import ChunkPlanes, decode_planes, encode_planes, is_plane_payload
+from .database import COMPRESSION_LEVEL, DICT_TRAIN_MIN_CHUNKS, Database, DictionaryTrainer, JournalWriter, compress_data, decompress_data
+from .opcodec import FORMAT_VERSION, OpCodec
+from .prefetch import ChunkPrefetcher
+from .spatial import SpatialIndex
+from .undo import UndoHistory
 from .math_parser import parse_math, ASTNode, Number, Fraction, Exponent, Root
 
 CHUNK_SIZE = 128
 CHECKPOINT_INTERVAL = 2000
 UNDO_LIMIT = 100
+CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+BLANK = ord(' ')
+NO_COLOR = -1
+CHUNK_BASE_BYTES = 512 + CHUNK_AREA // 8
+OWNER_ENTRY_BYTES = 96
+CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+EMPTY_CHUNK_SET_LIMIT = 100_000
+PREFETCH_MAX_CHUNKS = 64
+SEARCH_LIMIT = 1000
+DAMAGE_MAX_RECTS = 64
+SUMMARY_GRID = 8
+_UTF32 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
 
 class Cell(NamedTuple):
     ch: str = ' '
@@ -17,6 +39,26 @@ class Cell(NamedTuple):
     bg: Optional[int] = None
     owner: Optional[str] = None
 
+BLANK_CELL = Cell()
+
+class RegionRow(NamedTuple):
+    text: str
+    runs: List[Tuple[int, int, Optional[int], Optional[int]]]
+
+class Span(NamedTuple):
+    """A horizontal run of text starting at (x, y) and drawn with one style."""
+    x: int
+    y: int
+    text: str
+    fg: Optional[int] = None
+    bg: Optional[int] = None
+    owner: Optional[str] = None
+
+def _color(plane: Optional[array], i: int) -> Optional[int]:
+    if plane is None: return None
+    value = plane[i]
+    return None if value == NO_COLOR else value
+
 class AsciiObject:
     def __init__(self, obj_id: str = None):
         self.id = obj_id or str(uuid.uuid4())
@@ -87,114 +129,1061 @@ class PageFrame(AsciiObject):
     def get_bounding_box(self) -> Tuple[int, int, int, int]:
         return self.x, self.y, self.x + self.width, self.y + self.height
 
+OBJECT_TYPES = {'Table': Table, 'Math': Math, 'PageFrame': PageFrame}
+
+def object_from_dict(data: Dict[str, Any]) -> Optional[AsciiObject]:
+    obj_cls = OBJECT_TYPES.get(data.get('type'))
+    return obj_cls.from_dict(data) if obj_cls else None
+
+_chunk_versions = count(1)
+
 class Chunk:
+    """A CHUNK_SIZE x CHUNK_SIZE block of cells stored as flat, row-major planes.
+
+    Codepoints, colors and interned owner indexes live in fixed-size `array` planes that are
+    only allocated once some cell needs them. `occupancy` holds one bit per non-blank cell.
+    `version` is drawn from a process-wide counter on every write, so it also changes when a
+    chunk is evicted and loaded again.
+    """
     def __init__(self, cx: int, cy: int):
         self.cx, self.cy = cx, cy
-        self.cells: Dict[Tuple[int, int], Cell] = {}
+        self.chars: Optional[array] = None
+        self.fg: Optional[array] = None
+        self.bg: Optional[array] = None
+        self.owner_ids: Optional[array] = None
+        self.owners: List[Optional[str]] = [None]
+        self._owner_index: Dict[str, int] = {}
+        self.occupancy = bytearray(CHUNK_AREA // 8)
+        self.count = 0
         self.dirty = False
-    def get_cell(self, lx: int, ly: int) -> Cell: return self.cells.get((lx, ly), Cell())
+        self.version = next(_chunk_versions)
+        self.nbytes = CHUNK_BASE_BYTES
+    @property
+    def is_empty(self) -> bool: return self.count == 0
+    def is_occupied(self, lx: int, ly: int) -> bool:
+        i = ly * CHUNK_SIZE + lx
+        return bool(self.occupancy[i >> 3] & (1 << (i & 7)))
+    def get_cell(self, lx: int, ly: int) -> Cell:
+        i = ly * CHUNK_SIZE + lx
+        if not self.occupancy[i >> 3] & (1 << (i & 7)): return BLANK_CELL
+        return Cell(chr(self.chars[i]) if self.chars is not None else ' ',
+                    _color(self.fg, i), _color(self.bg, i),
+                    self.owners[self.owner_ids[i]] if self.owner_ids is not None else None)
     def set_cell(self, lx: int, ly: int, cell: Cell):
-        if cell == Cell():
-            if (lx, ly) in self.cells: del self.cells[(lx, ly)]
-        else: self.cells[(lx, ly)] = cell
+        i = ly * CHUNK_SIZE + lx
+        ch, fg, bg, owner = cell
+        cp = ord(ch[0]) if ch else BLANK
+        if cp != BLANK or self.chars is not None:
+            if self.chars is None: self.chars = array('I', [BLANK]) * CHUNK_AREA; self.nbytes += 4 * CHUNK_AREA
+            self.chars[i] = cp
+        if fg is not None or self.fg is not None:
+            if self.fg is None: self.fg = array('h', [NO_COLOR]) * CHUNK_AREA; self.nbytes += 2 * CHUNK_AREA
+            self.fg[i] = NO_COLOR if fg is None else fg
+        if bg is not None or self.bg is not None:
+            if self.bg is None: self.bg = array('h', [NO_COLOR]) * CHUNK_AREA; self.nbytes += 2 * CHUNK_AREA
+            self.bg[i] = NO_COLOR if bg is None else bg
+        if owner is not None or self.owner_ids is not None:
+            if self.owner_ids is None: self.owner_ids = array('H', [0]) * CHUNK_AREA; self.nbytes += 2 * CHUNK_AREA
+            self.owner_ids[i] = 0 if owner is None else self._intern_owner(owner)
+        occupied = cp != BLANK or fg is not None or bg is not None or owner is not None
+        byte, bit = i >> 3, 1 << (i & 7)
+        was_occupied = bool(self.occupancy[byte] & bit)
+        if occupied and not was_occupied: self.occupancy[byte] |= bit; self.count += 1
+        elif was_occupied and not occupied: self.occupancy[byte] &= ~bit; self.count -= 1
         self.dirty = True
-    def serialize(self) -> bytes:
-        data = {'chars': {(lx, ly): c.ch for (lx, ly), c in self.cells.items() if c.ch != ' '}}
-        return compress_data(msgpack.packb(data, use_bin_type=True))
+        self.version = next(_chunk_versions)
+    def write_row(self, lx: int, ly: int, text: str, fg: Optional[int] = None, bg: Optional[int] = None, owner: Optional[str] = None):
+        """Writes `text` into row `ly` from `lx` with one style, using slice assignments on the planes."""
+        n = len(text)
+        if not n: return
+        i = ly * CHUNK_SIZE + lx
+        spaces = text.count(' ')
+        if spaces != n or self.chars is not None:
+            if self.chars is None: self.chars = array('I', [BLANK]) * CHUNK_AREA; self.nbytes += 4 * CHUNK_AREA
+            self.chars[i:i + n] = array('I', text.encode(_UTF32, 'surrogatepass'))
+        if fg is not None or self.fg is not None:
+            if self.fg is None: self.fg = array('h', [NO_COLOR]) * CHUNK_AREA; self.nbytes += 2 * CHUNK_AREA
+            self.fg[i:i + n] = array('h', [NO_COLOR if fg is None else fg]) * n
+        if bg is not None or self.bg is not None:
+            if self.bg is None: self.bg = array('h', [NO_COLOR]) * CHUNK_AREA; self.nbytes += 2 * CHUNK_AREA
+            self.bg[i:i + n] = array('h', [NO_COLOR if bg is None else bg]) * n
+        if owner is not None or self.owner_ids is not None:
+            if self.owner_ids is None: self.owner_ids = array('H', [0]) * CHUNK_AREA; self.nbytes += 2 * CHUNK_AREA
+            self.owner_ids[i:i + n] = array('H', [0 if owner is None else self._intern_owner(owner)]) * n
+        mask = (1 << n) - 1
+        if fg is not None or bg is not None or owner is not None or not spaces: bits = mask
+        elif spaces == n: bits = 0
+        else: bits = int(''.join('0' if c == ' ' else '1' for c in reversed(text)), 2)
+        self._set_row_bits(lx, ly, n, bits)
+    def read_segment(self, lx: int, ly: int, n: int) -> Tuple[int, Optional[array], Optional[array], Optional[array], Optional[array]]:
+        """Returns the occupancy bits and the chars, fg, bg and owner index slices of `n` cells of row `ly`."""
+        i = ly * CHUNK_SIZE + lx
+        row_bytes = CHUNK_SIZE // 8
+        bits = (int.from_bytes(self.occupancy[ly * row_bytes:(ly + 1) * row_bytes], 'little') >> lx) & ((1 << n) - 1)
+        return (bits,) + tuple(None if plane is None else plane[i:i + n] for plane in (self.chars, self.fg, self.bg, self.owner_ids))
+    def write_segment(self, lx: int, ly: int, n: int, bits: int, chars: Optional[array], fg: Optional[array],
+                      bg: Optional[array], owner_ids: Optional[array]):
+        """Overwrites `n` cells of row `ly` with plane slices as returned by `read_segment`; None means default values.
+
+        `owner_ids` must already index this chunk's owner table.
+        """
+        i = ly * CHUNK_SIZE + lx
+        for name, typecode, default, values in (('chars', 'I', BLANK, chars), ('fg', 'h', NO_COLOR, fg),
+                                                ('bg', 'h', NO_COLOR, bg), ('owner_ids', 'H', 0, owner_ids)):
+            plane = getattr(self, name)
+            if values is None:
+                if plane is not None: plane[i:i + n] = array(typecode, [default]) * n
+                continue
+            if plane is None:
+                plane = array(typecode, [default]) * CHUNK_AREA
+                setattr(self, name, plane)
+                self.nbytes += plane.itemsize * CHUNK_AREA
+            plane[i:i + n] = values
+        self._set_row_bits(lx, ly, n, bits)
+    def _set_row_bits(self, lx: int, ly: int, n: int, bits: int):
+        # Occupancy of the row as one integer: replace the `n` bits from `lx` with `bits`.
+        mask = ((1 << n) - 1) << lx
+        row_bytes = CHUNK_SIZE // 8
+        start = ly * row_bytes
+        old = int.from_bytes(self.occupancy[start:start + row_bytes], 'little')
+        new = (old & ~mask) | (bits << lx)
+        self.occupancy[start:start + row_bytes] = new.to_bytes(row_bytes, 'little')
+        self.count += new.bit_count() - old.bit_count()
+        self.dirty = True
+        self.version = next(_chunk_versions)
+    def set_cells(self, cells: Iterable[Tuple[int, int, Cell]]):
+        for lx, ly, cell in cells: self.set_cell(lx, ly, cell)
+    def _intern_owner(self, owner: str) -> int:
+        idx = self._owner_index.get(owner)
+        if idx is None:
+            if len(self.owners) > 0xFFFF: self.compact_owners()
+            idx = self._owner_index[owner] = len(self.owners)
+            self.owners.append(sys.intern(owner))
+            self.nbytes += OWNER_ENTRY_BYTES
+        return idx
+    def compact_owners(self):
+        """Drops owner table entries that no cell refers to any more and renumbers the rest."""
+        if self.owner_ids is None or len(self.owners) == 1: return
+        used = sorted(set(self.owner_ids) - {0})
+        if len(used) == len(self.owners) - 1: return
+        remap = [0] * len(self.owners)
+        for new, old in enumerate(used, 1): remap[old] = new
+        self.nbytes -= OWNER_ENTRY_BYTES * (len(self.owners) - 1 - len(used))
+        self.owner_ids = array('H', [remap[idx] for idx in self.owner_ids])
+        self.owners = [None] + [self.owners[idx] for idx in used]
+        self._owner_index = {owner: idx for idx, owner in enumerate(self.owners) if idx}
+    def row_text(self, ly: int, lx0: int = 0, lx1: int = CHUNK_SIZE) -> str:
+        """Returns the characters of row `ly` between `lx0` (inclusive) and `lx1` (exclusive)."""
+        if self.chars is None: return ' ' * (lx1 - lx0)
+        start = ly * CHUNK_SIZE
+        return self.chars[start + lx0:start + lx1].tobytes().decode(_UTF32, 'surrogatepass')
+    def row_runs(self, ly: int, lx0: int = 0, lx1: int = CHUNK_SIZE) -> List[Tuple[int, int, Optional[int], Optional[int]]]:
+        """Returns `(start, end, fg, bg)` style runs covering row `ly` between `lx0` and `lx1`."""
+        if self.fg is None and self.bg is None: return [(lx0, lx1, None, None)]
+        start = ly * CHUNK_SIZE
+        fgs = self.fg[start + lx0:start + lx1] if self.fg is not None else repeat(NO_COLOR)
+        bgs = self.bg[start + lx0:start + lx1] if self.bg is not None else repeat(NO_COLOR)
+        runs, x = [], lx0
+        for (fg, bg), group in groupby(zip(fgs, bgs)):
+            end = x + sum(1 for _ in group)
+            runs.append((x, end, None if fg == NO_COLOR else fg, None if bg == NO_COLOR else bg))
+            x = end
+        return runs
+    def row_owners(self, ly: int, lx0: int = 0, lx1: int = CHUNK_SIZE) -> List[Optional[str]]:
+        if self.owner_ids is None: return [None] * (lx1 - lx0)
+        start, owners = ly * CHUNK_SIZE, self.owners
+        return [owners[idx] for idx in self.owner_ids[start + lx0:start + lx1]]
+    def summary(self) -> Tuple[int, bytes]:
+        """Returns the non-blank cell count and a SUMMARY_GRID x SUMMARY_GRID bitmap of the blocks holding any."""
+        row_bytes, block = CHUNK_SIZE // 8, CHUNK_SIZE // SUMMARY_GRID
+        block_mask, bits = (1 << block) - 1, 0
+        for by in range(SUMMARY_GRID):
+            rows = self.occupancy[by * block * row_bytes:(by + 1) * block * row_bytes]
+            if not any(rows): continue
+            merged = 0
+            for r in range(block): merged |= int.from_bytes(rows[r * row_bytes:(r + 1) * row_bytes], 'little')
+            for bx in range(SUMMARY_GRID):
+                if (merged >> (bx * block)) & block_mask: bits |= 1 << (by * SUMMARY_GRID + bx)
+        return self.count, bits.to_bytes(SUMMARY_GRID * SUMMARY_GRID // 8, 'little')
+    def text_rows(self) -> List[Tuple[int, str]]:
+        """Returns `(ly, text)` for every row with visible characters, trailing blanks stripped."""
+        if self.chars is None: return []
+        rows = ((ly, self.row_text(ly).rstrip()) for ly in range(CHUNK_SIZE) if not self.row_is_empty(ly))
+        return [(ly, text) for ly, text in rows if text]
+    def row_is_empty(self, ly: int) -> bool:
+        row_bytes = CHUNK_SIZE // 8
+        return not any(self.occupancy[ly * row_bytes:(ly + 1) * row_bytes])
+    def iter_cells(self) -> Iterator[Tuple[int, int, Cell]]:
+        """Yields `(lx, ly, cell)` for every non-blank cell, in row-major order."""
+        occupancy = self.occupancy
+        for byte_idx in range(len(occupancy)):
+            bits = occupancy[byte_idx]
+            while bits:
+                low = bits & -bits
+                i = (byte_idx << 3) + low.bit_length() - 1
+                yield i % CHUNK_SIZE, i // CHUNK_SIZE, self.get_cell(i % CHUNK_SIZE, i // CHUNK_SIZE)
+                bits ^= low
+    def serialize(self, compress: Callable[[bytes], bytes] = compress_data) -> bytes:
+        planes = ChunkPlanes(bytes(self.occupancy), self.chars, self.fg, self.bg, self.owner_ids, self.owners)
+        return compress(encode_planes(planes, BLANK, NO_COLOR))
     @classmethod
-    def deserialize(cls, cx: int, cy: int, data: bytes) -> 'Chunk':
+    def deserialize(cls, cx: int, cy: int, data: bytes, decompress: Callable[[bytes], bytes] = decompress_data) -> 'Chunk':
         chunk = cls(cx, cy)
-        unpacked = msgpack.unpackb(decompress_data(data), raw=False)
+        payload = decompress(data)
+        if is_plane_payload(payload):
+            planes = decode_planes(payload)
+            chunk.occupancy = bytearray(planes.occupancy)
+            chunk.count = int.from_bytes(planes.occupancy, 'little').bit_count()
+            chunk.chars, chunk.fg, chunk.bg, chunk.owner_ids = planes.chars, planes.fg, planes.bg, planes.owner_ids
+            chunk.nbytes += sum(plane.itemsize * CHUNK_AREA for plane in (planes.chars, planes.fg, planes.bg, planes.owner_ids) if plane is not None)
+            for owner in planes.owners[1:]: chunk._intern_owner(owner)
+            return chunk
+        # Version 1 blobs: a msgpack map of the non-blank characters only.
+        unpacked = msgpack.unpackb(payload, raw=False, use_list=False, strict_map_key=False)
         for (lx, ly), ch in unpacked.get('chars', {}).items():
-            chunk.cells[(lx, ly)] = Cell(ch=ch)
+            chunk.set_cell(lx, ly, Cell(ch=ch))
+        chunk.dirty = False
         return chunk
 
+class CellBlock:
+    """A rectangle of cells lifted off the canvas, stored in row-major planes like a chunk.
+
+    `objects` holds the dicts of the objects that lie wholly inside the block, with coordinates
+    relative to its top-left corner. Cells owned by any other object are copied without an owner.
+    """
+    def __init__(self, width: int, height: int):
+        self.width, self.height = width, height
+        self.occupancy = 0
+        self.chars: Optional[array] = None
+        self.fg: Optional[array] = None
+        self.bg: Optional[array] = None
+        self.owner_ids: Optional[array] = None
+        self.owners: List[Optional[str]] = [None]
+        self.objects: List[Dict[str, Any]] = []
+    @property
+    def area(self) -> int: return self.width * self.height
+    def put_segment(self, col: int, row: int, n: int, bits: int, chars, fg, bg, owner_ids):
+        """Stores a slice from `Chunk.read_segment`; `owner_ids` must already index this block's owner table."""
+        i = row * self.width + col
+        self.occupancy |= bits << i
+        for name, typecode, default, values in (('chars', 'I', BLANK, chars), ('fg', 'h', NO_COLOR, fg),
+                                                ('bg', 'h', NO_COLOR, bg), ('owner_ids', 'H', 0, owner_ids)):
+            if values is None: continue
+            plane = getattr(self, name)
+            if plane is None:
+                plane = array(typecode, [default]) * self.area
+                setattr(self, name, plane)
+            plane[i:i + n] = values
+    def get_segment(self, col: int, row: int, n: int) -> Tuple[int, Optional[array], Optional[array], Optional[array], Optional[array]]:
+        i = row * self.width + col
+        return ((self.occupancy >> i) & ((1 << n) - 1),) + tuple(
+            None if plane is None else plane[i:i + n] for plane in (self.chars, self.fg, self.bg, self.owner_ids))
+    def with_owners(self, owner_map: Dict[str, str]) -> 'CellBlock':
+        """Returns a copy whose owners and object ids are renamed through `owner_map`; the planes are shared."""
+        block = CellBlock(self.width, self.height)
+        block.occupancy, block.chars, block.fg, block.bg, block.owner_ids = self.occupancy, self.chars, self.fg, self.bg, self.owner_ids
+        block.owners = [None if owner is None else owner_map.get(owner, owner) for owner in self.owners]
+        block.objects = [dict(data, id=owner_map.get(data['id'], data['id'])) for data in self.objects]
+        return block
+    def serialize(self, compress: Callable[[bytes], bytes] = compress_data) -> bytes:
+        occupancy = self.occupancy.to_bytes((self.area + 7) // 8, 'little')
+        return compress(encode_planes(ChunkPlanes(occupancy, self.chars, self.fg, self.bg, self.owner_ids, self.owners), BLANK, NO_COLOR))
+    @classmethod
+    def deserialize(cls, width: int, height: int, data: bytes, decompress: Callable[[bytes], bytes] = decompress_data) -> 'CellBlock':
+        block = cls(width, height)
+        planes = decode_planes(decompress(data))
+        block.occupancy = int.from_bytes(planes.occupancy, 'little')
+        block.chars, block.fg, block.bg, block.owner_ids, block.owners = planes.chars, planes.fg, planes.bg, planes.owner_ids, planes.owners
+        return block
+
+class ChunkCache:
+    """LRU map of resident chunks, bounded by the estimated bytes of their planes.
+
+    When the budget is exceeded the least recently used chunks are evicted; `evict` is called
+    with each one first so the canvas can write dirty chunks back to the database. With
+    `keep_dirty` set there is nowhere to write them back to, so dirty chunks are pinned and only
+    clean ones are evicted; the cache may then stay over budget.
+    """
+    def __init__(self, budget_bytes: int, evict: Callable[[Chunk], None]):
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0
+        self.keep_dirty = False
+        self._evict = evict
+        self._chunks: OrderedDict[Tuple[int, int], Chunk] = OrderedDict()
+    def __len__(self) -> int: return len(self._chunks)
+    def __contains__(self, key: Tuple[int, int]) -> bool: return key in self._chunks
+    def __getitem__(self, key: Tuple[int, int]) -> Chunk: return self._chunks[key]
+    def values(self): return self._chunks.values()
+    def get(self, key: Tuple[int, int]) -> Optional[Chunk]:
+        chunk = self._chunks.get(key)
+        if chunk is not None: self._chunks.move_to_end(key)
+        return chunk
+    def put(self, chunk: Chunk):
+        key = (chunk.cx, chunk.cy)
+        old = self._chunks.pop(key, None)
+        if old is not None: self.nbytes -= old.nbytes
+        self._chunks[key] = chunk
+        self.nbytes += chunk.nbytes
+        self.trim()
+    def resized(self, old_nbytes: int, new_nbytes: int):
+        self.nbytes += new_nbytes - old_nbytes
+        if self.nbytes > self.budget_bytes: self.trim()
+    def pop(self, key: Tuple[int, int]) -> Optional[Chunk]:
+        chunk = self._chunks.pop(key, None)
+        if chunk is not None: self.nbytes -= chunk.nbytes
+        return chunk
+    def trim(self):
+        # The most recently used chunk is never evicted, so a caller holding it stays valid.
+        if self.keep_dirty:
+            self._trim_clean(); return
+        while self.nbytes > self.budget_bytes and len(self._chunks) > 1:
+            _, chunk = self._chunks.popitem(last=False)
+            self.nbytes -= chunk.nbytes
+            self._evict(chunk)
+    def _trim_clean(self):
+        for key in list(self._chunks)[:-1]:
+            if self.nbytes <= self.budget_bytes: return
+            chunk = self._chunks[key]
+            if chunk.dirty: continue
+            del self._chunks[key]
+            self.nbytes -= chunk.nbytes
+            self._evict(chunk)
+
 class Canvas:
-    def __init__(self, db_path: str):
-        self.db = Database(db_path)
-        self.chunks: Dict[Tuple[int, int], Chunk] = {}
+    def __init__(self, db_path: str, background_journal: bool = False, cache_bytes: int = CHUNK_CACHE_BYTES,
+                 compression_level: int = COMPRESSION_LEVEL):
+        self.db = Database(db_path, compression_level)
+        self.journal_writer = JournalWriter(db_path) if background_journal else None
+        self.chunks = ChunkCache(cache_bytes, self._evict_chunk)
+        self.empty_chunks: set[Tuple[int, int]] = set()
+        self.prefetcher: Optional[ChunkPrefetcher] = None
+        self._store_generation = 0
+        self._stored_at: Dict[Tuple[int, int], int] = {}
         self.objects: Dict[str, AsciiObject] = {}
+        self.object_index = SpatialIndex(CHUNK_SIZE)
+        self.dirty_objects: set[str] = set()
         self.last_checkpoint_seq = 0
-        self.undo_stack: deque[Dict] = deque(maxlen=UNDO_LIMIT)
-        self.redo_stack: deque[Dict] = deque(maxlen=UNDO_LIMIT)
-
-    def load(self):
-        self.db.connect()
-        self.db.create_tables()
-        for obj_id, obj_type, obj_data in self.db.get_all_objects():
-            obj_data_unpacked = msgpack.unpackb(decompress_data(obj_data), raw=False)
-            if obj_type == 'Table': self.objects[obj_id] = Table.from_dict(obj_data_unpacked)
-            elif obj_type == 'Math': self.objects[obj_id] = Math.from_dict(obj_data_unpacked)
-            elif obj_type == 'PageFrame': self.objects[obj_id] = PageFrame.from_dict(obj_data_unpacked)
+        self.ops_since_checkpoint = 0
+        self.dict_train_threshold = DICT_TRAIN_MIN_CHUNKS
+        self._dict_trainer: Optional[DictionaryTrainer] = None
+        self.op_codec = OpCodec()
+        self.journal_ts_base = 0
+        self.deleted_objects: set[str] = set()
+        self.history = UndoHistory(UNDO_LIMIT, self.db.get_undo_groups_before)
+        self._batch_ops: Optional[List[Dict[str, Any]]] = None
+        self.read_only = False
+        self.text_index_ready = False
+        self._summaries: Optional[Dict[Tuple[int, int], Tuple[int, bytes]]] = None
+        self.damage: Optional[List[List[int]]] = None
+
+    def load(self, read_only: bool = False):
+        """Opens the document and replays its journal.
+
+        A read-only canvas never writes to the file: the schema is not created or upgraded, the
+        journal is not checkpointed, and no undo history is built. It is meant for exports and
+        can be opened while an editor has the document open: it reads one snapshot of the
+        document from `load` until `close`, so checkpoints the editor makes meanwhile are not seen.
+        """
+        self.read_only = read_only
+        # Replayed chunks are dirty and cannot be written back, so they stay resident.
+        self.chunks.keep_dirty = read_only
+        self.db.connect(read_only=read_only, snapshot=read_only)
+        if not read_only: self.db.create_tables()
+        if not read_only: self._build_chunk_indexes()
+        self.text_index_ready = self.db.get_meta('text_index') is not None
+        self._load_object_index()
+        if not read_only: self.history.load()
         last_seq_bytes = self.db.get_meta('last_checkpoint_seq')
         if last_seq_bytes: self.last_checkpoint_seq = int(last_seq_bytes.decode())
-        self._replay_journal()
+        version_bytes = self.db.get_meta('version')
+        version = int(version_bytes.decode()) if version_bytes else 1
+        if version > FORMAT_VERSION: raise ValueError(f"Document format version {version} is newer than the supported version {FORMAT_VERSION}.")
+        ts_base_bytes = self.db.get_meta('journal_ts_base')
+        if ts_base_bytes: self.journal_ts_base = int(ts_base_bytes.decode())
+        self._replay_journal(self.op_codec.decode if version >= 2 else self._decode_legacy_op)
+        if read_only: return
+        if version < FORMAT_VERSION: self._upgrade_format()
+        elif self.ops_since_checkpoint >= CHECKPOINT_INTERVAL: self.perform_checkpoint()
+        if self.journal_writer: self.journal_writer.start()
+
+    def _load_object_index(self):
+        """Indexes every object by its stored bounding box; objects are materialized on demand."""
+        for obj_id, obj_type, x0, y0, x1, y1 in self.db.get_object_bounds():
+            if x0 is None:
+                # Written before bounding boxes were stored: decode once and backfill the row.
+                obj = self.get_object(obj_id)
+                if obj is None: continue
+                x0, y0, x1, y1 = obj.get_bounding_box()
+                if not self.read_only: self.db.put_object(obj.id, obj.type, self._pack_object(obj, self.db.compress), (x0, y0, x1, y1))
+            self.object_index.insert(obj_id, obj_type, (x0, y0, x1, y1))
+
+    def get_object(self, obj_id: str) -> Optional[AsciiObject]:
+        obj = self.objects.get(obj_id)
+        if obj is None and obj_id not in self.deleted_objects:
+            row = self.db.get_object(obj_id)
+            if row is None: return None
+            obj = object_from_dict(msgpack.unpackb(self.db.decompress(row[1]), raw=False))
+            if obj: self.objects[obj_id] = obj
+        return obj
+
+    def objects_in_rect(self, x0: int, y0: int, x1: int, y1: int) -> List[AsciiObject]:
+        """Returns the objects whose bounding boxes intersect the inclusive rectangle."""
+        objs = (self.get_object(obj_id) for obj_id in self.object_index.query_rect(x0, y0, x1, y1))
+        return [obj for obj in objs if obj is not None]
+
+    def objects_at(self, x: int, y: int) -> List[AsciiObject]:
+        return self.objects_in_rect(x, y, x, y)
+
+    def iter_objects(self, obj_type: Optional[str] = None) -> Iterator[AsciiObject]:
+        """Yields all objects, or only those of `obj_type`, materializing them as needed."""
+        for obj_id in self.object_index.ids_of_type(obj_type):
+            obj = self.get_object(obj_id)
+            if obj is not None: yield obj
 
-    def _replay_journal(self):
-        ops = self.db.get_journal_ops_after(self.last_checkpoint_seq)
-        for seq, op_data in ops:
-            op = msgpack.unpackb(op_data, raw=False)
+    @staticmethod
+    def _pack_object(obj: AsciiObject, compress: Callable[[bytes], bytes] = compress_data) -> bytes:
+        return compress(msgpack.packb(obj.to_dict(), use_bin_type=True))
+
+    @staticmethod
+    def _decode_legacy_op(op_data: bytes) -> Dict[str, Any]:
+        return msgpack.unpackb(op_data, raw=False)
+
+    def _iter_stored_chunks(self) -> Iterator[Chunk]:
+        for rows in self.db.iter_chunks():
+            for cx, cy, data in rows: yield self._decode_chunk(cx, cy, data)
+
+    def _build_chunk_indexes(self):
+        """Fills `chunk_text` and `chunk_summary` for documents written before they existed, decoding each chunk once."""
+        text, summary = self.db.get_meta('text_index') is None, self.db.get_meta('chunk_summary') is None
+        if not (text or summary): return
+        with self.db.transaction():
+            for chunk in self._iter_stored_chunks():
+                if text: self.db.put_chunk_text(chunk.cx, chunk.cy, chunk.text_rows())
+                if summary: self.db.put_chunk_summary(chunk.cx, chunk.cy, *chunk.summary())
+            for key, missing in (('text_index', text), ('chunk_summary', summary)):
+                if missing: self.db.set_meta(key, b'1')
+
+    def _upgrade_format(self):
+        """Moves a version 1 document to the current format.
+
+        Version 1 journals hold msgpack ops. The replayed tail is checkpointed so the journal is
+        empty, and the new version is recorded in the same transaction, so every op written
+        afterwards uses the compact codec.
+        """
+        with self.db.transaction():
+            if self.has_pending_changes(): self.perform_checkpoint()
+            else: self._restart_journal_stream()
+            self.db.set_meta('version', str(FORMAT_VERSION).encode())
+
+    def _restart_journal_stream(self):
+        # Called with the journal empty: the codec tables and the timestamp base start over.
+        self.op_codec.reset()
+        self.journal_ts_base = int(time.time())
+        self.db.set_meta('journal_ts_base', str(self.journal_ts_base).encode())
+
+    def _replay_journal(self, decode: Callable[[bytes], Dict[str, Any]]):
+        """Replays the journal tail, keeping only the last write to each cell.
+
+        Rows are fetched and decoded in batches. Cell writes, including the cells rendered by
+        created objects, are coalesced per coordinate and then applied chunk by chunk; op types
+        without a fast path flush the pending writes and go through `apply_operation` in order.
+        The undo history is rebuilt on top of the groups stored at the last checkpoint.
+        """
+        t0 = metrics.start()
+        pending: Dict[Tuple[int, int], Any] = {}
+        for rows in self.db.iter_journal_ops_after(self.last_checkpoint_seq):
+            for op in [decode(op_data) for _, op_data in rows]:
+                self._collect_replayed_op(op, pending)
+                if not self.read_only: self._record_history(op)
+            self.ops_since_checkpoint += len(rows)
+        self._apply_cell_writes(pending)
+        metrics.stop('replay', t0)
+        metrics.count('replay.ops', self.ops_since_checkpoint)
+
+    def _record_history(self, op: Dict[str, Any]):
+        op_type = op.get('type')
+        if op_type == 'UNDO': self.history.pop_undo()
+        # The redo stack is not stored, so a REDO of a group undone before the last checkpoint records its ops again.
+        elif op_type == 'REDO':
+            if self.history.pop_redo() is None: self.history.record(op)
+        else: self.history.record(op)
+
+    def _collect_replayed_op(self, op: Dict[str, Any], pending: Dict[Tuple[int, int], Any]):
+        op_type = op.get('type')
+        if op_type == 'SET_CELL':
+            pending[(op['x'], op['y'])] = op['new_cell']
+        elif op_type in ('BATCH', 'UNDO', 'REDO'):
+            for sub_op in op['ops']: self._collect_replayed_op(sub_op, pending)
+        elif op_type == 'CREATE_OBJECT':
+            obj = object_from_dict(op['obj_data'])
+            if not obj: return
+            self._register_object(obj)
+            for x, y, cell in obj.render(): pending[(x, y)] = cell
+        else:
+            self._apply_cell_writes(pending)
+            pending.clear()
             self.apply_operation(op)
-            if 'old_cell' in op or op.get('type') == 'CREATE_OBJECT':
-                self.undo_stack.append(op)
+
+    def _apply_cell_writes(self, writes: Dict[Tuple[int, int], Any]):
+        by_chunk: Dict[Tuple[int, int], List[Tuple[int, int, Cell]]] = {}
+        for (x, y), cell in writes.items():
+            by_chunk.setdefault((x // CHUNK_SIZE, y // CHUNK_SIZE), []).append((x % CHUNK_SIZE, y % CHUNK_SIZE, Cell(*cell)))
+        for (cx, cy), cells in by_chunk.items():
+            chunk = self.get_chunk(cx, cy)
+            nbytes = chunk.nbytes
+            chunk.set_cells(cells)
+            if chunk.nbytes != nbytes: self.chunks.resized(nbytes, chunk.nbytes)
 
     def close(self):
-        if self.db.conn: self.perform_checkpoint(); self.db.close()
+        if self.prefetcher: self.prefetcher.close(); self.prefetcher = None
+        if self.db.conn:
+            if not self.read_only: self.perform_checkpoint()
+            if self._dict_trainer: self._maybe_train_dictionary(wait=True)
+            if self.journal_writer: self.journal_writer.close()
+            self.db.close()
+
+    def flush_journal(self) -> int:
+        """Blocks until every logged op is committed and returns the last journal seq."""
+        if self.journal_writer: return max(self.journal_writer.flush(), self.db.get_last_journal_seq())
+        return self.db.get_last_journal_seq()
 
     def apply_operation(self, op: Dict[str, Any]):
         op_type = op.get('type')
         if op_type == 'SET_CELL':
             self.set_cell(op['x'], op['y'], Cell(*op['new_cell']))
         elif op_type == 'CREATE_OBJECT':
-            obj_data = op['obj_data']
-            obj_type = obj_data['type']
-            if obj_type == 'Table': obj = Table.from_dict(obj_data)
-            elif obj_type == 'Math': obj = Math.from_dict(obj_data)
-            elif obj_type == 'PageFrame': obj = PageFrame.from_dict(obj_data)
-            else: return
-            self.objects[obj.id] = obj
+            obj = object_from_dict(op['obj_data'])
+            if not obj: return
+            self._register_object(obj)
             for x, y, cell in obj.render(): self.set_cell(x, y, cell)
+        elif op_type == 'DRAW_SPANS':
+            for x, y, text, fg, bg, owner in op['spans']: self._write_span(x, y, text, fg, bg, owner)
+        elif op_type == 'FILL_RECT':
+            x0, y0, x1, y1 = op['rect']
+            ch, fg, bg, owner = op['cell']
+            row = (ch[:1] or ' ') * (x1 - x0)
+            for y in range(y0, y1): self._write_span(x0, y, row, fg, bg, owner)
+        elif op_type in ('BATCH', 'UNDO', 'REDO'):
+            for sub_op in op['ops']: self.apply_operation(sub_op)
+        elif op_type == 'DELETE_OBJECT':
+            self._unregister_object(op['obj_id'])
+            for x, y, cell in op['old_cells']: self.set_cell(x, y, Cell(*cell))
+        elif op_type == 'BLIT':
+            for obj_data in op['delete']: self._unregister_object(obj_data['id'])
+            for x, y, w, h, data in op['writes']: self._write_block(CellBlock.deserialize(w, h, data, self.db.decompress), x, y)
+            for obj in filter(None, map(object_from_dict, op['create'])): self._register_object(obj)
+
+    def _register_object(self, obj: AsciiObject):
+        self.deleted_objects.discard(obj.id)
+        self.objects[obj.id] = obj
+        self.object_index.insert(obj.id, obj.type, obj.get_bounding_box())
+        self.dirty_objects.add(obj.id)
+
+    def _unregister_object(self, obj_id: str):
+        self.objects.pop(obj_id, None)
+        self.object_index.remove(obj_id)
+        self.dirty_objects.discard(obj_id)
+        self.deleted_objects.add(obj_id)
 
     def get_cell(self, x: int, y: int) -> Cell:
-        cx, cy = x // CHUNK_SIZE, y // CHUNK_SIZE
-        chunk = self.get_chunk(cx, cy)
-        return chunk.get_cell(x % CHUNK_SIZE, y % CHUNK_SIZE)
+        chunk = self.peek_chunk(x // CHUNK_SIZE, y // CHUNK_SIZE)
+        return chunk.get_cell(x % CHUNK_SIZE, y % CHUNK_SIZE) if chunk else BLANK_CELL
+
+    def get_region(self, x0: int, y0: int, x1: int, y1: int) -> List[RegionRow]:
+        """Reads the half-open rectangle [x0, x1) x [y0, y1) one chunk row at a time.
+
+        Each `RegionRow` holds the row's characters and its `(start, end, fg, bg)` style runs in
+        world x coordinates, with adjacent runs of the same style merged across chunk borders.
+        """
+        rows: List[RegionRow] = []
+        if x1 <= x0 or y1 <= y0: return rows
+        for cy in range(y0 // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE + 1):
+            ly0, ly1 = max(y0 - cy * CHUNK_SIZE, 0), min(y1 - cy * CHUNK_SIZE, CHUNK_SIZE)
+            band = []
+            for cx in range(x0 // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE + 1):
+                lx0, lx1 = max(x0 - cx * CHUNK_SIZE, 0), min(x1 - cx * CHUNK_SIZE, CHUNK_SIZE)
+                band.append((self.peek_chunk(cx, cy), lx0, lx1, cx * CHUNK_SIZE))
+            for ly in range(ly0, ly1):
+                parts, runs = [], []
+                for chunk, lx0, lx1, base in band:
+                    if chunk is None or chunk.row_is_empty(ly):
+                        parts.append(' ' * (lx1 - lx0)); segment_runs = [(lx0, lx1, None, None)]
+                    else:
+                        parts.append(chunk.row_text(ly, lx0, lx1)); segment_runs = chunk.row_runs(ly, lx0, lx1)
+                    for start, end, fg, bg in segment_runs:
+                        if runs and runs[-1][2] == fg and runs[-1][3] == bg: runs[-1] = (runs[-1][0], base + end, fg, bg)
+                        else: runs.append((base + start, base + end, fg, bg))
+                rows.append(RegionRow(''.join(parts), runs))
+        return rows
+
+    def peek_chunk(self, cx: int, cy: int) -> Optional[Chunk]:
+        """Returns the chunk for reading, or None if it is empty. Empty chunks are not cached."""
+        chunk = self.chunks.get((cx, cy))
+        if chunk is not None or (cx, cy) in self.empty_chunks:
+            metrics.count('chunk.hit')
+            return chunk
+        metrics.count('chunk.miss')
+        chunk_data = self.db.get_chunk(cx, cy)
+        if not chunk_data:
+            self._remember_empty(cx, cy)
+            return None
+        chunk = self._decode_chunk(cx, cy, chunk_data)
+        self.chunks.put(chunk)
+        return chunk
+
+    def is_resident(self, cx: int, cy: int) -> bool:
+        """Returns whether `peek_chunk(cx, cy)` would answer without reading the database."""
+        return (cx, cy) in self.chunks or (cx, cy) in self.empty_chunks
 
     def get_chunk(self, cx: int, cy: int) -> Chunk:
-        if (cx, cy) not in self.chunks:
-            chunk_data = self.db.get_chunk(cx, cy)
-            if chunk_data: self.chunks[(cx, cy)] = Chunk.deserialize(cx, cy, chunk_data)
-            else: self.chunks[(cx, cy)] = Chunk(cx, cy)
-        return self.chunks[(cx, cy)]
-    
+        """Returns the chunk for writing, creating it if it does not exist yet."""
+        chunk = self.peek_chunk(cx, cy)
+        if chunk is None:
+            self.empty_chunks.discard((cx, cy))
+            chunk = Chunk(cx, cy)
+            self.chunks.put(chunk)
+        return chunk
+
+    def load_chunks(self, cx0: int, cy0: int, cx1: int, cy1: int):
+        """Reads the missing chunks of the inclusive chunk rectangle with a single query."""
+        missing = {(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)
+                   if (cx, cy) not in self.chunks and (cx, cy) not in self.empty_chunks}
+        if not missing: return
+        for cx, cy, data in self.db.get_chunks_in_rect(cx0, cy0, cx1, cy1):
+            if (cx, cy) in missing:
+                missing.discard((cx, cy))
+                self.chunks.put(self._decode_chunk(cx, cy, data))
+        for key in missing: self._remember_empty(*key)
+
+    @contextmanager
+    def transient_chunks(self):
+        """Drops the chunks loaded inside the block from the cache when it ends, writing back dirty ones."""
+        resident = {(chunk.cx, chunk.cy) for chunk in self.chunks.values()}
+        try:
+            yield
+        finally:
+            for chunk in [chunk for chunk in self.chunks.values() if (chunk.cx, chunk.cy) not in resident]:
+                self.chunks.pop((chunk.cx, chunk.cy))
+                self._evict_chunk(chunk)
+
+    @property
+    def summary_version(self) -> Tuple[int, int]:
+        """Changes whenever `chunk_summaries` may return something different."""
+        return self._store_generation, max((chunk.version for chunk in self.chunks.values() if chunk.dirty), default=0)
+
+    def chunk_summaries(self) -> Dict[Tuple[int, int], Tuple[int, bytes]]:
+        """Returns `(count, bitmap)` for every non-empty chunk without reading chunk blobs.
+
+        Stored summaries are read from `chunk_summary` once and then kept up to date as chunks
+        are written; chunks with unsaved edits are summarized from memory on each call.
+        """
+        if self._summaries is None:
+            self._summaries = {(cx, cy): (count, bitmap) for cx, cy, count, bitmap in self.db.get_chunk_summaries()}
+        summaries = dict(self._summaries)
+        for chunk in self.chunks.values():
+            if not chunk.dirty: continue
+            if chunk.is_empty: summaries.pop((chunk.cx, chunk.cy), None)
+            else: summaries[(chunk.cx, chunk.cy)] = chunk.summary()
+        return summaries
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[Tuple[int, int]]:
+        """Returns the world coordinates where `query` starts, ignoring case, in reading order.
+
+        Stored chunks are searched through the `chunk_text` index, and chunks with unsaved edits
+        are scanned in memory. A match must lie within one chunk row: text that crosses a chunk
+        border is not found. Documents opened read-only without an index are scanned chunk by chunk.
+        """
+        if not query: return []
+        t0 = metrics.start()
+        needle, hits = query.lower(), set()
+        def scan(cx: int, cy: int, rows: Iterable[Tuple[int, str]]):
+            for ly, text in rows:
+                i = text.lower().find(needle)
+                while i >= 0:
+                    hits.add((cx * CHUNK_SIZE + i, cy * CHUNK_SIZE + ly))
+                    i = text.lower().find(needle, i + 1)
+        dirty = {(chunk.cx, chunk.cy): chunk for chunk in self.chunks.values() if chunk.dirty}
+        if self.text_index_ready:
+            for cx, cy, ly, text in self.db.search_text(query, limit):
+                if (cx, cy) not in dirty: scan(cx, cy, [(ly, text)])
+        else:
+            for chunk in self._iter_stored_chunks():
+                if (chunk.cx, chunk.cy) not in dirty: scan(chunk.cx, chunk.cy, chunk.text_rows())
+        for (cx, cy), chunk in dirty.items(): scan(cx, cy, chunk.text_rows())
+        metrics.stop('search', t0)
+        return sorted(hits, key=lambda hit: (hit[1], hit[0]))[:limit]
+
+    def _remember_empty(self, cx: int, cy: int):
+        if len(self.empty_chunks) >= EMPTY_CHUNK_SET_LIMIT: self.empty_chunks.clear()
+        self.empty_chunks.add((cx, cy))
+
+    def _evict_chunk(self, chunk: Chunk):
+        if chunk.dirty:
+            self._store_chunk(chunk)
+            chunk.dirty = False
+        if chunk.is_empty: self._remember_empty(chunk.cx, chunk.cy)
+
+    def _decode_chunk(self, cx: int, cy: int, data: bytes) -> Chunk:
+        t0 = metrics.start()
+        chunk = Chunk.deserialize(cx, cy, data, self.db.decompress)
+        metrics.stop('chunk.decode', t0)
+        return chunk
+
+    def start_prefetcher(self, on_ready: Optional[Callable[[], None]] = None):
+        """Starts loading chunks requested through `prefetch` on a background thread.
+
+        `on_ready` is called from the worker thread whenever results are waiting; the owner
+        should then call `install_prefetched` on the thread that uses the canvas.
+        """
+        if self.prefetcher: return
+        self.prefetcher = ChunkPrefetcher(self.db.db_path, self._decode_chunk, on_ready)
+        self.prefetcher.start()
+
+    def prefetch(self, cx0: int, cy0: int, cx1: int, cy1: int):
+        """Requests the inclusive chunk rectangle in the background; resident chunks are skipped."""
+        if not self.prefetcher: return
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > PREFETCH_MAX_CHUNKS: return
+        skip = frozenset(key for key in ((cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1))
+                         if key in self.chunks or key in self.empty_chunks)
+        self.prefetcher.request((cx0, cy0, cx1, cy1), skip, self._store_generation)
+
+    def install_prefetched(self) -> int:
+        """Adds finished prefetch results to the chunk cache and returns how many were new."""
+        if not self.prefetcher: return 0
+        installed = 0
+        for generation, loaded in self.prefetcher.take_results():
+            for key, chunk in loaded.items():
+                # A chunk written back after the request was read may be stale on the worker's side.
+                if key in self.chunks or key in self.empty_chunks or self._stored_at.get(key, 0) > generation: continue
+                if chunk is None: self._remember_empty(*key)
+                else: self.chunks.put(chunk)
+                installed += 1
+        return installed
+
+    def _store_chunk(self, chunk: Chunk):
+        self._store_generation += 1
+        self._stored_at[(chunk.cx, chunk.cy)] = self._store_generation
+        key = (chunk.cx, chunk.cy)
+        if chunk.is_empty:
+            self.db.delete_chunk(chunk.cx, chunk.cy)
+            self.db.delete_chunk_text(chunk.cx, chunk.cy)
+            self.db.delete_chunk_summary(chunk.cx, chunk.cy)
+            if self._summaries is not None: self._summaries.pop(key, None)
+        else:
+            # Owners of overwritten cells linger in the table until the chunk is written back.
+            nbytes = chunk.nbytes
+            chunk.compact_owners()
+            if chunk.nbytes != nbytes and key in self.chunks and self.chunks[key] is chunk: self.chunks.resized(nbytes, chunk.nbytes)
+            summary = chunk.summary()
+            self.db.put_chunk(chunk.cx, chunk.cy, chunk.serialize(self.db.compress))
+            self.db.put_chunk_text(chunk.cx, chunk.cy, chunk.text_rows())
+            self.db.put_chunk_summary(chunk.cx, chunk.cy, *summary)
+            if self._summaries is not None: self._summaries[key] = summary
+
+    def take_damage(self) -> List[List[int]]:
+        """Returns the half-open world rectangles written since the previous call and starts a new list.
+
+        Writes are only recorded once this has been called, so headless users pay nothing for it.
+        """
+        damage, self.damage = self.damage, []
+        return damage or []
+
+    def _add_damage(self, x0: int, y0: int, x1: int, y1: int):
+        # Runs of writes along a row or down a column grow the previous rectangle instead of adding one.
+        damage = self.damage
+        if damage:
+            last = damage[-1]
+            if last[1] == y0 and last[3] == y1 and x0 <= last[2] and x1 >= last[0]:
+                last[0], last[2] = min(last[0], x0), max(last[2], x1); return
+            if last[0] == x0 and last[2] == x1 and y0 <= last[3] and y1 >= last[1]:
+                last[1], last[3] = min(last[1], y0), max(last[3], y1); return
+        damage.append([x0, y0, x1, y1])
+        if len(damage) > DAMAGE_MAX_RECTS:
+            damage[:] = [[min(r[0] for r in damage), min(r[1] for r in damage), max(r[2] for r in damage), max(r[3] for r in damage)]]
+
     def set_cell(self, x: int, y: int, cell: Cell):
+        if self.damage is not None: self._add_damage(x, y, x + 1, y + 1)
         cx, cy = x // CHUNK_SIZE, y // CHUNK_SIZE
         chunk = self.get_chunk(cx, cy)
+        nbytes = chunk.nbytes
         chunk.set_cell(x % CHUNK_SIZE, y % CHUNK_SIZE, cell)
-        
+        if chunk.nbytes != nbytes: self.chunks.resized(nbytes, chunk.nbytes)
+
+    def _write_span(self, x: int, y: int, text: str, fg: Optional[int], bg: Optional[int], owner: Optional[str]):
+        # Split at chunk borders; blank segments over empty chunks are skipped.
+        if self.damage is not None: self._add_damage(x, y, x + len(text), y + 1)
+        blank = fg is None and bg is None and owner is None and text.count(' ') == len(text)
+        cy, ly = divmod(y, CHUNK_SIZE)
+        while text:
+            cx, lx = divmod(x, CHUNK_SIZE)
+            n = min(len(text), CHUNK_SIZE - lx)
+            if not blank or self.peek_chunk(cx, cy) is not None:
+                chunk = self.get_chunk(cx, cy)
+                nbytes = chunk.nbytes
+                chunk.write_row(lx, ly, text[:n], fg, bg, owner)
+                if chunk.nbytes != nbytes: self.chunks.resized(nbytes, chunk.nbytes)
+            x, text = x + n, text[n:]
+
+    def _occupied_spans(self, x: int, y: int, length: int) -> List[list]:
+        """Returns the non-blank cells of a row segment as `[x, y, text, fg, bg, owner]` spans."""
+        spans: List[list] = []
+        cy, ly = divmod(y, CHUNK_SIZE)
+        end = x + length
+        while x < end:
+            cx, lx0 = divmod(x, CHUNK_SIZE)
+            lx1 = min(CHUNK_SIZE, lx0 + end - x)
+            chunk = self.peek_chunk(cx, cy)
+            if chunk is not None and not chunk.row_is_empty(ly):
+                base = cx * CHUNK_SIZE
+                for lx in range(lx0, lx1):
+                    if not chunk.is_occupied(lx, ly): continue
+                    ch, fg, bg, owner = chunk.get_cell(lx, ly)
+                    last = spans[-1] if spans else None
+                    if last and last[0] + len(last[2]) == base + lx and last[3:] == [fg, bg, owner]: last[2] += ch
+                    else: spans.append([base + lx, y, ch, fg, bg, owner])
+            x = cx * CHUNK_SIZE + lx1
+        return spans
+
+    def _segments(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[Tuple[int, int, int, int, int, int]]:
+        # Splits the half-open rectangle into `(cx, cy, lx, ly, n, col)` row segments, chunk by chunk.
+        for cy in range(y0 // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE + 1):
+            ly0, ly1 = max(y0 - cy * CHUNK_SIZE, 0), min(y1 - cy * CHUNK_SIZE, CHUNK_SIZE)
+            for cx in range(x0 // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE + 1):
+                lx0, lx1 = max(x0 - cx * CHUNK_SIZE, 0), min(x1 - cx * CHUNK_SIZE, CHUNK_SIZE)
+                for ly in range(ly0, ly1): yield cx, cy, lx0, ly, lx1 - lx0, cx * CHUNK_SIZE + lx0 - x0
+
+    def _read_block(self, x0: int, y0: int, x1: int, y1: int, owners: Optional[set] = None) -> CellBlock:
+        """Copies the half-open rectangle; owners not in `owners` are dropped unless it is None."""
+        block = CellBlock(x1 - x0, y1 - y0)
+        owner_index: Dict[Optional[str], int] = {None: 0}
+        for cx, cy, lx, ly, n, col in self._segments(x0, y0, x1, y1):
+            chunk = self.peek_chunk(cx, cy)
+            if chunk is None or chunk.row_is_empty(ly): continue
+            bits, chars, fg, bg, owner_ids = chunk.read_segment(lx, ly, n)
+            if owner_ids is not None:
+                index = []
+                for owner in chunk.owners:
+                    if owners is not None and owner not in owners: owner = None
+                    if owner not in owner_index: owner_index[owner] = len(block.owners); block.owners.append(owner)
+                    index.append(owner_index[owner])
+                owner_ids = array('H', [index[i] for i in owner_ids])
+            block.put_segment(col, cy * CHUNK_SIZE + ly - y0, n, bits, chars, fg, bg, owner_ids)
+        return block
+
+    def _write_block(self, block: CellBlock, x: int, y: int):
+        """Overwrites the block's rectangle at (x, y) with its cells, blanks included."""
+        if self.damage is not None: self._add_damage(x, y, x + block.width, y + block.height)
+        index: Dict[Tuple[int, int], List[int]] = {}
+        for cx, cy, lx, ly, n, col in self._segments(x, y, x + block.width, y + block.height):
+            bits, chars, fg, bg, owner_ids = block.get_segment(col, cy * CHUNK_SIZE + ly - y, n)
+            chunk = self.peek_chunk(cx, cy)
+            if chunk is None:
+                if not bits: continue
+                chunk = self.get_chunk(cx, cy)
+            if owner_ids is not None:
+                if (cx, cy) not in index: index[(cx, cy)] = [0 if owner is None else chunk._intern_owner(owner) for owner in block.owners]
+                owner_ids = array('H', [index[(cx, cy)][i] for i in owner_ids])
+            nbytes = chunk.nbytes
+            chunk.write_segment(lx, ly, n, bits, chars, fg, bg, owner_ids)
+            if chunk.nbytes != nbytes: self.chunks.resized(nbytes, chunk.nbytes)
+
+    def _objects_inside(self, x0: int, y0: int, x1: int, y1: int) -> List[AsciiObject]:
+        return [obj for obj in self.objects_in_rect(x0, y0, x1 - 1, y1 - 1)
+                if all(x0 <= x < x1 and y0 <= y < y1 for x, y, _ in obj.render())]
+
+    def copy_region(self, x0: int, y0: int, x1: int, y1: int) -> CellBlock:
+        """Copies the half-open rectangle [x0, x1) x [y0, y1) together with the objects wholly inside it."""
+        objs = self._objects_inside(x0, y0, x1, y1)
+        block = self._read_block(x0, y0, x1, y1, {obj.id for obj in objs})
+        block.objects = [dict(obj.to_dict(), x=obj.x - x0, y=obj.y - y0) for obj in objs]
+        return block
+
+    def cut_region(self, x0: int, y0: int, x1: int, y1: int) -> CellBlock:
+        block = self.copy_region(x0, y0, x1, y1)
+        self.clear_region(x0, y0, x1, y1)
+        return block
+
+    def clear_region(self, x0: int, y0: int, x1: int, y1: int):
+        """Blanks the rectangle and deletes the objects wholly inside it, as one op."""
+        if x1 <= x0 or y1 <= y0: return
+        deleted = [obj.to_dict() for obj in self._objects_inside(x0, y0, x1, y1)]
+        self._blit([(x0, y0, CellBlock(x1 - x0, y1 - y0))], deleted, [])
+
+    def paste_region(self, block: CellBlock, x: int, y: int):
+        """Writes a copied block with its top-left corner at (x, y); its objects are created under new ids."""
+        block = block.with_owners({data['id']: str(uuid.uuid4()) for data in block.objects})
+        created = [dict(data, x=data['x'] + x, y=data['y'] + y) for data in block.objects]
+        self._blit([(x, y, block)], [], created)
+
+    def move_region(self, x0: int, y0: int, x1: int, y1: int, dx: int, dy: int):
+        """Moves the rectangle by (dx, dy) as one op; objects wholly inside move with it and keep their ids."""
+        if x1 <= x0 or y1 <= y0 or (dx, dy) == (0, 0): return
+        block = self.copy_region(x0, y0, x1, y1)
+        deleted = [dict(data, x=data['x'] + x0, y=data['y'] + y0) for data in block.objects]
+        created = [dict(data, x=data['x'] + dx, y=data['y'] + dy) for data in deleted]
+        self._blit([(x0, y0, CellBlock(x1 - x0, y1 - y0)), (x0 + dx, y0 + dy, block)], deleted, created)
+
+    def _blit(self, writes: List[Tuple[int, int, CellBlock]], deleted: List[Dict[str, Any]], created: List[Dict[str, Any]]):
+        # The previous content of every written rectangle is recorded so that the op can be undone.
+        old = [(x, y, self._read_block(x, y, x + block.width, y + block.height)) for x, y, block in writes]
+        # Blocks outlive a dictionary in the journal and undo history, so they are compressed without one.
+        pack = lambda blocks: [[x, y, block.width, block.height, block.serialize()] for x, y, block in blocks]
+        self.log_and_apply_operation({'type': 'BLIT', 'writes': pack(writes), 'old': pack(old), 'delete': deleted, 'create': created})
+
+    def draw_spans(self, spans: Iterable[Span]):
+        """Writes runs of styled text as one journaled op and one undo step."""
+        spans = [list(span) for span in spans]
+        if spans: self.log_and_apply_operation({'type': 'DRAW_SPANS', 'spans': spans})
+
+    def fill_rect(self, x0: int, y0: int, x1: int, y1: int, cell: Cell = BLANK_CELL):
+        """Fills the half-open rectangle [x0, x1) x [y0, y1) with `cell` as one journaled op."""
+        if x1 > x0 and y1 > y0: self.log_and_apply_operation({'type': 'FILL_RECT', 'rect': [x0, y0, x1, y1], 'cell': list(cell)})
+
     def log_and_apply_operation(self, op: Dict[str, Any]):
         if op['type'] == 'SET_CELL':
             # FIX: Convert dict_values to a list for serialization
+            op['new_cell'] = list(op['new_cell'])
             op['old_cell'] = list(self.get_cell(op['x'], op['y'])._asdict().values())
+        elif op['type'] == 'CREATE_OBJECT' and 'old_cells' not in op:
+            obj = object_from_dict(op['obj_data'])
+            if obj: op['old_cells'] = [[x, y, list(self.get_cell(x, y))] for x, y, _ in obj.render()]
+        elif op['type'] == 'DRAW_SPANS' and 'old_spans' not in op:
+            op['old_spans'] = [old for x, y, text, *_ in op['spans'] for old in self._occupied_spans(x, y, len(text))]
+        elif op['type'] == 'FILL_RECT' and 'old_spans' not in op:
+            x0, y0, x1, y1 = op['rect']
+            op['old_spans'] = [old for y in range(y0, y1) for old in self._occupied_spans(x0, y, x1 - x0)]
+        if self._batch_ops is not None:
+            self.apply_operation(op)
+            self._batch_ops.append(op)
+            return
         self._execute_and_log_op(op)
-        self.undo_stack.append(op)
-        self.redo_stack.clear()
+        self.history.record(op)
+
+    @contextmanager
+    def batch(self):
+        """Collects every op logged inside the block into one journal record and one undo step.
+
+        Ops are applied as they are logged, so reads inside the block see them. Nested blocks
+        join the outermost one.
+        """
+        if self._batch_ops is not None:
+            yield
+            return
+        self._batch_ops = []
+        try:
+            yield
+        finally:
+            ops, self._batch_ops = self._batch_ops, None
+            if ops:
+                op = ops[0] if len(ops) == 1 else {'type': 'BATCH', 'ops': ops}
+                self._log_op(op)
+                self.history.record(op)
+
+    def undo(self) -> bool:
+        """Reverts the newest undo group; returns False when there is nothing to undo."""
+        group = self.history.pop_undo()
+        if group is None: return False
+        self._execute_and_log_op({'type': 'UNDO', 'ops': group.inverse_ops()})
+        return True
+
+    def redo(self) -> bool:
+        """Re-applies the most recently undone group; returns False when there is none."""
+        group = self.history.pop_redo()
+        if group is None: return False
+        self._execute_and_log_op({'type': 'REDO', 'ops': group.forward_ops()})
+        return True
 
     def _execute_and_log_op(self, op: Dict[str, Any]):
         self.apply_operation(op)
-        packed_op = msgpack.packb(op, use_bin_type=True)
-        op_seq = self.db.append_journal_op(int(time.time()), packed_op)
-        if op_seq - self.last_checkpoint_seq >= CHECKPOINT_INTERVAL:
+        self._log_op(op)
+
+    def _log_op(self, op: Dict[str, Any]):
+        packed_op = self.op_codec.encode(op)
+        ts = int(time.time()) - self.journal_ts_base
+        if self.journal_writer: self.journal_writer.append(ts, packed_op)
+        else: self.db.append_journal_op(ts, packed_op)
+        self.ops_since_checkpoint += 1
+        if self.ops_since_checkpoint >= CHECKPOINT_INTERVAL:
             self.perform_checkpoint()
-            
+
     def create_object(self, obj: AsciiObject):
         self.objects[obj.id] = obj
         creation_op = {'type': 'CREATE_OBJECT', 'obj_data': obj.to_dict()}
-        self.log_and_apply_operation(creation_op)
-        for x, y, cell in obj.render():
-            op = {"type": "SET_CELL", "x": x, "y": y, "new_cell": list(cell._asdict().values())}
-            self.log_and_apply_operation(op)
-            
+        with self.batch():
+            self.log_and_apply_operation(creation_op)
+
+    def save_all_dirty_chunks(self):
+        """Writes dirty chunks and new or changed objects in one transaction."""
+        with self.db.transaction():
+            saved = self._write_dirty_state()
+        self._mark_clean(saved)
+
+    def _write_dirty_state(self) -> Tuple[List[Chunk], List[str]]:
+        chunks = [chunk for chunk in self.chunks.values() if chunk.dirty]
+        for chunk in chunks: self._store_chunk(chunk)
+        obj_ids = [obj_id for obj_id in self.dirty_objects if obj_id in self.objects]
+        for obj_id in obj_ids:
+            obj = self.objects[obj_id]
+            self.db.put_object(obj.id, obj.type, self._pack_object(obj, self.db.compress), obj.get_bounding_box())
+        for obj_id in self.deleted_objects: self.db.delete_object(obj_id)
+        return chunks, obj_ids
+
+    def _write_history(self):
+        # Undo groups built from the journal tail must be stored before the tail is truncated.
+        for group in self.history.unpersisted(): group.row_id = self.db.append_undo_group(group.pack())
+        for row_id in self.history.deleted: self.db.delete_undo_group(row_id)
+
+    def _mark_clean(self, saved: Tuple[List[Chunk], List[str]]):
+        chunks, obj_ids = saved
+        for chunk in chunks: chunk.dirty = False
+        self.dirty_objects.difference_update(obj_ids)
+        self.deleted_objects.clear()
+
+    @property
+    def journal_backlog(self) -> int:
+        """Ops queued for the background journal writer but not yet committed."""
+        return self.journal_writer.backlog if self.journal_writer else 0
+
+    def has_pending_changes(self) -> bool:
+        return (self.ops_since_checkpoint > 0 or bool(self.dirty_objects) or bool(self.deleted_objects)
+                or any(c.dirty for c in self.chunks.values()))
+
     def perform_checkpoint(self):
-        #...
-        pass
+        """Compacts the journal into the chunks and objects tables.
+
+        Only dirty chunks and new or changed objects are written. The chunk writes, the new
+        `last_checkpoint_seq` and the journal truncation share one transaction, so a crash
+        leaves either the old checkpoint plus the full journal or the new one.
+        """
+        if not self.has_pending_changes(): return
+        t0 = metrics.start()
+        seq = max(self.flush_journal(), self.last_checkpoint_seq)
+        self.history.seal()
+        with self.db.transaction():
+            saved = self._write_dirty_state()
+            self._write_history()
+            self.db.set_meta('last_checkpoint_seq', str(seq).encode())
+            self.db.truncate_journal_before(seq)
+            self._restart_journal_stream()
+        self._mark_clean(saved)
+        self.history.persisted()
+        self.last_checkpoint_seq = seq
+        self.ops_since_checkpoint = 0
+        metrics.stop('checkpoint', t0)
+        self._maybe_train_dictionary()
+
+    def _maybe_train_dictionary(self, wait: bool = False):
+        # Trained once per document on a background thread, so an idle checkpoint on the UI thread
+        # does not stall. A later checkpoint, or close, stores the result, and blobs adopt it as they
+        # are rewritten. When there is too little data, retry after the chunk count doubles.
+        if self.db.compressor.dict_id: return
+        if self._dict_trainer is None:
+            count = self.db.count_chunks()
+            if count < self.dict_train_threshold: return
+            self.dict_train_threshold = count * 2
+            self._dict_trainer = DictionaryTrainer(self.db.compressor, self.db.sample_chunk_payloads())
+            self._dict_trainer.start()
+        if wait: self._dict_trainer.join()
+        if self._dict_trainer.is_alive(): return
+        dictionary, self._dict_trainer = self._dict_trainer.dictionary, None
+        if dictionary: self.db.set_compression_dictionary(dictionary)
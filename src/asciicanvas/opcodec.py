@@ -0,0 +1,196 @@
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import msgpack
+
+FORMAT_VERSION = 2
+
+OP_SET_CELL = 0x01
+OP_SET_CELL_UNDOABLE = 0x02
+OP_BATCH = 0x03
+OP_UNDO = 0x04
+OP_REDO = 0x05
+OP_MSGPACK = 0x0F
+DEF_STYLE = 0x10
+DEF_OWNER = 0x11
+DEF_OWNER_UUID = 0x12
+
+_GROUP_OPCODES = {'BATCH': OP_BATCH, 'UNDO': OP_UNDO, 'REDO': OP_REDO}
+_GROUP_TYPES = {opcode: op_type for op_type, opcode in _GROUP_OPCODES.items()}
+_SET_CELL_KEYS = frozenset(('type', 'x', 'y', 'new_cell', 'old_cell'))
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+def _put_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _get_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    byte = data[pos]
+    if byte < 0x80: return byte, pos + 1
+    value, shift = byte & 0x7F, 7
+    while True:
+        pos += 1
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80: return value, pos + 1
+        shift += 7
+
+def _is_plain_cell(cell) -> bool:
+    if len(cell) != 4: return False
+    ch, fg, bg, owner = cell
+    return (type(ch) is str and len(ch) == 1 and (fg is None or type(fg) is int)
+            and (bg is None or type(bg) is int) and (owner is None or type(owner) is str))
+
+def _canonical_uuid(owner: str) -> Optional[uuid.UUID]:
+    try: value = uuid.UUID(owner)
+    except ValueError: return None
+    return value if str(value) == owner else None
+
+class OpCodec:
+    """Encodes journal ops into compact byte strings and decodes them back.
+
+    A row is a run of DEF records followed by one op, each starting with an opcode byte. Cell
+    edits store their position as zig-zag varint deltas from the previous edit and their cells
+    as a codepoint plus indexes into style and owner tables; a table entry is defined by a DEF
+    record in the first row that uses it. Ops without a compact form are embedded as msgpack.
+
+    The tables and the last position carry over from row to row, so a journal must be decoded
+    in order from its first row after a checkpoint, by the codec that will keep appending to it.
+    `reset` starts a new stream and is called whenever the journal is truncated.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.styles: List[Tuple[Optional[int], Optional[int]]] = [(None, None)]
+        self.owners: List[Optional[str]] = [None]
+        self._style_ids: Dict[Tuple[Optional[int], Optional[int]], int] = {(None, None): 0}
+        self._owner_ids: Dict[Optional[str], int] = {None: 0}
+        self.x = self.y = 0
+
+    def encode(self, op: Dict[str, Any]) -> bytes:
+        defs, body = bytearray(), bytearray()
+        self._encode_op(op, defs, body)
+        return bytes(defs + body)
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        pos = 0
+        while data[pos] >= DEF_STYLE: pos = self._decode_def(data, pos)
+        op, _ = self._decode_op(data, pos)
+        return op
+
+    def _encode_op(self, op: Dict[str, Any], defs: bytearray, body: bytearray):
+        op_type = op.get('type')
+        if op_type == 'SET_CELL' and op.keys() <= _SET_CELL_KEYS and type(op['x']) is int and type(op['y']) is int \
+                and _is_plain_cell(op['new_cell']) and ('old_cell' not in op or _is_plain_cell(op['old_cell'])):
+            x, y = op['x'], op['y']
+            body.append(OP_SET_CELL_UNDOABLE if 'old_cell' in op else OP_SET_CELL)
+            _put_varint(body, _zigzag(x - self.x)); _put_varint(body, _zigzag(y - self.y))
+            self.x, self.y = x, y
+            self._encode_cell(op['new_cell'], defs, body)
+            if 'old_cell' in op: self._encode_cell(op['old_cell'], defs, body)
+        elif op_type in _GROUP_OPCODES and op.keys() == {'type', 'ops'}:
+            body.append(_GROUP_OPCODES[op_type])
+            _put_varint(body, len(op['ops']))
+            for sub_op in op['ops']: self._encode_op(sub_op, defs, body)
+        else:
+            packed = msgpack.packb(op, use_bin_type=True)
+            body.append(OP_MSGPACK)
+            _put_varint(body, len(packed))
+            body += packed
+
+    def _encode_cell(self, cell, defs: bytearray, body: bytearray):
+        ch, fg, bg, owner = cell
+        _put_varint(body, ord(ch))
+        style_id = self._style_ids.get((fg, bg))
+        if style_id is None:
+            style_id = self._style_ids[(fg, bg)] = len(self.styles)
+            self.styles.append((fg, bg))
+            defs.append(DEF_STYLE)
+            defs.append((fg is not None) | (bg is not None) << 1)
+            if fg is not None: _put_varint(defs, _zigzag(fg))
+            if bg is not None: _put_varint(defs, _zigzag(bg))
+        _put_varint(body, style_id)
+        owner_id = self._owner_ids.get(owner)
+        if owner_id is None:
+            owner_id = self._owner_ids[owner] = len(self.owners)
+            self.owners.append(owner)
+            value = _canonical_uuid(owner)
+            if value is not None:
+                defs.append(DEF_OWNER_UUID)
+                defs += value.bytes
+            else:
+                encoded = owner.encode('utf-8')
+                defs.append(DEF_OWNER)
+                _put_varint(defs, len(encoded))
+                defs += encoded
+        _put_varint(body, owner_id)
+
+    def _decode_def(self, data: bytes, pos: int) -> int:
+        kind = data[pos]
+        pos += 1
+        if kind == DEF_STYLE:
+            flags, fg, bg = data[pos], None, None
+            pos += 1
+            if flags & 1: value, pos = _get_varint(data, pos); fg = _unzigzag(value)
+            if flags & 2: value, pos = _get_varint(data, pos); bg = _unzigzag(value)
+            self._style_ids[(fg, bg)] = len(self.styles)
+            self.styles.append((fg, bg))
+            return pos
+        if kind == DEF_OWNER_UUID:
+            owner = str(uuid.UUID(bytes=bytes(data[pos:pos + 16])))
+            pos += 16
+        elif kind == DEF_OWNER:
+            length, pos = _get_varint(data, pos)
+            owner = bytes(data[pos:pos + length]).decode('utf-8')
+            pos += length
+        else:
+            raise ValueError(f"Unknown journal record type 0x{kind:02x}")
+        self._owner_ids[owner] = len(self.owners)
+        self.owners.append(owner)
+        return pos
+
+    def _decode_op(self, data: bytes, pos: int) -> Tuple[Dict[str, Any], int]:
+        opcode = data[pos]
+        pos += 1
+        if opcode == OP_SET_CELL or opcode == OP_SET_CELL_UNDOABLE:
+            dx, dy = data[pos:pos + 2]
+            if dx < 0x80 and dy < 0x80: pos += 2
+            else:
+                dx, pos = _get_varint(data, pos)
+                dy, pos = _get_varint(data, pos)
+            self.x += _unzigzag(dx); self.y += _unzigzag(dy)
+            op = {'type': 'SET_CELL', 'x': self.x, 'y': self.y}
+            op['new_cell'], pos = self._decode_cell(data, pos)
+            if opcode == OP_SET_CELL_UNDOABLE: op['old_cell'], pos = self._decode_cell(data, pos)
+            return op, pos
+        if opcode in _GROUP_TYPES:
+            count, pos = _get_varint(data, pos)
+            ops = []
+            for _ in range(count):
+                sub_op, pos = self._decode_op(data, pos)
+                ops.append(sub_op)
+            return {'type': _GROUP_TYPES[opcode], 'ops': ops}, pos
+        if opcode == OP_MSGPACK:
+            length, pos = _get_varint(data, pos)
+            return msgpack.unpackb(data[pos:pos + length], raw=False), pos + length
+        raise ValueError(f"Unknown journal opcode 0x{opcode:02x}")
+
+    def _decode_cell(self, data: bytes, pos: int) -> Tuple[list, int]:
+        codepoint, style_id, owner_id = data[pos:pos + 3]
+        if codepoint < 0x80 and style_id < 0x80 and owner_id < 0x80:
+            # ASCII with fewer than 128 styles and owners: three single-byte varints.
+            pos += 3
+        else:
+            codepoint, pos = _get_varint(data, pos)
+            style_id, pos = _get_varint(data, pos)
+            owner_id, pos = _get_varint(data, pos)
+        fg, bg = self.styles[style_id]
+        return [chr(codepoint), fg, bg, self.owners[owner_id]], pos
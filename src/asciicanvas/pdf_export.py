@@ -1,45 +1,88 @@
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import count, islice
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+
 from reportlab.pdfgen import canvas as reportlab_canvas
 from reportlab.lib import pagesizes
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-
-from .model import Canvas, PageFrame
-
-def export_to_pdf(canvas: Canvas, output_path: str):
-    """Exports the content of all page frames to a PDF."""
-    
-    # In a real app, the font would be bundled. For now, assume it's available.
-    # pdfmetrics.registerFont(TTFont('DejaVuSansMono', 'path/to/font.ttf'))
-
-    c = reportlab_canvas.Canvas(output_path, pagesize=pagesizes.a4)
-    width, height = pagesizes.a4
-
-    page_frames = sorted(
-        [obj for obj in canvas.objects.values() if isinstance(obj, PageFrame)],
-        key=lambda p: (p.y, p.x)
-    )
-
-    for frame in page_frames:
-        # This is a simplified rendering. A real implementation would need
-        # to calculate cell size and handle colors.
-        char_width = 6
-        char_height = 12
-        
-        y_pos = height - 50 # Start from top
-        
-        for r in range(frame.height):
-            text_line = ""
-            for col in range(frame.width):
-                cell = canvas.get_cell(frame.x + col, frame.y + r)
-                text_line += cell.ch
-            
-            c.drawString(50, y_pos, text_line)
-            y_pos -= char_height
-            
-            if y_pos <= 50:
-                c.showPage()
-                y_pos = height - 50
-
-        c.showPage()
+from pypdf import PdfWriter
+
+from .model import CHUNK_SIZE, Canvas, PageFrame
+
+CHAR_HEIGHT = 12
+MARGIN = 50
+FRAMES_PER_PART = 16
+
+ProgressCallback = Callable[[int, int], None]
+
+def _draw_frame(c: reportlab_canvas.Canvas, rows: List[str]):
+    height = pagesizes.A4[1]
+    y_pos = height - MARGIN
+    for text in rows:
+        c.drawString(MARGIN, y_pos, text)
+        y_pos -= CHAR_HEIGHT
+        if y_pos <= MARGIN:
+            c.showPage()
+            y_pos = height - MARGIN
+    c.showPage()
 
+def render_frames(frames: Iterable[List[str]], output_path: str):
+    """Writes the rows of each frame to `output_path`, starting a new PDF page for every frame."""
+    c = reportlab_canvas.Canvas(output_path, pagesize=pagesizes.A4)
+    for rows in frames: _draw_frame(c, rows)
     c.save()
+
+def iter_frame_rows(canvas: Canvas, frames: Iterable[PageFrame]) -> Iterator[List[str]]:
+    """Yields the row texts of each frame, reading its chunks in one query and releasing them after."""
+    for frame in frames:
+        x0, y0, x1, y1 = frame.x, frame.y, frame.x + frame.width, frame.y + frame.height
+        with canvas.transient_chunks():
+            canvas.load_chunks(x0 // CHUNK_SIZE, y0 // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE)
+            rows = [row.text.rstrip() for row in canvas.get_region(x0, y0, x1, y1)]
+        yield rows
+
+def _report(frames: Iterator[List[str]], total: int, progress: Optional[ProgressCallback]) -> Iterator[List[str]]:
+    for done, rows in enumerate(frames, 1):
+        yield rows
+        if progress: progress(done, total)
+
+def export_to_pdf(canvas: Canvas, output_path: str, progress: Optional[ProgressCallback] = None, workers: Optional[int] = None):
+    """Exports the content of all page frames to a PDF, one frame at a time.
+
+    With more than FRAMES_PER_PART frames and several workers, groups of frames are rendered to
+    partial PDFs in a process pool and merged with pypdf; otherwise frames are rendered in this process.
+    Either way only one frame's chunks are loaded at a time. `progress(done, total)` is called
+    after each frame (serial) or each finished group (parallel).
+    """
+    frames = sorted(canvas.iter_objects(PageFrame.__name__), key=lambda p: (p.y, p.x))
+    if workers is None: workers = os.cpu_count() or 1
+    rows = iter_frame_rows(canvas, frames)
+    if workers <= 1 or len(frames) <= FRAMES_PER_PART:
+        render_frames(_report(rows, len(frames), progress), output_path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        parts: List[str] = []
+        pending: Deque[Tuple[Future, int]] = deque()
+        done = 0
+        def finish_oldest():
+            nonlocal done
+            future, frame_count = pending.popleft()
+            future.result()
+            done += frame_count
+            if progress: progress(done, len(frames))
+        for index in count():
+            group = list(islice(rows, FRAMES_PER_PART))
+            if not group: break
+            parts.append(os.path.join(tmp, f"part{index:05}.pdf"))
+            pending.append((pool.submit(render_frames, group, parts[-1]), len(group)))
+            # Bound the rows waiting in the pool instead of reading the whole document ahead.
+            if len(pending) >= 2 * workers: finish_oldest()
+        while pending: finish_oldest()
+        writer = PdfWriter()
+        for part in parts: writer.append(part)
+        with open(output_path, 'wb') as f: writer.write(f)
@@ -0,0 +1,71 @@
+import threading
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from .database import Database
+
+ChunkKey = Tuple[int, int]
+
+class ChunkPrefetcher:
+    """Loads and decodes chunks on a worker thread ahead of the viewport.
+
+    The worker owns a read-only connection and fetches each requested rectangle with one
+    `Database.get_chunks_in_rect` query. Only the latest request is kept: when the viewport
+    moves faster than the worker, stale rectangles are skipped. Results are collected with
+    `take_results` on the UI thread, after `on_ready` signals that some are waiting.
+    """
+    def __init__(self, db_path: str, decode: Callable[[int, int, bytes], object], on_ready: Optional[Callable[[], None]] = None):
+        self.db_path = db_path
+        self._decode, self._on_ready = decode, on_ready
+        self._lock = threading.Condition()
+        self._request: Optional[Tuple[Tuple[int, int, int, int], FrozenSet[ChunkKey], int]] = None
+        self._results: List[Tuple[int, Dict[ChunkKey, object]]] = []
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread: return
+        self._thread = threading.Thread(target=self._run, name="chunk-prefetch", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if not self._thread: return
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        self._thread.join()
+        self._thread = None
+
+    def request(self, rect: Tuple[int, int, int, int], skip: FrozenSet[ChunkKey], generation: int):
+        """Asks for the inclusive chunk rectangle `rect`, except the chunks in `skip`."""
+        with self._lock:
+            self._request = (rect, skip, generation)
+            self._lock.notify()
+
+    def take_results(self) -> List[Tuple[int, Dict[ChunkKey, object]]]:
+        """Returns `(generation, {(cx, cy): chunk or None})` batches; None marks an empty chunk."""
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def _run(self):
+        db = Database(self.db_path)
+        db.connect(read_only=True)
+        try:
+            while True:
+                with self._lock:
+                    while self._request is None and not self._stopped: self._lock.wait()
+                    if self._stopped: return
+                    (cx0, cy0, cx1, cy1), skip, generation = self._request
+                    self._request = None
+                loaded: Dict[ChunkKey, object] = {(cx, cy): None for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1) if (cx, cy) not in skip}
+                if not loaded: continue
+                for cx, cy, data in db.get_chunks_in_rect(cx0, cy0, cx1, cy1):
+                    if (cx, cy) not in loaded: continue
+                    try: loaded[(cx, cy)] = self._decode(cx, cy, data)
+                    # Leave undecodable chunks to the synchronous path, which reports the error.
+                    except Exception: del loaded[(cx, cy)]
+                with self._lock:
+                    self._results.append((generation, loaded))
+                if self._on_ready: self._on_ready()
+        finally:
+            db.close()
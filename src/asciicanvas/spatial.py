@@ -0,0 +1,70 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+BBox = Tuple[int, int, int, int]
+
+def _intersects(bbox: BBox, x0: int, y0: int, x1: int, y1: int) -> bool:
+    bx0, by0, bx1, by1 = bbox
+    return min(bx0, bx1) <= x1 and max(bx0, bx1) >= x0 and min(by0, by1) <= y1 and max(by0, by1) >= y0
+
+class SpatialIndex:
+    """Uniform grid index over inclusive bounding boxes.
+
+    Each id is registered in every `cell_size` x `cell_size` grid cell its box touches, so
+    point and rectangle queries only look at the ids near the queried area.
+    """
+    def __init__(self, cell_size: int = 128):
+        self.cell_size = cell_size
+        self._grid: Dict[Tuple[int, int], Set[str]] = {}
+        self._entries: Dict[str, Tuple[str, BBox]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._entries
+
+    def _cells(self, bbox: BBox) -> Iterator[Tuple[int, int]]:
+        x0, y0, x1, y1 = bbox
+        size = self.cell_size
+        for gy in range(min(y0, y1) // size, max(y0, y1) // size + 1):
+            for gx in range(min(x0, x1) // size, max(x0, x1) // size + 1):
+                yield gx, gy
+
+    def insert(self, item_id: str, item_type: str, bbox: BBox):
+        if item_id in self._entries: self.remove(item_id)
+        self._entries[item_id] = (item_type, bbox)
+        for cell in self._cells(bbox): self._grid.setdefault(cell, set()).add(item_id)
+
+    def remove(self, item_id: str):
+        entry = self._entries.pop(item_id, None)
+        if entry is None: return
+        for cell in self._cells(entry[1]):
+            ids = self._grid.get(cell)
+            if ids is None: continue
+            ids.discard(item_id)
+            if not ids: del self._grid[cell]
+
+    def bbox(self, item_id: str) -> Optional[BBox]:
+        entry = self._entries.get(item_id)
+        return entry[1] if entry else None
+
+    def query_rect(self, x0: int, y0: int, x1: int, y1: int) -> List[str]:
+        """Returns the ids whose boxes intersect the inclusive rectangle, in no particular order."""
+        found: Set[str] = set()
+        size = self.cell_size
+        grid_cells = (abs(x1 - x0) // size + 2) * (abs(y1 - y0) // size + 2)
+        if grid_cells > len(self._entries):
+            # Scanning every entry is cheaper than walking a rectangle larger than the index.
+            return [item_id for item_id, (_, bbox) in self._entries.items() if _intersects(bbox, x0, y0, x1, y1)]
+        for cell in self._cells((x0, y0, x1, y1)):
+            for item_id in self._grid.get(cell, ()):
+                if item_id not in found and _intersects(self._entries[item_id][1], x0, y0, x1, y1): found.add(item_id)
+        return list(found)
+
+    def query_point(self, x: int, y: int) -> List[str]:
+        return self.query_rect(x, y, x, y)
+
+    def ids_of_type(self, item_type: Optional[str] = None) -> List[str]:
+        """Returns the ids registered with `item_type`, or every id when it is None."""
+        if item_type is None: return list(self._entries)
+        return [item_id for item_id, (entry_type, _) in self._entries.items() if entry_type == item_type]
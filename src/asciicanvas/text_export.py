@@ -0,0 +1,76 @@
+import html
+from typing import Iterator, Optional, TextIO, Tuple
+
+from .model import CHUNK_SIZE, Canvas, RegionRow
+
+# The editor's palette (ui.COLORS_DARK) without importing Qt.
+PALETTE = {1: (135, 206, 250), 2: (144, 238, 144), 3: (255, 255, 224), 4: (255, 182, 193), 5: (221, 160, 221)}
+
+def content_bounds(canvas: Canvas) -> Optional[Tuple[int, int, int, int]]:
+    """Returns the inclusive chunk range holding content, from the stored and the resident chunks."""
+    bounds = canvas.db.get_chunk_bounds()
+    for chunk in canvas.chunks.values():
+        if chunk.is_empty: continue
+        if bounds is None: bounds = (chunk.cx, chunk.cy, chunk.cx, chunk.cy)
+        else: bounds = (min(bounds[0], chunk.cx), min(bounds[1], chunk.cy), max(bounds[2], chunk.cx), max(bounds[3], chunk.cy))
+    return bounds
+
+def iter_rows(canvas: Canvas) -> Iterator[Tuple[int, RegionRow]]:
+    """Yields `(x0, row)` for every row of the content, one band of chunks at a time.
+
+    Each band is read with one query and released before the next, so memory is bounded by the
+    width of the document rather than its size. Leading and trailing blank rows are dropped.
+    """
+    bounds = content_bounds(canvas)
+    if bounds is None: return
+    cx0, cy0, cx1, cy1 = bounds
+    x0, x1 = cx0 * CHUNK_SIZE, (cx1 + 1) * CHUNK_SIZE
+    started, blank_rows = False, 0
+    for cy in range(cy0, cy1 + 1):
+        with canvas.transient_chunks():
+            canvas.load_chunks(cx0, cy, cx1, cy)
+            band = canvas.get_region(x0, cy * CHUNK_SIZE, x1, (cy + 1) * CHUNK_SIZE)
+        for row in band:
+            if not row.text.strip() and len(row.runs) == 1 and row.runs[0][2:] == (None, None):
+                blank_rows += started
+                continue
+            for _ in range(blank_rows): yield x0, RegionRow('', [])
+            started, blank_rows = True, 0
+            yield x0, row
+
+def _styled_segments(x0: int, row: RegionRow) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+    text = row.text.rstrip()
+    for start, end, fg, bg in row.runs:
+        if bg is None: end = min(end, x0 + len(text))
+        if start - x0 >= len(row.text) or end <= start: continue
+        yield row.text[start - x0:end - x0], fg, bg
+
+def write_text(canvas: Canvas, out: TextIO):
+    for _, row in iter_rows(canvas): out.write(row.text.rstrip() + '\n')
+
+def _sgr(fg: Optional[int], bg: Optional[int]) -> str:
+    codes = ['0']
+    if fg in PALETTE: codes.append('38;2;%d;%d;%d' % PALETTE[fg])
+    if bg in PALETTE: codes.append('48;2;%d;%d;%d' % PALETTE[bg])
+    return '\x1b[' + ';'.join(codes) + 'm'
+
+def write_ansi(canvas: Canvas, out: TextIO):
+    for x0, row in iter_rows(canvas):
+        parts = []
+        for text, fg, bg in _styled_segments(x0, row):
+            parts.append(text if fg is None and bg is None else _sgr(fg, bg) + text + '\x1b[0m')
+        out.write(''.join(parts) + '\n')
+
+def write_html(canvas: Canvas, out: TextIO, title: str = 'AsciiCanvas'):
+    out.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title><style>\n')
+    out.write('body { background: #1e1e1e; color: #dcdcdc; }\n')
+    for index, rgb in PALETTE.items():
+        out.write('.f%d { color: rgb%s; } .b%d { background: rgb%s; }\n' % (index, rgb, index, rgb))
+    out.write('</style></head><body><pre>\n')
+    for x0, row in iter_rows(canvas):
+        parts = []
+        for text, fg, bg in _styled_segments(x0, row):
+            classes = ' '.join(f'{prefix}{color}' for prefix, color in (('f', fg), ('b', bg)) if color in PALETTE)
+            parts.append(f'<span class="{classes}">{html.escape(text)}</span>' if classes else html.escape(text))
+        out.write(''.join(parts) + '\n')
+    out.write('</pre></body></html>\n')
@@ -3,14 +3,15 @@ import json
 import os
 import time
 import math
+from collections import OrderedDict, deque
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QStatusBar, QVBoxLayout, 
                                QHBoxLayout, QListWidget, QSplitter, QFrame, QLineEdit, QLabel, QDialog,
-                               QFileDialog, QPushButton, QStackedWidget, QListWidgetItem, QInputDialog)
-from PySide6.QtGui import (QPainter, QColor, QFont, QAction, QFontDatabase, QFontMetrics, QPen)
-from PySide6.QtCore import Qt, QRect, QPoint, Signal, QTimer, QPointF, QRectF
+                               QFileDialog, QPushButton, QStackedWidget, QListWidgetItem, QInputDialog, QProgressDialog)
+from PySide6.QtGui import (QPainter, QColor, QFont, QAction, QFontDatabase, QFontMetrics, QPen, QPixmap, QImage)
+from PySide6.QtCore import Qt, QObject, QRect, QPoint, Signal, QTimer, QPointF, QRectF
 
-from . import config
-from .model import Canvas, Cell, CHUNK_SIZE, Table, Math, PageFrame
+from . import config, metrics
+from .model import Canvas, Cell, Chunk, CHUNK_AREA, CHUNK_SIZE, NO_COLOR, PREFETCH_MAX_CHUNKS, SUMMARY_GRID, Table, Math, PageFrame
 from .drawing_utils import get_line_cells, get_rect_cells
 from .pdf_export import export_to_pdf
 
@@ -20,6 +21,51 @@ COLORS_DARK = {
     4: QColor(255, 182, 193), 5: QColor(221, 160, 221),
 }
 BASE_FONT_SIZE = 15
+TILE_CELLS = 32
+TILE_CACHE_BYTES = 96 * 1024 * 1024
+LOD_ZOOM = 0.34
+LOD_CACHE_BYTES = 48 * 1024 * 1024
+LOD_LEVELS = CHUNK_SIZE.bit_length()
+# LOD palette indexes: 0 empty, 1 default text, then one per foreground and one per background
+# color. Color indexes are odd, so OR-ing them over the 0/1 occupancy bytes keeps the color.
+LOD_FG_BASE, LOD_BG_BASE, LOD_COLORS = 3, 15, 6
+LOD_PREFETCH_SPAN = 8
+_BIT_BYTES = [bytes((b >> i) & 1 for i in range(8)) for b in range(256)]
+_LOW_BYTES = slice(0, None, 2) if sys.byteorder == 'little' else slice(1, None, 2)
+_OCCUPIED_MASK = bytes([0, 0xFF]) + bytes(254)
+_NONZERO_MASK = bytes([0]) + b'\xff' * 255
+
+def _lod_color_table() -> list:
+    shade = lambda color, alpha: QColor(color.red(), color.green(), color.blue(), alpha).rgba()
+    table = [0] * (LOD_BG_BASE + 2 * LOD_COLORS)
+    table[1] = shade(COLORS_DARK['default_fg'], 110)
+    for key in range(LOD_COLORS):
+        color = COLORS_DARK.get(key, COLORS_DARK['default_fg'])
+        table[LOD_FG_BASE + 2 * key], table[LOD_BG_BASE + 2 * key] = shade(color, 150), shade(color, 255)
+    return table
+LOD_COLOR_TABLE = _lod_color_table()
+# Map the low byte of a color plane entry to a palette index: NO_COLOR (0xFF) to 0, unknown colors to 1.
+_LOD_FG_INDEXES, _LOD_BG_INDEXES = (bytes(base + 2 * v if v < LOD_COLORS else 0 if v == NO_COLOR & 0xFF else 1 for v in range(256))
+                                    for base in (LOD_FG_BASE, LOD_BG_BASE))
+
+def lod_base_image(chunk: Chunk) -> QImage:
+    """Returns one pixel per cell of `chunk`: its background color, else a dimmed text color, else transparent.
+
+    The palette indexes are built a whole plane at a time with `bytes.translate` and big-integer
+    bit operations, one byte per cell, rather than cell by cell.
+    """
+    occupied = b''.join(_BIT_BYTES[b] for b in chunk.occupancy)
+    indexes, mask = int.from_bytes(occupied, 'little'), int.from_bytes(occupied.translate(_OCCUPIED_MASK), 'little')
+    planes = [plane.tobytes()[_LOW_BYTES].translate(table) if plane is not None else None
+              for plane, table in ((chunk.bg, _LOD_BG_INDEXES), (chunk.fg, _LOD_FG_INDEXES))]
+    if planes[0] is not None:
+        bg = int.from_bytes(planes[0], 'little') & mask
+        indexes |= bg
+        mask &= ~int.from_bytes(planes[0].translate(_NONZERO_MASK), 'little')
+    if planes[1] is not None: indexes |= int.from_bytes(planes[1], 'little') & mask
+    image = QImage(indexes.to_bytes(CHUNK_AREA, 'little'), CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE, QImage.Format_Indexed8)
+    image.setColorTable(LOD_COLOR_TABLE)
+    return image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
 
 def get_font():
     font_path = os.path.join(os.path.dirname(__file__), 'resources', 'DejaVuSansMono.ttf')
@@ -68,25 +114,177 @@ class WelcomeWidget(QWidget):
             if fname.endswith('.asciicanvas'): self.file_list.addItem(QListWidgetItem(fname))
     def on_file_selected(self, item): self.file_selected.emit(item.text())
 
+class TileCache:
+    """LRU cache of rasterized pieces of the canvas: TILE_CELLS x TILE_CELLS tiles, or LOD images.
+
+    Entries are keyed by position and zoom or detail level and remember the version of the chunk
+    they were drawn from; an entry whose chunk has changed since is treated as a miss.
+    """
+    def __init__(self, budget_bytes: int = TILE_CACHE_BYTES):
+        self.budget_bytes, self.nbytes = budget_bytes, 0
+        self._tiles: OrderedDict = OrderedDict()
+    def __len__(self): return len(self._tiles)
+    def get(self, key, version):
+        entry = self._tiles.get(key)
+        if entry is None or entry[0] != version: return None
+        self._tiles.move_to_end(key)
+        return entry[1]
+    def put(self, key, version, pixmap):
+        old = self._tiles.pop(key, None)
+        if old is not None: self.nbytes -= self._size(old[1])
+        self._tiles[key] = (version, pixmap)
+        self.nbytes += self._size(pixmap)
+        while self.nbytes > self.budget_bytes and len(self._tiles) > 1:
+            _, (_, evicted) = self._tiles.popitem(last=False)
+            self.nbytes -= self._size(evicted)
+    def clear(self):
+        self._tiles.clear(); self.nbytes = 0
+    @staticmethod
+    def _size(pixmap) -> int: return pixmap.width() * pixmap.height() * 4
+
+class FrameScheduler:
+    """Runs `callback` at most once per `interval_ms`, however often `request` is called.
+
+    A request after a quiet spell runs on the next pass of the event loop; requests arriving sooner
+    wait out the rest of the interval and share one run. No timer is armed until something asks.
+    """
+    def __init__(self, parent: QObject, callback, interval_ms: float):
+        self.callback, self.interval_ms = callback, interval_ms
+        self.timer = QTimer(parent)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.run)
+        self.last_run, self.runs = 0.0, 0
+    def request(self):
+        if self.timer.isActive(): return
+        self.timer.start(max(0, math.ceil(self.interval_ms - (time.monotonic() - self.last_run) * 1000)))
+    def flush(self):
+        """Runs a pending request now."""
+        if self.timer.isActive(): self.run()
+    def run(self):
+        self.timer.stop()
+        self.last_run, self.runs = time.monotonic(), self.runs + 1
+        metrics.count('ui.wakeup')
+        self.callback()
+
+class MinimapWidget(QWidget):
+    """Overview of the whole document drawn from `Canvas.chunk_summaries`, never from chunk blobs.
+
+    Each chunk is a block shaded by its density, or its coarse occupancy bitmap once blocks are
+    large enough. The raster is rebuilt only when the summaries or the layout change. Clicking or
+    dragging jumps the canvas view there.
+    """
+    SIZE, MARGIN, DETAIL_PX = 220, 12, 16
+    def __init__(self, canvas_widget: 'CanvasWidget'):
+        super().__init__(canvas_widget)
+        self.canvas_widget = canvas_widget
+        self.resize(self.SIZE, self.SIZE)
+        self.setCursor(Qt.PointingHandCursor)
+        self.summaries, self.bounds, self.version = {}, None, None
+        self.layout_key, self.pixmap = None, None
+    def compute_layout(self):
+        """Returns `(cx0, cy0, scale, ox, oy)` fitting the document and the viewport, in pixels per chunk."""
+        view = self.canvas_widget.view_chunk_rect()
+        cx0, cy0, cx1, cy1 = view if self.bounds is None else (min(view[0], self.bounds[0]), min(view[1], self.bounds[1]),
+                                                               max(view[2], self.bounds[2]), max(view[3], self.bounds[3]))
+        inner = self.SIZE - 8
+        scale = min(inner / (cx1 - cx0 + 1), inner / (cy1 - cy0 + 1))
+        return cx0, cy0, scale, 4 + (inner - (cx1 - cx0 + 1) * scale) / 2, 4 + (inner - (cy1 - cy0 + 1) * scale) / 2
+    def refresh(self):
+        canvas = self.canvas_widget.canvas
+        if canvas.summary_version == self.version: return
+        self.version, self.summaries = canvas.summary_version, canvas.chunk_summaries()
+        keys = self.summaries.keys()
+        self.bounds = (min(k[0] for k in keys), min(k[1] for k in keys), max(k[0] for k in keys), max(k[1] for k in keys)) if keys else None
+        self.layout_key = None
+    def render_summaries(self, layout) -> QPixmap:
+        cx0, cy0, scale, ox, oy = layout
+        pixmap = QPixmap(self.size())
+        pixmap.fill(QColor(20, 20, 20, 220))
+        painter = QPainter(pixmap)
+        detail, sub = scale >= self.DETAIL_PX, scale / SUMMARY_GRID
+        for (cx, cy), (count, bitmap) in self.summaries.items():
+            level = 70 + int(185 * min(1.0, (count / CHUNK_AREA) ** 0.5))
+            color = QColor(level // 2, level, level // 2)
+            x, y = ox + (cx - cx0) * scale, oy + (cy - cy0) * scale
+            if not detail:
+                painter.fillRect(QRectF(x, y, max(scale, 1.0), max(scale, 1.0)), color)
+                continue
+            bits = int.from_bytes(bitmap, 'little')
+            for i in range(SUMMARY_GRID * SUMMARY_GRID):
+                if bits >> i & 1: painter.fillRect(QRectF(x + (i % SUMMARY_GRID) * sub, y + (i // SUMMARY_GRID) * sub, sub, sub), color)
+        painter.end()
+        return pixmap
+    def paintEvent(self, event):
+        self.refresh()
+        layout = self.compute_layout()
+        if layout != self.layout_key: self.layout_key, self.pixmap = layout, self.render_summaries(layout)
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.pixmap)
+        cx0, cy0, scale, ox, oy = layout
+        widget = self.canvas_widget
+        cell_w, cell_h = widget.get_zoomed_cell_size()
+        px = scale / CHUNK_SIZE
+        painter.setPen(QColor(255, 215, 0))
+        painter.drawRect(QRectF(ox + (widget.vx - cx0 * CHUNK_SIZE) * px, oy + (widget.vy - cy0 * CHUNK_SIZE) * px,
+                                widget.width() / cell_w * px, widget.height() / cell_h * px))
+    def mousePressEvent(self, event): self.jump(event.position())
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton: self.jump(event.position())
+    def jump(self, pos: QPointF):
+        cx0, cy0, scale, ox, oy = self.layout_key or self.compute_layout()
+        self.canvas_widget.jump_to(cx0 * CHUNK_SIZE + (pos.x() - ox) / scale * CHUNK_SIZE, cy0 * CHUNK_SIZE + (pos.y() - oy) / scale * CHUNK_SIZE)
+
 class CanvasWidget(QWidget):
     update_signal = Signal()
+    prefetch_ready = Signal()
     REPEAT_DELAY_MS, REPEAT_INTERVAL_MS, SCROLL_MARGIN = 180, 16, 5
-    ZOOM_STEPS = [0.2, 0.25, 0.33, 0.4, 0.5, 0.67, 0.8, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0]
+    STATUS_INTERVAL_MS = 100
+    IDLE_CHECKPOINT_MS = 3000
+    PREFETCH_LOOKAHEAD_S = 0.3
+    ZOOM_STEPS = [0.05, 0.1, 0.2, 0.25, 0.33, 0.4, 0.5, 0.67, 0.8, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0]
     MOVEMENT_KEYS = {Qt.Key_Up, Qt.Key_Down, Qt.Key_Left, Qt.Key_Right, Qt.Key_H, Qt.Key_J, Qt.Key_K, Qt.Key_L}
     def __init__(self, canvas: Canvas, status_bar: QStatusBar, parent=None):
         super().__init__(parent)
         self.canvas, self.status_bar = canvas, status_bar
         self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+        # paintEvent fills every rectangle it is asked for, which also lets QWidget.scroll blit.
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
         self.base_font = get_font()
         self.calculate_base_metrics()
         self.vx, self.vy, self.cursor_x, self.cursor_y = -5.0, -5.0, 0, 0
         self.zoom_level_index = self.ZOOM_STEPS.index(1.0)
         self.mode = 'NAV'
         self.key_press_time = {}
+        # Runs only while a movement key is held; see keyPressEvent and keyReleaseEvent.
         self.movement_timer = QTimer(self)
+        self.movement_timer.setInterval(self.REPEAT_INTERVAL_MS)
         self.movement_timer.timeout.connect(self.process_held_keys)
-        self.movement_timer.start(self.REPEAT_INTERVAL_MS)
+        self.repeat_ticks = 0
+        refresh_rate = self.screen().refreshRate() if self.screen() else 0
+        self.frames = FrameScheduler(self, self.refresh, 1000 / (refresh_rate if refresh_rate > 0 else 60))
+        self.status_updates = FrameScheduler(self, self.update_status_bar, self.STATUS_INTERVAL_MS)
+        self.idle_checkpoint_timer = QTimer(self)
+        self.idle_checkpoint_timer.setSingleShot(True)
+        self.idle_checkpoint_timer.timeout.connect(self.canvas.perform_checkpoint)
         self.grid_visible = True
+        self.tile_cache = TileCache()
+        self.tiles_rendered = 0
+        self.lod_cache = TileCache(LOD_CACHE_BYTES)
+        self.lod_rendered = 0
+        self.lod_pending = False
+        self.stats_visible, self.frame_times, self.last_frame_ms = False, deque(maxlen=60), 0.0
+        self.search_query, self.search_results, self.search_index = "", [], -1
+        self.minimap = MinimapWidget(self)
+        self.minimap.hide()
+        if metrics.log_path:
+            self.metrics_log_timer = QTimer(self)
+            self.metrics_log_timer.timeout.connect(lambda: metrics.dump(metrics.log_path))
+            self.metrics_log_timer.start(metrics.LOG_INTERVAL_MS)
+        self._last_view, self._view_velocity = (self.vx, self.vy, time.monotonic()), (0.0, 0.0)
+        self.prefetch_ready.connect(self.install_prefetched)
+        self.canvas.start_prefetcher(self.prefetch_ready.emit)
+        self.canvas.take_damage()
+        self._shown_view, self._shown_cursor = (self.vx, self.vy, self.zoom_level_index), (self.cursor_x, self.cursor_y)
         self.update_status_bar()
     def calculate_base_metrics(self):
         metrics = QFontMetrics(self.base_font)
@@ -125,50 +323,218 @@ class CanvasWidget(QWidget):
             self.vx += world_x_before - world_x_after; self.vy += world_y_before - world_y_after
         elif mods == Qt.ShiftModifier: self.vx -= (event.angleDelta().y() / 120) * 5
         else: self.vy -= (event.angleDelta().y() / 120) * 5
-        self.update_status_bar(); self.update(); self.update_signal.emit()
+        self.frames.request()
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
             wx, wy = self.screen_to_world(event.position().x(), event.position().y())
             self.cursor_x, self.cursor_y = math.floor(wx), math.floor(wy)
-            self.update_status_bar(); self.update(); self.update_signal.emit()
+            self.frames.request()
+    def schedule_prefetch(self):
+        """Requests the chunks around the viewport, stretched in the direction it is moving."""
+        now = time.monotonic()
+        last_vx, last_vy, last_time = self._last_view
+        if (self.vx, self.vy) != (last_vx, last_vy):
+            dt = now - last_time
+            self._view_velocity = ((self.vx - last_vx) / dt, (self.vy - last_vy) / dt) if 0 < dt < 0.5 else (0.0, 0.0)
+        elif now - last_time > 0.5: self._view_velocity = (0.0, 0.0)
+        self._last_view = (self.vx, self.vy, now)
+        cell_w, cell_h = self.get_zoomed_cell_size()
+        view_w, view_h = self.width() / cell_w, self.height() / cell_h
+        ahead_x = self.vx + self._view_velocity[0] * self.PREFETCH_LOOKAHEAD_S
+        ahead_y = self.vy + self._view_velocity[1] * self.PREFETCH_LOOKAHEAD_S
+        self.canvas.prefetch(math.floor(min(self.vx, ahead_x) / CHUNK_SIZE) - 1, math.floor(min(self.vy, ahead_y) / CHUNK_SIZE) - 1,
+                             math.floor((max(self.vx, ahead_x) + view_w) / CHUNK_SIZE) + 1, math.floor((max(self.vy, ahead_y) + view_h) / CHUNK_SIZE) + 1)
+    def view_chunk_rect(self):
+        """Returns the inclusive chunk rectangle under the viewport."""
+        cell_w, cell_h = self.get_zoomed_cell_size()
+        return (math.floor(self.vx / CHUNK_SIZE), math.floor(self.vy / CHUNK_SIZE),
+                math.floor((self.vx + self.width() / cell_w) / CHUNK_SIZE), math.floor((self.vy + self.height() / cell_h) / CHUNK_SIZE))
+    def jump_to(self, wx: float, wy: float):
+        """Centers the view on a world position, e.g. from the minimap, and prefetches the chunks there."""
+        self.cursor_x, self.cursor_y = math.floor(wx), math.floor(wy)
+        self.canvas.history.seal()
+        self.center_view_on_cursor()
+        # A jump is not scrolling: reset the velocity so prefetch does not look far ahead.
+        self._last_view, self._view_velocity = (self.vx, self.vy, time.monotonic()), (0.0, 0.0)
+        # The whole view can exceed what one prefetch may ask for, so take the chunks around the target first.
+        cx0, cy0, cx1, cy1 = self.view_chunk_rect()
+        tcx, tcy, half = math.floor(wx / CHUNK_SIZE), math.floor(wy / CHUNK_SIZE), math.isqrt(PREFETCH_MAX_CHUNKS) // 2
+        self.canvas.prefetch(max(cx0, tcx - half + 1), max(cy0, tcy - half + 1), min(cx1, tcx + half), min(cy1, tcy + half))
+        self.frames.request()
+    def resizeEvent(self, event):
+        self.minimap.move(self.width() - self.minimap.width() - MinimapWidget.MARGIN, self.height() - self.minimap.height() - MinimapWidget.MARGIN)
+        super().resizeEvent(event)
+    def install_prefetched(self):
+        # Text painting loads the chunks it needs itself; only LOD painting waits for prefetched ones.
+        if self.canvas.install_prefetched() and self.lod_pending:
+            self.lod_pending = False
+            self.update()
+    def cell_rect(self, x0: float, y0: float, x1: float, y1: float) -> QRect:
+        """Returns the screen rectangle covering the half-open world rectangle, a pixel wider on each side."""
+        cell_w, cell_h = self.get_zoomed_cell_size()
+        left, top = math.floor((x0 - self.vx) * cell_w) - 1, math.floor((y0 - self.vy) * cell_h) - 1
+        return QRect(left, top, math.ceil((x1 - self.vx) * cell_w) + 1 - left, math.ceil((y1 - self.vy) * cell_h) + 1 - top)
+    def stats_rect(self) -> QRect: return QRect(self.width() - 260, 8, 252, self.base_cell_height * len(self.stats_lines()) + 8)
+    def refresh(self):
+        """Repaints what changed since the last call: the view, the cells written and the old and new cursor.
+
+        A pan by whole pixels at the same zoom blits the pixels already on screen with `QWidget.scroll`,
+        which repaints only the strip it exposes. Any other view change repaints the whole widget.
+        """
+        damage = self.canvas.take_damage()
+        view, full = (self.vx, self.vy, self.zoom_level_index), False
+        if view != self._shown_view:
+            cell_w, cell_h = self.get_zoomed_cell_size()
+            dx, dy = (self._shown_view[0] - self.vx) * cell_w, (self._shown_view[1] - self.vy) * cell_h
+            full = (self._shown_view[2] != self.zoom_level_index or abs(dx) >= self.width() or abs(dy) >= self.height()
+                    or abs(dx - round(dx)) > 1e-6 or abs(dy - round(dy)) > 1e-6)
+            if not full:
+                self.scroll(round(dx), round(dy), self.rect())
+                if self.stats_visible: self.update(self.stats_rect().translated(round(dx), round(dy)))
+            self._shown_view = view
+        if full: self.update()
+        else:
+            for x0, y0, x1, y1 in damage: self.update(self.cell_rect(x0, y0, x1, y1))
+            for x, y in (self._shown_cursor, (self.cursor_x, self.cursor_y)): self.update(self.cell_rect(x, y, x + 1, y + 1))
+            if self.stats_visible: self.update(self.stats_rect())
+        if self.minimap.isVisible(): self.minimap.update()
+        self._shown_cursor = (self.cursor_x, self.cursor_y)
+        self.status_updates.request(); self.update_signal.emit()
     def paintEvent(self, event):
+        t0 = metrics.start()
+        self.schedule_prefetch()
         painter = QPainter(self)
-        painter.fillRect(self.rect(), COLORS_DARK['default_bg'])
+        # Only the damaged area is drawn; Qt clips to the exact region, this bounds the loops below.
+        area = event.rect()
+        painter.fillRect(area, COLORS_DARK['default_bg'])
         zoom_factor = self.ZOOM_STEPS[self.zoom_level_index]
         cell_w, cell_h = self.get_zoomed_cell_size()
         if cell_w <= 0.1 or cell_h <= 0.1: return
-        start_wx, start_wy = self.screen_to_world(0, 0)
-        end_wx, end_wy = self.screen_to_world(self.width(), self.height())
+        start_wx, start_wy = self.screen_to_world(area.left(), area.top())
+        end_wx, end_wy = self.screen_to_world(area.right() + 1, area.bottom() + 1)
         if self.grid_visible and zoom_factor > 0.5:
             grid_pen = QPen(QColor(60, 60, 60)); grid_pen.setStyle(Qt.DotLine); painter.setPen(grid_pen)
             for x_grid in range(math.floor(start_wx), math.ceil(end_wx) + 1):
-                sp = self.world_to_screen(x_grid, 0); painter.drawLine(sp.x(), 0, sp.x(), self.height())
+                sp = self.world_to_screen(x_grid, 0); painter.drawLine(sp.x(), area.top(), sp.x(), area.bottom())
             for y_grid in range(math.floor(start_wy), math.ceil(end_wy) + 1):
-                sp = self.world_to_screen(0, y_grid); painter.drawLine(0, sp.y(), self.width(), sp.y())
-        scaled_font = QFont(self.base_font); scaled_font.setPointSizeF(BASE_FONT_SIZE * zoom_factor); painter.setFont(scaled_font)
-        for y in range(math.floor(start_wy), math.ceil(end_wy) + 1):
-            batch_start_x, current_batch, current_style = math.floor(start_wx), "", None
-            def flush_batch():
-                nonlocal current_batch, batch_start_x, current_style
-                if not current_batch: return
-                sp = self.world_to_screen(batch_start_x, y)
-                batch_width = len(current_batch) * cell_w
-                if current_style[1] is not None: painter.fillRect(QRectF(sp.x(), sp.y(), batch_width, cell_h), COLORS_DARK.get(current_style[1]))
-                painter.setPen(COLORS_DARK.get(current_style[0], COLORS_DARK['default_fg']))
-                painter.drawText(QPointF(sp.x(), sp.y() + self.base_cell_height * zoom_factor * 0.8), current_batch)
-                current_batch = ""
-            for x in range(math.floor(start_wx), math.ceil(end_wx) + 2):
-                cell = self.canvas.get_cell(x, y); style = (cell.fg, cell.bg)
-                if style != current_style: flush_batch(); current_style = style; batch_start_x = x
-                current_batch += cell.ch
-            flush_batch()
+                sp = self.world_to_screen(0, y_grid); painter.drawLine(area.left(), sp.y(), area.right(), sp.y())
+        if zoom_factor < LOD_ZOOM: self.paint_lod(painter, start_wx, start_wy, end_wx, end_wy)
+        else:
+            for ty in range(math.floor(start_wy / TILE_CELLS), math.floor(end_wy / TILE_CELLS) + 1):
+                for tx in range(math.floor(start_wx / TILE_CELLS), math.floor(end_wx / TILE_CELLS) + 1):
+                    chunk = self.canvas.peek_chunk(tx * TILE_CELLS // CHUNK_SIZE, ty * TILE_CELLS // CHUNK_SIZE)
+                    if chunk is None: continue
+                    key = (tx, ty, self.zoom_level_index)
+                    tile = self.tile_cache.get(key, chunk.version)
+                    if tile is None:
+                        tile = self.render_tile(tx, ty)
+                        self.tile_cache.put(key, chunk.version, tile)
+                    painter.drawPixmap(QPointF((tx * TILE_CELLS - self.vx) * cell_w, (ty * TILE_CELLS - self.vy) * cell_h), tile)
         cursor_screen_pos = self.world_to_screen(self.cursor_x, self.cursor_y)
         cursor_rect = QRect(cursor_screen_pos.x(), cursor_screen_pos.y(), int(cell_w), int(cell_h))
         painter.setCompositionMode(QPainter.CompositionMode_Difference); painter.fillRect(cursor_rect, QColor(255, 255, 255)); painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        metrics.stop('paint', t0)
+        if self.stats_visible:
+            self.frame_times.append(time.monotonic()); self.last_frame_ms = (time.perf_counter() - t0) * 1000
+            self.draw_stats_overlay(painter)
+    def stats_lines(self) -> list:
+        """Returns the lines shown by the stats overlay."""
+        span = self.frame_times[-1] - self.frame_times[0] if len(self.frame_times) > 1 else 0.0
+        fps = (len(self.frame_times) - 1) / span if span > 0 else 0.0
+        paint = metrics.histograms.get('paint')
+        p95 = paint.percentile(0.95) * 1000 if paint else 0.0
+        chunks = self.canvas.chunks
+        return [f"FPS {fps:5.1f}", f"frame {self.last_frame_ms:5.1f} ms (p95 {p95:.1f})",
+                f"chunks {len(chunks)} ({chunks.nbytes / 2**20:.1f} MB)", f"journal backlog {self.canvas.journal_backlog}",
+                f"wakeups {self.wakeups}"]
+    def draw_stats_overlay(self, painter: QPainter):
+        lines = self.stats_lines()
+        painter.setFont(self.base_font)
+        line_h = self.base_cell_height
+        box = self.stats_rect()
+        painter.fillRect(box, QColor(0, 0, 0, 180))
+        painter.setPen(QColor(144, 238, 144))
+        for i, line in enumerate(lines): painter.drawText(box.x() + 6, box.y() + 4 + line_h * (i + 1) - line_h // 4, line)
+    def toggle_stats_overlay(self):
+        self.stats_visible = not self.stats_visible
+        self.update(self.stats_rect())
+        self.frame_times.clear()
+        if self.stats_visible: metrics.enable()
+        elif not metrics.log_path: metrics.enable(False)
+    def paint_lod(self, painter: QPainter, start_wx: float, start_wy: float, end_wx: float, end_wy: float):
+        """Draws each visible chunk as a downsampled color image instead of text, for low zoom levels."""
+        cell_w, cell_h = self.get_zoomed_cell_size()
+        cx0, cy0, cx1, cy1 = (math.floor(start_wx / CHUNK_SIZE), math.floor(start_wy / CHUNK_SIZE),
+                              math.floor(end_wx / CHUNK_SIZE), math.floor(end_wy / CHUNK_SIZE))
+        missing = None
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                # Chunks that are not resident are loaded by the prefetcher a batch at a time, not decoded here.
+                if self.canvas.prefetcher and not self.canvas.is_resident(cx, cy):
+                    missing = missing or (cx, cy)
+                    continue
+                chunk = self.canvas.peek_chunk(cx, cy)
+                if chunk is None: continue
+                key = (cx, cy, -1 - self.zoom_level_index)
+                tile = self.lod_cache.get(key, chunk.version)
+                if tile is None:
+                    tile = self.render_lod_tile(chunk)
+                    self.lod_cache.put(key, chunk.version, tile)
+                painter.drawPixmap(QPointF((cx * CHUNK_SIZE - self.vx) * cell_w, (cy * CHUNK_SIZE - self.vy) * cell_h), tile)
+        if missing:
+            mx, my = missing
+            self.lod_pending = True
+            self.canvas.prefetch(mx, my, min(mx + LOD_PREFETCH_SPAN - 1, cx1), min(my + LOD_PREFETCH_SPAN - 1, cy1))
+    def render_lod_tile(self, chunk: Chunk) -> QPixmap:
+        """Scales the smallest mip of `chunk` that still covers its on-screen size to exactly that size."""
+        cell_w, cell_h = self.get_zoomed_cell_size()
+        dpr = self.devicePixelRatioF()
+        width, height = math.ceil(CHUNK_SIZE * cell_w * dpr), math.ceil(CHUNK_SIZE * cell_h * dpr)
+        level = min(LOD_LEVELS - 1, max(0, int(math.log2(CHUNK_SIZE / min(width, height)))))
+        tile = QPixmap.fromImage(self.lod_image(chunk, level).scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        tile.setDevicePixelRatio(dpr)
+        return tile
+    def lod_image(self, chunk: Chunk, level: int) -> QImage:
+        """Returns mip `level` of `chunk`, CHUNK_SIZE >> level pixels square, built from the level above on a miss."""
+        key = (chunk.cx, chunk.cy, level)
+        image = self.lod_cache.get(key, chunk.version)
+        if image is not None: return image
+        if level == 0: image = lod_base_image(chunk)
+        else:
+            size = CHUNK_SIZE >> level
+            image = self.lod_image(chunk, level - 1).scaled(size, size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self.lod_cache.put(key, chunk.version, image)
+        self.lod_rendered += 1
+        return image
+    def render_tile(self, tx: int, ty: int) -> QPixmap:
+        """Rasterizes the tile at tile coordinates (tx, ty) at the current zoom level."""
+        zoom_factor = self.ZOOM_STEPS[self.zoom_level_index]
+        cell_w, cell_h = self.get_zoomed_cell_size()
+        dpr = self.devicePixelRatioF()
+        tile = QPixmap(math.ceil(TILE_CELLS * cell_w * dpr), math.ceil(TILE_CELLS * cell_h * dpr))
+        tile.setDevicePixelRatio(dpr)
+        tile.fill(Qt.transparent)
+        painter = QPainter(tile)
+        scaled_font = QFont(self.base_font); scaled_font.setPointSizeF(BASE_FONT_SIZE * zoom_factor); painter.setFont(scaled_font)
+        x0, y0 = tx * TILE_CELLS, ty * TILE_CELLS
+        baseline = self.base_cell_height * zoom_factor * 0.8
+        for row_index, row in enumerate(self.canvas.get_region(x0, y0, x0 + TILE_CELLS, y0 + TILE_CELLS)):
+            py = row_index * cell_h
+            for start, end, fg, bg in row.runs:
+                px = (start - x0) * cell_w
+                if bg is not None: painter.fillRect(QRectF(px, py, (end - start) * cell_w, cell_h), COLORS_DARK.get(bg))
+                text = row.text[start - x0:end - x0]
+                if text.isspace(): continue
+                painter.setPen(COLORS_DARK.get(fg, COLORS_DARK['default_fg']))
+                painter.drawText(QPointF(px, py + baseline), text)
+        painter.end()
+        self.tiles_rendered += 1
+        return tile
     def keyPressEvent(self, event):
         key, mods, text = event.key(), event.modifiers(), event.text()
         if event.isAutoRepeat() and key in self.MOVEMENT_KEYS: return
         self.key_press_time[key] = time.time()
+        if key in self.MOVEMENT_KEYS and not self.movement_timer.isActive(): self.movement_timer.start()
         dx, dy, is_move_key = 0, 0, True
         if key in self.MOVEMENT_KEYS:
             if self.mode == 'NAV' or key in (Qt.Key_Up, Qt.Key_Down, Qt.Key_Left, Qt.Key_Right):
@@ -179,22 +545,68 @@ class CanvasWidget(QWidget):
             else: is_move_key = False
         else: is_move_key = False
         if is_move_key:
+            self.canvas.history.seal()
             if mods == Qt.ShiftModifier: self.vx += dx; self.vy += dy; self.cursor_x += dx; self.cursor_y += dy
             else: self.cursor_x += dx; self.cursor_y += dy; self.ensure_cursor_visible()
-        elif key == Qt.Key_Escape: self.mode = 'NAV'
+        elif key == Qt.Key_Escape: self.mode = 'NAV'; self.canvas.history.seal()
+        elif key == Qt.Key_E and mods == Qt.ControlModifier: self.export_pdf()
+        elif key == Qt.Key_F3: self.toggle_stats_overlay()
+        elif key == Qt.Key_F and mods == Qt.ControlModifier: self.prompt_search(); return
+        elif key == Qt.Key_M and mods == Qt.ControlModifier: self.minimap.setVisible(not self.minimap.isVisible())
         elif self.mode == 'NAV':
-            if key == Qt.Key_I: self.mode = 'TEXT'
+            if key == Qt.Key_U or (key == Qt.Key_R and mods == Qt.ControlModifier):
+                if self.canvas.undo() if key == Qt.Key_U else self.canvas.redo(): self.idle_checkpoint_timer.start(self.IDLE_CHECKPOINT_MS)
+            elif key == Qt.Key_I: self.mode = 'TEXT'
             elif key == Qt.Key_Z: self.center_view_on_cursor()
-            elif key == Qt.Key_G: self.grid_visible = not self.grid_visible
+            elif key == Qt.Key_G: self.grid_visible = not self.grid_visible; self.update()
+            elif key == Qt.Key_N and self.search_results: self.jump_to_result(-1 if mods & Qt.ShiftModifier else 1)
         elif self.mode == 'TEXT':
             if key == Qt.Key_Backspace:
                 self.cursor_x -= 1; op = {"type": "SET_CELL", "x": self.cursor_x, "y": self.cursor_y, "new_cell": list(Cell()._asdict().values())}; self.canvas.log_and_apply_operation(op); self.ensure_cursor_visible()
+                self.idle_checkpoint_timer.start(self.IDLE_CHECKPOINT_MS)
             elif text and text.isprintable():
                 op = {"type": "SET_CELL", "x": self.cursor_x, "y": self.cursor_y, "new_cell": list(Cell(ch=text)._asdict().values())}; self.canvas.log_and_apply_operation(op); self.cursor_x += 1; self.ensure_cursor_visible()
-        self.update_status_bar(); self.update(); self.update_signal.emit()
+                self.idle_checkpoint_timer.start(self.IDLE_CHECKPOINT_MS)
+        self.frames.request()
+    def prompt_search(self):
+        query, ok = QInputDialog.getText(self, "Search", "Find:", text=self.search_query)
+        if ok and query: self.search(query)
+    def search(self, query: str):
+        """Searches the canvas and moves the cursor to the first match at or after it."""
+        self.search_query, self.search_results = query, self.canvas.search(query)
+        here = (self.cursor_y, self.cursor_x)
+        self.search_index = next((i for i, (x, y) in enumerate(self.search_results) if (y, x) >= here), 0) - 1
+        if self.search_results: self.jump_to_result(1)
+        else: self.status_bar.showMessage(f"No matches for {query!r}")
+    def jump_to_result(self, step: int):
+        self.search_index = (self.search_index + step) % len(self.search_results)
+        self.cursor_x, self.cursor_y = self.search_results[self.search_index]
+        self.canvas.history.seal()
+        self.center_view_on_cursor()
+        self.frames.request()
+    def export_pdf(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export PDF", "", "PDF files (*.pdf)")
+        if not path: return
+        dialog = QProgressDialog("Exporting PDF...", None, 0, 0, self)
+        dialog.setWindowModality(Qt.WindowModal); dialog.setMinimumDuration(300)
+        def on_progress(done, total):
+            dialog.setMaximum(total); dialog.setValue(done); QApplication.processEvents()
+        try: export_to_pdf(self.canvas, path, progress=on_progress)
+        finally: dialog.close()
     def keyReleaseEvent(self, event):
         if not event.isAutoRepeat() and event.key() in self.key_press_time: del self.key_press_time[event.key()]
+        if not self.MOVEMENT_KEYS.intersection(self.key_press_time): self.movement_timer.stop()
+    def focusOutEvent(self, event):
+        # Releases that happen while another window has focus never arrive here.
+        self.key_press_time.clear(); self.movement_timer.stop()
+        super().focusOutEvent(event)
+    @property
+    def wakeups(self) -> int:
+        """Timer callbacks run so far: key repeats, frames and status bar updates. Stays put while idle."""
+        return self.repeat_ticks + self.frames.runs + self.status_updates.runs
     def process_held_keys(self):
+        self.repeat_ticks += 1
+        metrics.count('ui.wakeup')
         if not self.key_press_time: return
         now, dx, dy, moved = time.time(), 0, 0, False
         is_shift_held = Qt.Key_Shift in self.key_press_time
@@ -210,10 +622,15 @@ class CanvasWidget(QWidget):
         if moved:
             if is_shift_held: self.vx += dx; self.vy += dy; self.cursor_x += dx; self.cursor_y += dy
             else: self.cursor_x += dx; self.cursor_y += dy; self.ensure_cursor_visible()
-            self.update_status_bar(); self.update(); self.update_signal.emit()
+            self.frames.request()
     def update_status_bar(self):
         zoom = self.ZOOM_STEPS[self.zoom_level_index] * 100
-        self.status_bar.showMessage(f"Mode: {self.mode} | Cursor: ({self.cursor_x}, {self.cursor_y}) | View: ({self.vx:.1f}, {self.vy:.1f}) | Zoom: {zoom:.0f}%")
+        message = f"Mode: {self.mode} | Cursor: ({self.cursor_x}, {self.cursor_y}) | View: ({self.vx:.1f}, {self.vy:.1f}) | Zoom: {zoom:.0f}%"
+        objects_here = self.canvas.objects_at(self.cursor_x, self.cursor_y)
+        if objects_here: message += f" | Object: {objects_here[0].type}"
+        if self.search_results and self.search_results[self.search_index] == (self.cursor_x, self.cursor_y):
+            message += f" | Match {self.search_index + 1}/{len(self.search_results)}"
+        if message != self.status_bar.currentMessage(): self.status_bar.showMessage(message)
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -234,7 +651,7 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("AsciiCanvas - Welcome")
     def open_document(self, file_name: str):
         doc_path = config.get_document_folder() / file_name
-        canvas = Canvas(str(doc_path))
+        canvas = Canvas(str(doc_path), background_journal=True)
         canvas.load()
         status_bar = QStatusBar()
         self.setStatusBar(status_bar)
@@ -252,4 +669,5 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         if self.canvas_widget and self.canvas_widget.canvas:
             self.canvas_widget.canvas.close()
+        if metrics.log_path: metrics.dump(metrics.log_path)
         event.accept()
@@ -0,0 +1,218 @@
+import sys
+from array import array
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import msgpack
+
+from .database import compress_data, decompress_data
+
+BLANK = ord(' ')
+MAX_GROUP_EDITS = 10_000
+
+def _le_bytes(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values); values.byteswap()
+    return values.tobytes()
+
+def _from_le_bytes(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big': values.byteswap()
+    return values
+
+def _codepoint(ch: str) -> int:
+    return ord(ch[0]) if ch else BLANK
+
+def invert_op(op: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the op that reverses `op`, which must carry the state it replaced."""
+    op_type = op['type']
+    if op_type == 'CREATE_OBJECT':
+        return {'type': 'DELETE_OBJECT', 'obj_id': op['obj_data']['id'], 'old_cells': op.get('old_cells', [])}
+    if op_type == 'BLIT':
+        return {'type': 'BLIT', 'writes': op['old'], 'old': op['writes'], 'delete': op['create'], 'create': op['delete']}
+    # Span ops blank the area they wrote, then put back the non-blank cells they replaced.
+    if op_type == 'DRAW_SPANS':
+        blanks = [[x, y, ' ' * len(text), None, None, None] for x, y, text, *_ in op['spans']]
+        return {'type': 'DRAW_SPANS', 'spans': blanks + op.get('old_spans', [])}
+    if op_type == 'FILL_RECT':
+        return {'type': 'BATCH', 'ops': [{'type': 'FILL_RECT', 'rect': op['rect'], 'cell': [' ', None, None, None]},
+                                         {'type': 'DRAW_SPANS', 'spans': op.get('old_spans', [])}]}
+    raise ValueError(f"Cannot invert operation of type {op_type!r}")
+
+class UndoGroup:
+    """One undo step.
+
+    Cell edits are packed into parallel arrays of coordinates and old/new codepoints; edits whose
+    cells carry colors or an owner keep their full cells in `styled`. Ops that are not cell edits
+    (object creation, span drawing) are stored as dicts together with the number of cell edits
+    that preceded them, so a group replays and reverses in its original order.
+    """
+    __slots__ = ('xs', 'ys', 'old_chars', 'new_chars', 'styled', 'ops', 'owner', 'sealed', 'row_id')
+
+    def __init__(self):
+        self.xs, self.ys = array('i'), array('i')
+        self.old_chars, self.new_chars = array('I'), array('I')
+        self.styled: Optional[Dict[int, Tuple[list, list]]] = None
+        self.ops: Optional[List[Tuple[int, Dict[str, Any]]]] = None
+        self.owner: Optional[str] = None
+        self.sealed = False
+        self.row_id: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.xs) + (len(self.ops) if self.ops else 0)
+
+    def add_cell(self, x: int, y: int, old_cell: list, new_cell: list):
+        if old_cell[1:] != [None, None, None] or new_cell[1:] != [None, None, None]:
+            if self.styled is None: self.styled = {}
+            self.styled[len(self.xs)] = (list(old_cell), list(new_cell))
+        self.xs.append(x); self.ys.append(y)
+        self.old_chars.append(_codepoint(old_cell[0])); self.new_chars.append(_codepoint(new_cell[0]))
+
+    def add_op(self, op: Dict[str, Any]):
+        if op['type'] in ('BATCH', 'UNDO', 'REDO'):
+            for sub_op in op['ops']: self.add_op(sub_op)
+        elif op['type'] == 'SET_CELL':
+            if 'old_cell' in op: self.add_cell(op['x'], op['y'], op['old_cell'], op['new_cell'])
+        else:
+            if self.ops is None: self.ops = []
+            self.ops.append((len(self.xs), op))
+
+    def _cell(self, i: int, old: bool) -> list:
+        if self.styled and i in self.styled: return self.styled[i][0 if old else 1]
+        return [chr(self.old_chars[i] if old else self.new_chars[i]), None, None, None]
+
+    def _cell_op(self, i: int, old: bool) -> Dict[str, Any]:
+        op = {'type': 'SET_CELL', 'x': self.xs[i], 'y': self.ys[i], 'new_cell': self._cell(i, old)}
+        # Redone edits keep the cell they replace, so a replayed REDO can rebuild the group from the journal.
+        if not old: op['old_cell'] = self._cell(i, True)
+        return op
+
+    def forward_ops(self) -> List[Dict[str, Any]]:
+        """Returns the ops that redo this group, in order."""
+        result, ops, start = [], self.ops or [], 0
+        for position, op in ops + [(len(self.xs), None)]:
+            result.extend(self._cell_op(i, False) for i in range(start, position))
+            if op is not None: result.append(op)
+            start = position
+        return result
+
+    def inverse_ops(self) -> List[Dict[str, Any]]:
+        """Returns the ops that undo this group, newest edit first."""
+        result, end = [], len(self.xs)
+        for position, op in reversed(self.ops or []):
+            result.extend(self._cell_op(i, True) for i in range(end - 1, position - 1, -1))
+            result.append(invert_op(op))
+            end = position
+        result.extend(self._cell_op(i, True) for i in range(end - 1, -1, -1))
+        return result
+
+    def pack(self) -> bytes:
+        data = {'x': _le_bytes(self.xs), 'y': _le_bytes(self.ys), 'o': _le_bytes(self.old_chars), 'n': _le_bytes(self.new_chars),
+                's': [[i, old, new] for i, (old, new) in (self.styled or {}).items()], 'p': [[i, op] for i, op in (self.ops or [])]}
+        return compress_data(msgpack.packb(data, use_bin_type=True))
+
+    @classmethod
+    def unpack(cls, blob: bytes) -> 'UndoGroup':
+        data = msgpack.unpackb(decompress_data(blob), raw=False)
+        group = cls()
+        group.xs, group.ys = _from_le_bytes('i', data['x']), _from_le_bytes('i', data['y'])
+        group.old_chars, group.new_chars = _from_le_bytes('I', data['o']), _from_le_bytes('I', data['n'])
+        group.styled = {i: (old, new) for i, old, new in data['s']} or None
+        group.ops = [(i, op) for i, op in data['p']] or None
+        group.sealed = True
+        return group
+
+class UndoHistory:
+    """Undo and redo stacks of `UndoGroup`s with older history paged out to the document.
+
+    At most `limit` groups stay in memory. Older groups that are already stored in the `undo`
+    table are dropped; newer ones wait in `spill` until the next checkpoint stores them. Undoing
+    past the in-memory window pages groups back in through `load_page(before_seq, limit)`.
+    `floor` tracks the stored rows: every row with `seq >= floor` is in memory, on the redo
+    stack or waiting to be deleted.
+    """
+    def __init__(self, limit: int, load_page: Optional[Callable[[int, int], List[Tuple[int, bytes]]]] = None):
+        self.limit = limit
+        self.groups: deque[UndoGroup] = deque()
+        self.redo: deque[UndoGroup] = deque(maxlen=limit)
+        self.spill: List[UndoGroup] = []
+        self.deleted: Dict[int, UndoGroup] = {}
+        self.floor = 0
+        self._load_page = load_page
+
+    def load(self):
+        """Reads the newest stored groups into memory."""
+        self.groups.clear(); self.floor = sys.maxsize
+        self._page_in()
+
+    def record(self, op: Dict[str, Any]):
+        """Adds a logged op, merging cell edits from one typing run or one object into one group."""
+        self.redo.clear()
+        if op['type'] == 'SET_CELL':
+            if 'old_cell' not in op: return
+            top = self.groups[-1] if self.groups else None
+            owner = op['new_cell'][3]
+            if top is None or top.sealed or top.ops or len(top.xs) >= MAX_GROUP_EDITS or not (
+                    (owner is not None and owner == top.owner) or (op['y'] == top.ys[-1] and abs(op['x'] - top.xs[-1]) <= 1)):
+                top = self._push(UndoGroup())
+                top.owner = owner
+            top.add_op(op)
+        else:
+            group = UndoGroup()
+            group.add_op(op)
+            group.sealed = True
+            if len(group): self._push(group)
+
+    def seal(self):
+        """Ends the current typing run; the next cell edit starts a new group."""
+        if self.groups: self.groups[-1].sealed = True
+
+    def pop_undo(self) -> Optional[UndoGroup]:
+        if not self.groups: self._page_in()
+        if not self.groups: return None
+        group = self.groups.pop()
+        group.sealed = True
+        if group.row_id is not None: self.deleted[group.row_id] = group
+        self.redo.append(group)
+        return group
+
+    def pop_redo(self) -> Optional[UndoGroup]:
+        if not self.redo: return None
+        group = self.redo.pop()
+        if group.row_id is not None: self.deleted.pop(group.row_id, None)
+        self._push(group)
+        return group
+
+    def unpersisted(self) -> List[UndoGroup]:
+        """Groups that still need a row in the `undo` table, oldest first."""
+        return self.spill + [group for group in self.groups if group.row_id is None]
+
+    def persisted(self):
+        """Called after the groups from `unpersisted` were stored and `deleted` rows removed."""
+        if self.spill: self.floor = max(self.floor, self.spill[-1].row_id + 1)
+        self.spill.clear()
+        for group in self.deleted.values(): group.row_id = None
+        self.deleted.clear()
+
+    def _push(self, group: UndoGroup) -> UndoGroup:
+        self.groups.append(group)
+        while len(self.groups) > self.limit:
+            evicted = self.groups.popleft()
+            if evicted.row_id is None: self.spill.append(evicted)
+            else: self.floor = evicted.row_id + 1
+        return group
+
+    def _page_in(self):
+        if self.spill:
+            page, self.spill = self.spill[-self.limit:], self.spill[:-self.limit]
+            self.groups.extendleft(reversed(page))
+            return
+        if not self._load_page or self.floor <= 0: return
+        rows = self._load_page(self.floor, self.limit)
+        for row_id, blob in rows:
+            group = UndoGroup.unpack(blob)
+            group.row_id = row_id
+            self.groups.appendleft(group)
+        if rows: self.floor = rows[-1][0]
+        else: self.floor = 0
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+from asciicanvas import cli
+from asciicanvas.model import Canvas, PageFrame
+
+def make_document(path, text, fg=None):
+    canvas = Canvas(str(path))
+    canvas.load()
+    canvas.create_object(PageFrame(0, 0, 30, 10))
+    for i, ch in enumerate(text):
+        canvas.log_and_apply_operation({"type": "SET_CELL", "x": 2 + i, "y": 300, "new_cell": [ch, fg, None, None]})
+    canvas.close()
+
+def test_export_folder_skips_unchanged_documents(tmp_path):
+    """Test that every format is written and unchanged documents are skipped on the next run."""
+    docs, out = tmp_path / "docs", tmp_path / "out"
+    docs.mkdir()
+    make_document(docs / "a.asciicanvas", "hello <world>", fg=2)
+    make_document(docs / "b.asciicanvas", "second")
+
+    assert cli.run_export(docs, out, list(cli.FORMATS), jobs=2) == (2, 0, 0)
+    text = (out / "a.txt").read_text()
+    assert text.splitlines()[0].startswith("|----") and text.splitlines()[-1] == "  hello <world>"
+    assert "\x1b[0;38;2;144;238;144mhello <world>\x1b[0m" in (out / "a.ans").read_text()
+    assert '<span class="f2">hello &lt;world&gt;</span>' in (out / "a.html").read_text()
+    assert (out / "b.pdf").read_bytes().startswith(b"%PDF")
+
+    assert cli.run_export(docs, out, ["text"], jobs=1) == (0, 2, 0)
+    canvas = Canvas(str(docs / "b.asciicanvas"))
+    canvas.load()
+    canvas.log_and_apply_operation({"type": "SET_CELL", "x": 0, "y": 300, "new_cell": ["!", None, None, None]})
+    canvas.close()
+    assert cli.run_export(docs, out, ["text"], jobs=1) == (1, 1, 0)
+    assert (out / "b.txt").read_text().splitlines()[-1] == "! second"
+
+def test_export_command_does_not_import_qt(tmp_path):
+    """Test that the export subcommand runs without importing PySide6."""
+    make_document(tmp_path / "doc.asciicanvas", "x")
+    code = ("import sys; from asciicanvas import __main__ as m; sys.argv = ['asciicanvas', 'export', sys.argv[1], '--out', sys.argv[2], "
+            "'--formats', 'text', '--jobs', '1']\ntry: m.main()\nexcept SystemExit as e: assert e.code == 0, e.code\n"
+            "assert 'PySide6' not in sys.modules")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, "-c", code, str(tmp_path), str(tmp_path / "out")], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "out" / "doc.txt").read_text().splitlines()[-1] == "  x"
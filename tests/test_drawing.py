@@ -0,0 +1,41 @@
+from asciicanvas.drawing_utils import draw_rect, get_line_cells, get_rect_cells, iter_line_spans, iter_rect_spans
+from asciicanvas.model import CHUNK_SIZE, Canvas, Cell
+
+def expand(spans):
+    return sorted((x + i, y, Cell(ch, fg, bg, owner)) for x, y, text, fg, bg, owner in spans for i, ch in enumerate(text))
+
+def test_spans_cover_the_same_cells():
+    """Test that the span generators produce exactly the cells of the per-cell helpers."""
+    for corners in [(0, 0, 9, 4), (9, 4, 0, 0), (3, 3, 3, 3), (0, 0, 0, 5), (0, 0, 5, 0), (0, 0, 2, 7), (7, 0, 0, 3)]:
+        assert expand(iter_line_spans(*corners)) == sorted(get_line_cells(*corners))
+        assert expand(iter_rect_spans(*corners, True)) == sorted(get_rect_cells(*corners, True))
+    assert len(list(iter_line_spans(0, 0, 500, 0))) == 1
+    assert len(list(iter_line_spans(0, 0, 40, 3))) == 4
+
+def test_draw_rect_is_one_op_across_chunks(tmp_path):
+    """Test that a filled box spanning chunks is one journal record and one undo step that restores what it covered."""
+    canvas = Canvas(str(tmp_path / "doc.asciicanvas"))
+    canvas.load()
+    canvas.set_cell(CHUNK_SIZE + 3, 5, Cell("k", fg=2))
+    seq = canvas.db.get_last_journal_seq()
+
+    x1, y1 = 2 * CHUNK_SIZE + 10, CHUNK_SIZE + 20
+    draw_rect(canvas, 0, 0, x1, y1, filled=True)
+    assert canvas.db.get_last_journal_seq() == seq + 1 and len(canvas.history.groups) == 1
+    assert canvas.get_cell(0, 0).ch == "┌" and canvas.get_cell(x1, y1).ch == "┘" and canvas.get_cell(x1, 7).ch == "│"
+    assert canvas.get_cell(CHUNK_SIZE + 3, 5) == Cell(bg=1)
+    for chunk in canvas.chunks.values():
+        assert chunk.count == sum(1 for _ in chunk.iter_cells())
+
+    canvas.undo()
+    assert canvas.get_cell(CHUNK_SIZE + 3, 5) == Cell("k", fg=2)
+    assert canvas.get_cell(0, 0) == Cell() and canvas.get_cell(CHUNK_SIZE, CHUNK_SIZE) == Cell()
+    canvas.redo()
+    canvas.close()
+
+    canvas = Canvas(str(tmp_path / "doc.asciicanvas"))
+    canvas.load()
+    assert canvas.get_cell(x1, 0).ch == "┐" and canvas.get_cell(CHUNK_SIZE + 3, 5) == Cell(bg=1)
+    canvas.undo()
+    assert canvas.get_cell(CHUNK_SIZE + 3, 5) == Cell("k", fg=2) and canvas.get_cell(x1, 0) == Cell()
+    canvas.close()
@@ -0,0 +1,40 @@
+import pypdf
+import pytest
+
+from asciicanvas import pdf_export
+from asciicanvas.model import Canvas, Cell, PageFrame, CHUNK_SIZE
+
+@pytest.fixture
+def canvas_with_frames(tmp_path):
+    canvas = Canvas(str(tmp_path / "export.asciicanvas"))
+    canvas.load()
+    for i in range(5):
+        frame = PageFrame(i * 2 * CHUNK_SIZE, 0, 40, 20)
+        canvas.create_object(frame)
+        for j, ch in enumerate(f"page {i}"): canvas.set_cell(frame.x + 2 + j, 2, Cell(ch=ch))
+    canvas.perform_checkpoint()
+    yield canvas
+    canvas.close()
+
+def test_serial_export_releases_chunks(canvas_with_frames, tmp_path):
+    """Test that each frame is exported and its chunks leave the cache again."""
+    canvas = canvas_with_frames
+    for chunk in list(canvas.chunks.values()): canvas.chunks.pop((chunk.cx, chunk.cy))
+    progress = []
+    output = tmp_path / "serial.pdf"
+    pdf_export.export_to_pdf(canvas, str(output), progress=lambda done, total: progress.append((done, total)), workers=1)
+    assert output.read_bytes().startswith(b"%PDF")
+    assert progress == [(i, 5) for i in range(1, 6)]
+    assert len(canvas.chunks) == 0
+
+def test_parallel_export_merges_parts(canvas_with_frames, tmp_path, monkeypatch):
+    """Test that frames rendered in a process pool are merged in order into one PDF."""
+    monkeypatch.setattr(pdf_export, "FRAMES_PER_PART", 2)
+    progress = []
+    output = tmp_path / "parallel.pdf"
+    pdf_export.export_to_pdf(canvas_with_frames, str(output), progress=lambda done, total: progress.append(done), workers=2)
+    pages = pypdf.PdfReader(str(output)).pages
+    assert len(pages) == 5
+    assert [f"page {i}" in page.extract_text() for i, page in enumerate(pages)] == [True] * 5
+    # Progress arrives per finished group, so the serial fallback cannot pass this.
+    assert progress == [2, 4, 5]
@@ -3,8 +3,10 @@ import pytest
 import msgpack
 from time import time
 
-from asciicanvas.model import Canvas, Cell
+from asciicanvas import model
+from asciicanvas.model import Canvas, Cell, Table
 from asciicanvas.database import Database
+from asciicanvas.opcodec import FORMAT_VERSION, OpCodec
 
 @pytest.fixture
 def canvas_with_journal():
@@ -40,11 +42,12 @@ def test_journal_replay_on_load(canvas_with_journal):
     db = Database(db_path)
     db.connect()
     
-    op1 = { "type": "SET_CELL", "x": 5, "y": 5, "new_cell": Cell(ch='A')._asdict().values() }
-    op2 = { "type": "SET_CELL", "x": 6, "y": 6, "new_cell": Cell(ch='B', fg=1)._asdict().values() }
+    op1 = { "type": "SET_CELL", "x": 5, "y": 5, "new_cell": list(Cell(ch='A')._asdict().values()) }
+    op2 = { "type": "SET_CELL", "x": 6, "y": 6, "new_cell": list(Cell(ch='B', fg=1)._asdict().values()) }
     
-    db.append_journal_op(int(time()), msgpack.packb(op1))
-    db.append_journal_op(int(time()), msgpack.packb(op2))
+    codec = OpCodec()
+    db.append_journal_op(0, codec.encode(op1))
+    db.append_journal_op(0, codec.encode(op2))
     
     db.close()
     canvas_with_journal.close()
@@ -80,3 +83,152 @@ def test_checkpointing_truncates_journal(canvas_with_journal):
     reopened_canvas.load()
     assert reopened_canvas.get_cell(1, 1) == Cell(ch='C')
     reopened_canvas.close()
+
+def test_load_replay_stays_bounded(canvas_with_journal, monkeypatch):
+    """Test that the journal replayed on open does not grow with the number of edits."""
+    monkeypatch.setattr(model, "CHECKPOINT_INTERVAL", 50)
+    canvas = canvas_with_journal
+    db_path = canvas.db.db_path
+
+    for edits in (200, 2000):
+        for i in range(edits):
+            op = {"type": "SET_CELL", "x": i % 300, "y": i // 300, "new_cell": list(Cell(ch='x')._asdict().values())}
+            canvas.log_and_apply_operation(op)
+        assert len(canvas.db.get_journal_ops_after(canvas.last_checkpoint_seq)) < 50
+
+    canvas.close()
+    reopened_canvas = Canvas(db_path)
+    reopened_canvas.load()
+    assert reopened_canvas.ops_since_checkpoint < 50
+    assert reopened_canvas.get_cell(299, 0) == Cell(ch='x')
+    reopened_canvas.close()
+
+def test_background_journal_group_commit():
+    """Test that the background writer commits ops in groups and flushes on close."""
+    db_path = "test_journal_writer.asciicanvas"
+    try:
+        canvas = Canvas(db_path, background_journal=True)
+        canvas.load()
+        for i in range(500):
+            op = {"type": "SET_CELL", "x": i, "y": 0, "new_cell": list(Cell(ch='w')._asdict().values())}
+            canvas.log_and_apply_operation(op)
+        assert canvas.flush_journal() == 500
+        assert canvas.journal_writer.commits < 500
+
+        cursor = canvas.db.conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM journal")
+        assert cursor.fetchone()[0] == 500
+        canvas.log_and_apply_operation({"type": "SET_CELL", "x": 0, "y": 1, "new_cell": list(Cell(ch='z')._asdict().values())})
+        canvas.close()
+
+        reopened_canvas = Canvas(db_path)
+        reopened_canvas.load()
+        assert reopened_canvas.get_cell(499, 0) == Cell(ch='w')
+        assert reopened_canvas.get_cell(0, 1) == Cell(ch='z')
+        reopened_canvas.close()
+    finally:
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+def test_batch_is_one_record_and_one_undo_step(canvas_with_journal):
+    """Test that object creation and batched edits are journaled as single records."""
+    canvas = canvas_with_journal
+    db_path = canvas.db.db_path
+
+    table = Table(0, 0, rows=3, cols=4, cell_w=5, cell_h=2)
+    canvas.create_object(table)
+    with canvas.batch():
+        for i, ch in enumerate("batch"):
+            canvas.log_and_apply_operation({"type": "SET_CELL", "x": 40 + i, "y": 2, "new_cell": list(Cell(ch=ch)._asdict().values())})
+        assert canvas.get_cell(40, 2) == Cell(ch='b')
+
+    cursor = canvas.db.conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM journal")
+    assert cursor.fetchone()[0] == 2
+    assert len(canvas.history.groups) == 2
+    assert len(canvas.history.groups[-1]) == 5
+    table_cells = table.render()
+    assert len(canvas.history.groups[0].ops[0][1]["old_cells"]) == len(table_cells)
+    x, y, cell = table_cells[0]
+
+    canvas.db.close()
+    reopened_canvas = Canvas(db_path)
+    reopened_canvas.load()
+    assert reopened_canvas.get_cell(x, y) == cell
+    assert reopened_canvas.get_cell(44, 2) == Cell(ch='h')
+    assert table.id in reopened_canvas.objects
+    reopened_canvas.close()
+
+def test_coalesced_replay_matches_sequential_apply(canvas_with_journal):
+    """Test that the coalescing replay ends in the same state as applying every op in order."""
+    canvas = canvas_with_journal
+    db_path = canvas.db.db_path
+    for _ in range(20):
+        for i, ch in enumerate("redo"):
+            canvas.log_and_apply_operation({"type": "SET_CELL", "x": i, "y": 0, "new_cell": list(Cell(ch=ch, fg=i or None)._asdict().values())})
+        for i in reversed(range(4)):
+            canvas.log_and_apply_operation({"type": "SET_CELL", "x": i, "y": 0, "new_cell": list(Cell()._asdict().values())})
+    canvas.log_and_apply_operation({"type": "SET_CELL", "x": 1, "y": 0, "new_cell": list(Cell(ch='k')._asdict().values())})
+    table = Table(0, -3, rows=1, cols=2, cell_w=3, cell_h=1)
+    canvas.create_object(table)
+    canvas.log_and_apply_operation({"type": "SET_CELL", "x": 300, "y": 300, "new_cell": list(Cell(ch='z', bg=2)._asdict().values())})
+    expected = {(x, y): canvas.get_cell(x, y) for x in range(-2, 10) for y in range(-4, 2)}
+    expected_groups = [len(group) for group in canvas.history.groups]
+    canvas.db.close()
+
+    reopened_canvas = Canvas(db_path)
+    reopened_canvas.load()
+    assert {(x, y): reopened_canvas.get_cell(x, y) for x in range(-2, 10) for y in range(-4, 2)} == expected
+    assert reopened_canvas.get_cell(300, 300) == Cell(ch='z', bg=2)
+    assert [len(group) for group in reopened_canvas.history.groups] == expected_groups
+    assert reopened_canvas.history.groups[-1].xs[-1] == 300
+    assert table.id in reopened_canvas.object_index
+    reopened_canvas.close()
+
+def test_op_codec_round_trip():
+    """Test that the compact codec decodes every op shape back to the op that was encoded."""
+    owner = "7d9f2c1e-0b4a-4c3e-9a7b-2f1d0e5c6b8a"
+    ops = [
+        {"type": "SET_CELL", "x": 5, "y": -3, "new_cell": ["a", None, None, None], "old_cell": [" ", None, None, None]},
+        {"type": "SET_CELL", "x": 6, "y": -3, "new_cell": ["\u2502", 3, -1, owner]},
+        {"type": "SET_CELL", "x": -70000, "y": 2 ** 40, "new_cell": ["b", None, 7, "not-a-uuid"]},
+        {"type": "BATCH", "ops": [
+            {"type": "CREATE_OBJECT", "obj_data": {"id": owner, "type": "Table"}, "old_cells": [[0, 0, ["x", None, None, None]]]},
+            {"type": "SET_CELL", "x": 0, "y": 0, "new_cell": ["+", 3, -1, owner], "old_cell": ["x", None, None, None]},
+        ]},
+        {"type": "UNDO", "ops": [{"type": "DELETE_OBJECT", "obj_id": owner, "old_cells": []}]},
+        {"type": "SET_CELL", "x": 1, "y": 1, "new_cell": ["ab", None, None, None]},
+    ]
+    encoder, decoder = OpCodec(), OpCodec()
+    for op in ops:
+        assert decoder.decode(encoder.encode(op)) == op
+
+    typed = {"type": "SET_CELL", "x": 7, "y": -3, "new_cell": ["c", 3, -1, owner], "old_cell": [" ", None, None, None]}
+    assert len(encoder.encode(typed)) < len(msgpack.packb(typed)) // 8
+
+def test_version_1_document_is_migrated(canvas_with_journal):
+    """Test that a document with a msgpack journal is replayed, compacted and marked version 2."""
+    db_path = canvas_with_journal.db.db_path
+    canvas_with_journal.close()
+    db = Database(db_path)
+    db.connect()
+    db.conn.execute("DELETE FROM meta")
+    db.conn.commit()
+    db.append_journal_op(int(time()), msgpack.packb({"type": "SET_CELL", "x": 2, "y": 3, "new_cell": ["v", None, None, None]}))
+    db.close()
+
+    canvas = Canvas(db_path)
+    canvas.load()
+    assert canvas.get_cell(2, 3) == Cell(ch='v')
+    assert canvas.db.get_meta("version") == str(FORMAT_VERSION).encode()
+    assert canvas.db.get_journal_ops_after(0) == []
+    canvas.log_and_apply_operation({"type": "SET_CELL", "x": 4, "y": 3, "new_cell": ["w", None, None, None]})
+    (_, op_data), = canvas.db.get_journal_ops_after(0)
+    assert op_data[0] == 0x02
+    canvas.db.close()
+
+    reopened_canvas = Canvas(db_path)
+    reopened_canvas.load()
+    assert reopened_canvas.get_cell(2, 3) == Cell(ch='v')
+    assert reopened_canvas.get_cell(4, 3) == Cell(ch='w')
+    reopened_canvas.close()
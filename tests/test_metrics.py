@@ -0,0 +1,42 @@
+import json
+
+from asciicanvas import metrics
+from asciicanvas.model import Canvas, Cell
+
+def test_metrics_record_only_when_enabled(tmp_path):
+    """Test that probes are no-ops while disabled and fill histograms and counters once enabled."""
+    metrics.reset()
+    canvas = Canvas(str(tmp_path / "doc.asciicanvas"))
+    canvas.load()
+    canvas.log_and_apply_operation({"type": "SET_CELL", "x": 1, "y": 1, "new_cell": ["a", None, None, None]})
+    assert metrics.snapshot()["histograms"] == {} and metrics.snapshot()["counters"] == {}
+
+    metrics.enable()
+    try:
+        canvas.log_and_apply_operation({"type": "SET_CELL", "x": 2, "y": 1, "new_cell": ["b", None, None, None]})
+        canvas.perform_checkpoint()
+        canvas.chunks.pop((0, 0))
+        assert canvas.peek_chunk(0, 0).get_cell(2, 1) == Cell(ch="b")
+        assert canvas.peek_chunk(0, 0) is not None
+        snapshot = metrics.snapshot()
+        assert {"journal.append", "checkpoint", "chunk.decode"} <= set(snapshot["histograms"])
+        assert snapshot["counters"]["chunk.miss"] == 1 and snapshot["counters"]["chunk.hit"] >= 1
+        assert snapshot["histograms"]["checkpoint"]["count"] == 1
+
+        metrics.dump(str(tmp_path / "metrics.jsonl"))
+        metrics.dump(str(tmp_path / "metrics.jsonl"))
+        lines = (tmp_path / "metrics.jsonl").read_text().splitlines()
+        assert len(lines) == 2 and json.loads(lines[0])["histograms"]["checkpoint"]["count"] == 1
+    finally:
+        metrics.enable(False)
+        metrics.reset()
+        canvas.close()
+
+def test_histogram_percentiles():
+    """Test that percentiles report the bucket bound, capped at the largest value seen."""
+    histogram = metrics.Histogram()
+    for _ in range(90): histogram.add(0.0001)
+    for _ in range(10): histogram.add(0.05)
+    assert 0.0001 <= histogram.percentile(0.5) < 0.0002
+    assert histogram.percentile(0.99) == 0.05
+    assert histogram.summary()["count"] == 100
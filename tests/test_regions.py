@@ -0,0 +1,86 @@
+from asciicanvas.model import CHUNK_SIZE, Canvas, Cell, Math, Table
+
+def snapshot(canvas, x0, y0, x1, y1):
+    return [canvas.get_cell(x, y) for y in range(y0, y1) for x in range(x0, x1)]
+
+def journal_rows(canvas):
+    return canvas.db.conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+def test_move_region_is_one_op_and_one_undo_step(tmp_path):
+    """Test that moving a block across chunk borders writes one journal row and undoes in one step."""
+    canvas = Canvas(str(tmp_path / "doc.asciicanvas"))
+    canvas.load()
+    for y in range(100):
+        for x in range(0, 200, 3): canvas.set_cell(CHUNK_SIZE - 50 + x, y, Cell(chr(ord('a') + (x + y) % 26), fg=y % 3 or None))
+    table = Table(CHUNK_SIZE - 40, 10, rows=2, cols=2, cell_w=4, cell_h=2)
+    canvas.create_object(table)
+    outside = Math(CHUNK_SIZE + 148, 99, "a+b")
+    canvas.create_object(outside)
+    canvas.perform_checkpoint()
+    before = snapshot(canvas, CHUNK_SIZE - 60, 0, CHUNK_SIZE + 300, 160)
+    rows, groups = journal_rows(canvas), len(canvas.history.groups)
+
+    canvas.move_region(CHUNK_SIZE - 50, 0, CHUNK_SIZE + 150, 100, 30, 50)
+    assert journal_rows(canvas) == rows + 1 and len(canvas.history.groups) == groups + 1
+    assert canvas.get_cell(CHUNK_SIZE - 20, 50) == Cell('a', fg=None)
+    assert canvas.get_cell(CHUNK_SIZE - 50, 0) == Cell()
+    moved = canvas.get_object(table.id)
+    assert (moved.x, moved.y) == (CHUNK_SIZE - 10, 60)
+    assert canvas.get_cell(CHUNK_SIZE - 10, 61).owner == table.id
+    assert canvas.get_cell(CHUNK_SIZE + 178, 149) == Cell("a")
+    assert canvas.get_object(outside.id).x == CHUNK_SIZE + 148
+    canvas.close()
+
+    canvas = Canvas(str(tmp_path / "doc.asciicanvas"))
+    canvas.load()
+    assert canvas.get_object(table.id).x == CHUNK_SIZE - 10
+    assert canvas.undo()
+    assert snapshot(canvas, CHUNK_SIZE - 60, 0, CHUNK_SIZE + 300, 160) == before
+    assert canvas.get_object(table.id).x == CHUNK_SIZE - 40
+    canvas.close()
+
+def test_copy_paste_and_cut_keep_owner_links(tmp_path):
+    """Test that pasted objects get new ids with their cells relinked, and that cut removes the originals."""
+    canvas = Canvas(str(tmp_path / "doc.asciicanvas"))
+    canvas.load()
+    formula = Math(2, 2, "x^2")
+    canvas.create_object(formula)
+    canvas.set_cell(1, 1, Cell('#', bg=4))
+
+    block = canvas.copy_region(0, 0, 10, 5)
+    canvas.paste_region(block, 500, 300)
+    assert canvas.get_cell(501, 301) == Cell('#', bg=4)
+    copy_id = canvas.get_cell(502, 302).owner
+    assert copy_id not in (None, formula.id)
+    assert (canvas.get_object(copy_id).x, canvas.get_object(copy_id).y) == (502, 302)
+
+    cut = canvas.cut_region(0, 0, 10, 5)
+    assert canvas.get_cell(2, 2) == Cell() and canvas.get_object(formula.id) is None
+    canvas.paste_region(cut, 0, 0)
+    assert canvas.get_cell(2, 2).ch == 'x' and canvas.get_cell(2, 2).owner not in (formula.id, copy_id)
+
+    canvas.clear_region(0, 0, 700, 400)
+    assert not canvas.objects_in_rect(0, 0, 700, 400)
+    assert canvas.undo() and canvas.get_cell(501, 301) == Cell('#', bg=4) and len(canvas.objects_in_rect(0, 0, 700, 400)) == 2
+    canvas.close()
+
+def test_owner_table_drops_overwritten_owners_on_write_back(tmp_path):
+    """Test that repeated paste and clear cycles do not grow a chunk's owner table or blob."""
+    path = str(tmp_path / "doc.asciicanvas")
+    canvas = Canvas(path)
+    canvas.load()
+    canvas.create_object(Math(2, 2, "x^2"))
+    block = canvas.copy_region(0, 0, 10, 5)
+    for _ in range(200):
+        canvas.paste_region(block, 20, 20)
+        canvas.clear_region(20, 20, 30, 25)
+    canvas.paste_region(block, 20, 20)
+    pasted = canvas.get_cell(22, 22).owner
+    canvas.close()
+
+    canvas = Canvas(path)
+    canvas.load()
+    chunk = canvas.peek_chunk(0, 0)
+    assert pasted and len(chunk.owners) == 3 and canvas.get_cell(22, 22).owner == pasted
+    assert len(canvas.db.get_chunk(0, 0)) < 1000
+    canvas.close()
@@ -1,9 +1,12 @@
 import os
+import threading
 import pytest
 from time import time
 
-from asciicanvas.database import Database
-from asciicanvas.model import Canvas, Cell, CHUNK_SIZE
+import msgpack
+
+from asciicanvas.database import DICT_TRAIN_MIN_CHUNKS, Database, compress_data
+from asciicanvas.model import Canvas, Cell, Chunk, ChunkCache, Math, PageFrame, Table, CHUNK_SIZE, CHUNK_BASE_BYTES
 
 @pytest.fixture
 def db_path():
@@ -94,3 +97,313 @@ def test_empty_chunk_not_saved(db_path):
     chunk_data = db.get_chunk(1, 1)
     assert chunk_data is None
     db.close()
+
+def test_chunk_planes_roundtrip():
+    """Test that cells survive the array-backed planes and blank cells are pruned."""
+    chunk = Chunk(0, 0)
+    chunk.set_cell(3, 4, Cell(ch='A', fg=1, bg=2, owner="obj1"))
+    chunk.set_cell(4, 4, Cell(ch='B', owner="obj1"))
+    chunk.set_cell(5, 4, Cell(bg=3))
+    assert chunk.get_cell(3, 4) == Cell(ch='A', fg=1, bg=2, owner="obj1")
+    assert chunk.get_cell(4, 4) == Cell(ch='B', owner="obj1")
+    assert chunk.get_cell(5, 4) == Cell(bg=3)
+    assert chunk.get_cell(6, 4) == Cell()
+    assert chunk.count == 3
+    assert chunk.owners.count("obj1") == 1
+
+    chunk.set_cell(4, 4, Cell())
+    assert chunk.count == 2
+    assert not chunk.is_occupied(4, 4)
+    assert [(lx, ly) for lx, ly, _ in chunk.iter_cells()] == [(3, 4), (5, 4)]
+
+def test_chunk_codec_sparse_dense_and_legacy():
+    """Test that the plane codec keeps every cell attribute and version 1 blobs still decode."""
+    dense = Chunk(1, -1)
+    for i in range(CHUNK_SIZE * CHUNK_SIZE):
+        lx, ly = i % CHUNK_SIZE, i // CHUNK_SIZE
+        dense.set_cell(lx, ly, Cell(ch=chr(33 + i * 7 % 90), fg=i % 3 or None, owner="o%d" % (ly // 32) if lx < 8 else None))
+    restored = Chunk.deserialize(1, -1, dense.serialize())
+    assert list(restored.iter_cells()) == list(dense.iter_cells())
+    assert restored.count == dense.count and not restored.dirty
+
+    sparse = Chunk(0, 0)
+    sparse.set_cell(2, 5, Cell(ch='x', bg=4))
+    sparse.set_cell(3, 5, Cell(ch='y'))
+    sparse.set_cell(3, 5, Cell())
+    restored = Chunk.deserialize(0, 0, sparse.serialize())
+    assert list(restored.iter_cells()) == [(2, 5, Cell(ch='x', bg=4))]
+    assert restored.fg is None and restored.owner_ids is None
+    assert len(sparse.serialize()) < 200
+
+    legacy = compress_data(msgpack.packb({'chars': {(1, 2): 'L'}}, use_bin_type=True))
+    assert list(Chunk.deserialize(0, 0, legacy).iter_cells()) == [(1, 2, Cell(ch='L'))]
+
+def test_compression_dictionary_is_trained_and_old_blobs_still_decode(db_path):
+    """Test that a dictionary trained in the background shrinks rewritten chunks and dictionary-less blobs stay readable."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    for k in range(DICT_TRAIN_MIN_CHUNKS * 2):
+        for i, ch in enumerate(f"note {k} here"):
+            canvas.set_cell(k * CHUNK_SIZE + i, k % 7, Cell(ch=ch))
+    canvas.log_and_apply_operation({"type": "SET_CELL", "x": 5, "y": 5, "new_cell": ['z', None, None, None]})
+    canvas.dict_train_threshold = 10 ** 9
+    canvas.perform_checkpoint()
+    untrained, other = canvas.db.get_chunk(0, 0), canvas.db.get_chunk(1, 0)
+    sizes = [len(data) for _, _, data in canvas.db.get_chunks_in_rect(0, 0, 1000, 0)]
+
+    # Training starts after this checkpoint and close() stores its result; nothing is recompressed.
+    canvas.dict_train_threshold = DICT_TRAIN_MIN_CHUNKS
+    canvas.log_and_apply_operation({"type": "SET_CELL", "x": 6, "y": 5, "new_cell": ['y', None, None, None]})
+    canvas.perform_checkpoint()
+    canvas.close()
+
+    reopened = Canvas(db_path)
+    reopened.load()
+    assert reopened.db.get_meta("zstd_dict") and reopened.db.compressor.dict_id
+    assert reopened.db.get_chunk(1, 0) == other
+    reopened.set_cell(7, 5, Cell(ch='x'))
+    reopened.perform_checkpoint()
+    assert len(reopened.db.get_chunk(0, 0)) < len(untrained)
+    assert reopened.get_cell(3 * CHUNK_SIZE, 3) == Cell(ch='n')
+    assert reopened.get_cell(6, 5) == Cell(ch='y')
+    assert Chunk.deserialize(0, 0, untrained, reopened.db.decompress).get_cell(0, 0) == Cell(ch='n')
+    assert Chunk.deserialize(0, 0, Chunk(0, 0).serialize(), reopened.db.decompress).is_empty
+    assert reopened.db.train_compression_dictionary()
+    assert sum(len(data) for _, _, data in reopened.db.get_chunks_in_rect(0, 0, 1000, 0)) < sum(sizes)
+    assert reopened.get_cell(3 * CHUNK_SIZE, 3) == Cell(ch='n')
+    reopened.close()
+
+def test_undo_of_a_paste_survives_retraining_the_dictionary(db_path):
+    """Test that pasted blocks kept for undo do not depend on the dictionary in use when they were written."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    for k in range(DICT_TRAIN_MIN_CHUNKS * 2):
+        for i, ch in enumerate(f"note {k} here"): canvas.set_cell(k * CHUNK_SIZE + i, k % 7, Cell(ch=ch))
+    canvas.perform_checkpoint()
+    assert canvas.db.train_compression_dictionary()
+    canvas.paste_region(canvas.copy_region(0, 0, 12, 1), 2, 40)
+    canvas.perform_checkpoint()
+    for k in range(DICT_TRAIN_MIN_CHUNKS * 2):
+        for i, ch in enumerate(f"other {k} text"): canvas.set_cell(k * CHUNK_SIZE + i, 50 + k % 5, Cell(ch=ch))
+    canvas.perform_checkpoint()
+    assert canvas.db.train_compression_dictionary()
+    canvas.close()
+
+    reopened = Canvas(db_path)
+    reopened.load()
+    assert reopened.get_cell(2, 40) == Cell(ch='n')
+    while reopened.get_cell(2, 40) == Cell(ch='n'): assert reopened.undo()
+    assert reopened.get_cell(2, 40) == Cell() and reopened.redo()
+    assert reopened.get_cell(2, 40) == Cell(ch='n')
+    reopened.close()
+
+def test_chunk_row_accessors():
+    """Test that whole rows can be read without building per-cell objects."""
+    chunk = Chunk(0, 0)
+    for i, ch in enumerate("hello"):
+        chunk.set_cell(2 + i, 7, Cell(ch=ch, fg=1 if i < 2 else None))
+    assert chunk.row_text(7, 0, 9) == "  hello  "
+    assert chunk.row_runs(7, 0, 9) == [(0, 2, None, None), (2, 4, 1, None), (4, 9, None, None)]
+    assert chunk.row_text(8) == " " * CHUNK_SIZE
+    assert chunk.row_is_empty(8) and not chunk.row_is_empty(7)
+
+def test_chunk_cache_evicts_with_write_back(db_path):
+    """Test that the chunk cache stays within budget and writes dirty chunks back on eviction."""
+    canvas = Canvas(db_path, cache_bytes=3 * (CHUNK_BASE_BYTES + 4 * CHUNK_SIZE * CHUNK_SIZE))
+    canvas.load()
+
+    for i in range(10):
+        canvas.set_cell(i * CHUNK_SIZE, 0, Cell(ch=str(i)))
+    assert len(canvas.chunks) <= 3
+    assert canvas.chunks.nbytes <= canvas.chunks.budget_bytes
+    assert canvas.db.get_chunk(0, 0) is not None
+
+    # Reading empty chunks only records them in the negative set.
+    for cy in range(1, 50):
+        assert canvas.get_cell(0, cy * CHUNK_SIZE) == Cell()
+    assert len(canvas.chunks) <= 3
+    assert (0, 49) in canvas.empty_chunks
+
+    assert [canvas.get_cell(i * CHUNK_SIZE, 0).ch for i in range(10)] == [str(i) for i in range(10)]
+    canvas.close()
+
+def test_chunk_cache_pins_dirty_chunks_when_asked():
+    """Test that a cache with keep_dirty set evicts only clean chunks and never hands a dirty one to the hook."""
+    evicted = []
+    cache = ChunkCache(2 * (CHUNK_BASE_BYTES + 4 * CHUNK_SIZE * CHUNK_SIZE), evicted.append)
+    cache.keep_dirty = True
+    for i in range(6):
+        chunk = Chunk(i, 0)
+        chunk.set_cell(0, 0, Cell(ch='x'))
+        chunk.dirty = i % 2 == 0
+        cache.put(chunk)
+    assert evicted and not any(chunk.dirty for chunk in evicted)
+    assert all((i, 0) in cache for i in (0, 2, 4))
+
+def test_read_only_replay_keeps_dirty_chunks_under_a_small_cache(db_path):
+    """Test that replaying a journal tail over many chunks read-only never writes, even past the cache budget."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    canvas.perform_checkpoint()
+    for i in range(20):
+        canvas.log_and_apply_operation({"type": "SET_CELL", "x": i * CHUNK_SIZE, "y": 0, "new_cell": [chr(65 + i), None, None, None]})
+    canvas.db.close()
+
+    reader = Canvas(db_path, cache_bytes=200_000)
+    reader.load(read_only=True)
+    assert [reader.get_cell(i * CHUNK_SIZE, 0).ch for i in range(20)] == [chr(65 + i) for i in range(20)]
+    for cy in range(1, 30): reader.get_cell(0, cy * CHUNK_SIZE)
+    reader.close()
+    db = Database(db_path)
+    db.connect(read_only=True)
+    assert db.get_chunk(1, 0) is None
+    db.close()
+
+def test_read_only_canvas_reads_one_snapshot_while_an_editor_checkpoints(db_path):
+    """Test that a read-only canvas ignores checkpoints an editor makes after it was loaded."""
+    editor = Canvas(db_path)
+    editor.load()
+    editor.set_cell(5 * CHUNK_SIZE, 0, Cell(ch='a'))
+    editor.perform_checkpoint()
+    editor.log_and_apply_operation({"type": "SET_CELL", "x": 0, "y": 0, "new_cell": ['t', None, None, None]})
+    editor.flush_journal()
+
+    reader = Canvas(db_path)
+    reader.load(read_only=True)
+    seq = reader.db.get_document_seq()
+    editor.set_cell(5 * CHUNK_SIZE, 0, Cell(ch='c'))
+    editor.log_and_apply_operation({"type": "SET_CELL", "x": 0, "y": 0, "new_cell": ['u', None, None, None]})
+    editor.perform_checkpoint()
+    assert reader.get_cell(5 * CHUNK_SIZE, 0) == Cell(ch='a')
+    assert reader.get_cell(0, 0) == Cell(ch='t')
+    assert reader.db.get_document_seq() == seq
+    reader.close()
+    editor.close()
+
+def test_get_region_across_chunks(db_path):
+    """Test that region reads assemble rows and style runs across chunk borders."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    x = CHUNK_SIZE - 2
+    for i, ch in enumerate("abcd"):
+        canvas.set_cell(x + i, -1, Cell(ch=ch, fg=2))
+    canvas.set_cell(x + 4, -1, Cell(ch='e'))
+
+    rows = canvas.get_region(x - 1, -2, x + 6, 0)
+    assert [row.text for row in rows] == [" " * 7, " abcde "]
+    assert rows[0].runs == [(x - 1, x + 6, None, None)]
+    assert rows[1].runs == [(x - 1, x, None, None), (x, x + 4, 2, None), (x + 4, x + 6, None, None)]
+    assert canvas.get_region(5, 5, 5, 9) == []
+    canvas.close()
+
+def test_get_chunks_in_rect(db_path):
+    """Test that a single range query returns every stored chunk in the rectangle."""
+    db = Database(db_path)
+    db.connect()
+    db.create_tables()
+    for cx, cy in [(0, 0), (1, 2), (3, 3), (-1, 0)]:
+        db.put_chunk(cx, cy, b"data")
+    assert sorted((cx, cy) for cx, cy, _ in db.get_chunks_in_rect(0, 0, 2, 2)) == [(0, 0), (1, 2)]
+    db.close()
+
+def test_prefetch_installs_decoded_chunks(db_path):
+    """Test that prefetched chunks are decoded in the background and installed on request."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    canvas.set_cell(CHUNK_SIZE + 3, 5, Cell(ch='P'))
+    canvas.save_all_dirty_chunks()
+    canvas.close()
+
+    canvas = Canvas(db_path)
+    canvas.load()
+    ready = threading.Event()
+    canvas.start_prefetcher(ready.set)
+    canvas.prefetch(0, 0, 2, 1)
+    assert ready.wait(5)
+    assert canvas.install_prefetched() == 6
+    assert (1, 0) in canvas.chunks
+    assert (2, 1) in canvas.empty_chunks
+    assert canvas.get_cell(CHUNK_SIZE + 3, 5) == Cell(ch='P')
+    canvas.close()
+
+def test_objects_load_lazily_through_spatial_index(db_path):
+    """Test that objects are indexed by bounding box on load and materialized only when queried."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    table = Table(10, 10, rows=2, cols=2, cell_w=4, cell_h=1)
+    frame = PageFrame(500, 500, 80, 40)
+    canvas.create_object(table)
+    canvas.create_object(frame)
+    canvas.close()
+
+    # An object stored before bounding boxes existed is indexed once on load.
+    db = Database(db_path)
+    db.connect()
+    legacy = Math(-50, -50, "a/b")
+    db.put_object(legacy.id, legacy.type, Canvas._pack_object(legacy))
+    db.close()
+
+    canvas = Canvas(db_path)
+    canvas.load()
+    assert len(canvas.object_index) == 3
+    assert set(canvas.objects) == {legacy.id}
+    assert [obj.id for obj in canvas.objects_at(12, 11)] == [table.id]
+    assert set(canvas.objects) == {legacy.id, table.id}
+    assert [obj.id for obj in canvas.objects_in_rect(0, 0, 1000, 1000) if obj.type == "PageFrame"] == [frame.id]
+    assert canvas.objects_at(300, 300) == []
+    assert [obj.id for obj in canvas.iter_objects("Math")] == [legacy.id]
+    canvas.close()
+
+    db = Database(db_path)
+    db.connect()
+    assert all(row[2] is not None for row in db.get_object_bounds())
+    db.close()
+
+def test_text_index_follows_checkpoints(tmp_path):
+    """Test that search finds stored and unsaved text, drops erased text and indexes older documents on open."""
+    path = str(tmp_path / "doc.asciicanvas")
+    canvas = Canvas(path)
+    canvas.load()
+    for i, ch in enumerate("Hello world"): canvas.set_cell(-12 + i, -3, Cell(ch=ch))
+    for i, ch in enumerate("hello again"): canvas.set_cell(5 * CHUNK_SIZE + i, 7, Cell(ch=ch))
+    assert canvas.search("HELLO") == [(-12, -3), (5 * CHUNK_SIZE, 7)]
+    canvas.perform_checkpoint()
+    assert canvas.db.search_text("world", 10) == [(-1, -1, CHUNK_SIZE - 3, " " * (CHUNK_SIZE - 12) + "Hello world")]
+    canvas.set_cell(5 * CHUNK_SIZE, 7, Cell())
+    assert canvas.search("hello") == [(-12, -3)]
+    canvas.perform_checkpoint()
+    assert canvas.search("lo") == [(-9, -3), (5 * CHUNK_SIZE + 3, 7)]
+
+    canvas.db.conn.execute("DROP TABLE chunk_text")
+    canvas.db.conn.execute("DELETE FROM meta WHERE key = 'text_index'")
+    canvas.db.conn.commit()
+    canvas.close()
+    reader = Canvas(path)
+    reader.load(read_only=True)
+    assert not reader.text_index_ready and reader.search("world") == [(-6, -3)]
+    reader.close()
+    canvas = Canvas(path)
+    canvas.load()
+    assert canvas.text_index_ready and canvas.db.search_text("world", 10)
+    canvas.close()
+
+def test_chunk_summaries_follow_writes_without_reading_chunks(tmp_path):
+    """Test that summaries track counts and coarse occupancy through checkpoints and reopen without decoding chunks."""
+    path = str(tmp_path / "doc.asciicanvas")
+    canvas = Canvas(path)
+    canvas.load()
+    canvas.set_cell(0, 0, Cell("a"))
+    canvas.set_cell(CHUNK_SIZE - 1, CHUNK_SIZE - 1, Cell(bg=2))
+    canvas.set_cell(3 * CHUNK_SIZE + 20, -5, Cell("b"))
+    assert canvas.chunk_summaries()[(0, 0)] == (2, (1 | 1 << 63).to_bytes(8, "little"))
+    canvas.perform_checkpoint()
+    canvas.set_cell(3 * CHUNK_SIZE + 20, -5, Cell())
+    canvas.set_cell(1, 0, Cell("c"))
+    assert set(canvas.chunk_summaries()) == {(0, 0)} and canvas.chunk_summaries()[(0, 0)][0] == 3
+    canvas.close()
+
+    canvas = Canvas(path)
+    canvas.load()
+    assert canvas.chunk_summaries() == {(0, 0): (3, (1 | 1 << 63).to_bytes(8, "little"))}
+    assert len(canvas.chunks) == 0
+    canvas.close()
@@ -0,0 +1,200 @@
+import os
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PySide6.QtWidgets")
+
+from asciicanvas.model import Canvas, Cell, CHUNK_SIZE, PREFETCH_MAX_CHUNKS
+from asciicanvas.ui import CanvasWidget
+
+@pytest.fixture(scope="module")
+def qapp():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    yield app
+
+@pytest.fixture
+def widget(qapp):
+    """Provides a CanvasWidget over a temporary canvas."""
+    db_path = "test_ui.asciicanvas"
+    canvas = Canvas(db_path)
+    canvas.load()
+    status_bar = QtWidgets.QStatusBar()
+    widget = CanvasWidget(canvas, status_bar)
+    widget.resize(640, 480)
+    yield widget
+    widget.deleteLater()
+    status_bar.deleteLater()
+    qapp.processEvents()
+    canvas.close()
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+def test_tile_cache_reuses_unchanged_tiles(widget):
+    """Test that repaints blit cached tiles and only re-rasterize tiles of changed chunks."""
+    widget.zoom_level_index = widget.ZOOM_STEPS.index(0.4)
+    for x in range(0, 200, 2):
+        widget.canvas.set_cell(x, 3, Cell(ch='t'))
+    widget.grab()
+    first = widget.tiles_rendered
+    assert first > 0
+
+    widget.grab()
+    assert widget.tiles_rendered == first
+
+    widget.canvas.set_cell(CHUNK_SIZE + 1, 1, Cell(ch='x'))
+    widget.grab()
+    assert 0 < widget.tiles_rendered - first < first
+
+def test_low_zoom_draws_chunk_mips_instead_of_text(widget):
+    """Test that low zoom draws cached per-chunk LOD images and rebuilds only a chunk that was written."""
+    widget.zoom_level_index = widget.ZOOM_STEPS.index(0.05)
+    for cx in range(3):
+        widget.canvas.set_cell(cx * CHUNK_SIZE + 5, 5, Cell(ch='t', bg=2))
+    widget.grab()
+    first = widget.lod_rendered
+    assert widget.tiles_rendered == 0 and first > 0
+    image = widget.lod_cache.get((0, 0, 0), widget.canvas.peek_chunk(0, 0).version)
+    assert image.pixelColor(5, 5).alpha() == 255 and image.pixelColor(6, 5).alpha() == 0
+
+    widget.grab()
+    assert widget.lod_rendered == first
+
+    widget.canvas.set_cell(CHUNK_SIZE + 1, 1, Cell(ch='x'))
+    widget.grab()
+    assert widget.lod_rendered - first == first // 3
+    assert widget.lod_image(widget.canvas.peek_chunk(1, 0), 3).width() == CHUNK_SIZE >> 3
+
+def test_low_zoom_prefetches_missing_chunks_in_batches(widget, qapp):
+    """Test that low zoom leaves chunks that are not resident to the prefetcher and draws them once installed."""
+    import time
+    from asciicanvas.ui import LOD_PREFETCH_SPAN
+    widget.zoom_level_index = widget.ZOOM_STEPS.index(0.05)
+    keys = [(cx, cy) for cx in range(3) for cy in range(2)]
+    for cx, cy in keys: widget.canvas.set_cell(cx * CHUNK_SIZE + 5, cy * CHUNK_SIZE + 5, Cell(ch='t', bg=2))
+    widget.canvas.perform_checkpoint()
+    for key in keys: widget.canvas.chunks.pop(key)
+    requested = []
+    prefetch = widget.canvas.prefetch
+    widget.canvas.prefetch = lambda *rect: (requested.append(rect), prefetch(*rect))
+    widget.grab()
+    assert widget.lod_rendered == 0 and widget.lod_pending
+    cx0, cy0, cx1, cy1 = requested[-1]
+    assert (cx1 - cx0 + 1) <= LOD_PREFETCH_SPAN and (cy1 - cy0 + 1) <= LOD_PREFETCH_SPAN
+
+    deadline = time.monotonic() + 5
+    while not all(widget.canvas.is_resident(*key) for key in keys) and time.monotonic() < deadline:
+        qapp.processEvents()
+        widget.grab()
+    assert all(key in widget.canvas.chunks for key in keys)
+    widget.grab()
+    assert widget.lod_rendered >= len(keys)
+
+def test_stats_overlay_reports_frames(widget):
+    """Test that the stats overlay enables metrics and reports frame times and resident chunks."""
+    from asciicanvas import metrics
+    widget.canvas.set_cell(1, 1, Cell(ch='s'))
+    widget.toggle_stats_overlay()
+    try:
+        widget.grab(); widget.grab()
+        lines = widget.stats_lines()
+        assert metrics.histograms['paint'].count == 2
+        assert lines[2].startswith("chunks 1 ") and lines[3] == "journal backlog 0"
+    finally:
+        widget.toggle_stats_overlay()
+        metrics.reset()
+    assert not metrics.enabled
+
+def test_search_jumps_between_results(widget):
+    """Test that a search moves the cursor to the next match after it and n/N cycle through the matches."""
+    from PySide6.QtCore import Qt
+    from PySide6.QtGui import QKeyEvent
+    for x, y in ((5, 2), (40, 300), (2, 900)):
+        for i, ch in enumerate("needle"): widget.canvas.set_cell(x + i, y, Cell(ch=ch))
+    widget.canvas.save_all_dirty_chunks()
+    widget.cursor_x, widget.cursor_y = 0, 100
+    widget.search("NEEDLE")
+    assert (widget.cursor_x, widget.cursor_y) == (40, 300)
+    widget.frames.flush(); widget.status_updates.flush()
+    assert "Match 2/3" in widget.status_bar.currentMessage()
+    widget.keyPressEvent(QKeyEvent(QKeyEvent.KeyPress, Qt.Key_N, Qt.NoModifier, "n"))
+    assert (widget.cursor_x, widget.cursor_y) == (2, 900)
+    widget.keyPressEvent(QKeyEvent(QKeyEvent.KeyPress, Qt.Key_N, Qt.NoModifier, "n"))
+    assert (widget.cursor_x, widget.cursor_y) == (5, 2)
+    widget.keyPressEvent(QKeyEvent(QKeyEvent.KeyPress, Qt.Key_N, Qt.ShiftModifier, "N"))
+    assert (widget.cursor_x, widget.cursor_y) == (2, 900)
+
+def test_minimap_draws_from_summaries_and_jumps(widget):
+    """Test that the minimap renders the stored summaries and that clicking it moves the view and prefetches."""
+    from PySide6.QtCore import QPointF
+    widget.canvas.set_cell(40 * CHUNK_SIZE + 5, 20 * CHUNK_SIZE + 5, Cell(ch='f'))
+    widget.canvas.perform_checkpoint()
+    widget.canvas.chunks.pop((40, 20))
+    widget.minimap.show()
+    widget.minimap.grab()
+    assert (40, 20) in widget.minimap.summaries and (40, 20) not in widget.canvas.chunks
+
+    requested = []
+    widget.canvas.prefetch = lambda *rect: requested.append(rect)
+    cx0, cy0, scale, ox, oy = widget.minimap.layout_key
+    widget.minimap.jump(QPointF(ox + (40.5 - cx0) * scale, oy + (20.5 - cy0) * scale))
+    assert abs(widget.cursor_x - (40 * CHUNK_SIZE + 64)) <= CHUNK_SIZE // 8 and abs(widget.cursor_y - (20 * CHUNK_SIZE + 64)) <= CHUNK_SIZE // 8
+    rect = requested[-1]
+    assert rect[0] <= 40 <= rect[2] and rect[1] <= 20 <= rect[3]
+
+    widget.zoom_level_index = widget.ZOOM_STEPS.index(0.05)
+    widget.resize(1600, 1200)
+    widget.jump_to(40 * CHUNK_SIZE + 64, 20 * CHUNK_SIZE + 64)
+    cx0, cy0, cx1, cy1 = widget.view_chunk_rect()
+    assert (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > PREFETCH_MAX_CHUNKS
+    cx0, cy0, cx1, cy1 = requested[-1]
+    assert cx0 <= 40 <= cx1 and cy0 <= 20 <= cy1 and (cx1 - cx0 + 1) * (cy1 - cy0 + 1) <= PREFETCH_MAX_CHUNKS
+
+def test_edits_repaint_damage_and_pans_scroll(widget):
+    """Test that typing repaints only the written and cursor cells and that panning blits with scroll."""
+    from PySide6.QtCore import Qt
+    from PySide6.QtGui import QKeyEvent
+    updates, scrolls = [], []
+    widget.update = lambda *rect: updates.append(rect)
+    widget.scroll = lambda *args: scrolls.append(args[:2])
+    widget.mode = 'TEXT'
+    widget.keyPressEvent(QKeyEvent(QKeyEvent.KeyPress, Qt.Key_A, Qt.NoModifier, "a"))
+    widget.frames.flush()
+    cell_w, cell_h = widget.get_zoomed_cell_size()
+    assert updates and all(rect and rect[0].width() <= cell_w + 3 and rect[0].height() <= cell_h + 3 for rect in updates)
+    assert not scrolls
+
+    updates.clear()
+    widget.canvas.fill_rect(0, 1, 30, 10, Cell(ch='#'))
+    widget.refresh()
+    assert widget.cell_rect(0, 1, 30, 10) in [rect[0] for rect in updates if rect]
+
+    updates.clear()
+    widget.keyPressEvent(QKeyEvent(QKeyEvent.KeyPress, Qt.Key_Down, Qt.ShiftModifier, ""))
+    widget.frames.flush()
+    assert scrolls == [(0, -round(cell_h))] and () not in updates
+
+    widget.zoom_level_index -= 1
+    widget.refresh()
+    assert () in updates and len(scrolls) == 1
+
+def test_idle_widget_does_not_wake_up_and_frames_coalesce(widget, qapp):
+    """Test that an idle widget runs no timers, held keys repeat until released and events share one frame."""
+    from PySide6.QtCore import QEventLoop, QTimer, Qt
+    from PySide6.QtGui import QKeyEvent
+    def run_loop(ms):
+        loop = QEventLoop()
+        QTimer.singleShot(ms, loop.quit)
+        loop.exec()
+    run_loop(150)
+    assert widget.wakeups == 0 and not widget.movement_timer.isActive()
+
+    for _ in range(5): widget.keyPressEvent(QKeyEvent(QKeyEvent.KeyPress, Qt.Key_Right, Qt.NoModifier, ""))
+    assert widget.cursor_x == 5 and widget.movement_timer.isActive()
+    widget.keyReleaseEvent(QKeyEvent(QKeyEvent.KeyRelease, Qt.Key_Right, Qt.NoModifier, ""))
+    assert not widget.movement_timer.isActive()
+    run_loop(150)
+    assert widget.frames.runs == 1 and widget.status_updates.runs == 1
+    assert "Cursor: (5, 0)" in widget.status_bar.currentMessage()
+    woken = widget.wakeups
+    run_loop(150)
+    assert widget.wakeups == woken
@@ -0,0 +1,132 @@
+import os
+import pytest
+
+from asciicanvas import model
+from asciicanvas.model import Canvas, Cell, Table
+from asciicanvas.undo import UndoGroup
+
+@pytest.fixture
+def db_path():
+    path = "test_undo.asciicanvas"
+    yield path
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def type_text(canvas, x, y, text):
+    for i, ch in enumerate(text):
+        canvas.log_and_apply_operation({"type": "SET_CELL", "x": x + i, "y": y, "new_cell": list(Cell(ch=ch))})
+
+def row(canvas, x, y, width):
+    return "".join(canvas.get_cell(x + i, y).ch for i in range(width))
+
+def test_typing_run_is_one_undo_step(db_path):
+    """Test that consecutive typing merges into one group and undo/redo restore it whole."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    type_text(canvas, 0, 0, "hello")
+    canvas.history.seal()
+    type_text(canvas, 0, 1, "world")
+    assert len(canvas.history.groups) == 2
+
+    assert canvas.undo()
+    assert row(canvas, 0, 1, 5) == "     "
+    assert row(canvas, 0, 0, 5) == "hello"
+    assert canvas.undo()
+    assert row(canvas, 0, 0, 5) == "     "
+    assert not canvas.undo()
+    assert canvas.redo()
+    assert row(canvas, 0, 0, 5) == "hello"
+    canvas.close()
+
+def test_undo_object_creation(db_path):
+    """Test that undoing an object removes it and redo brings it back."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    table = Table(0, 0, rows=1, cols=2, cell_w=3, cell_h=1)
+    canvas.create_object(table)
+    x, y, cell = table.render()[0]
+    canvas.perform_checkpoint()
+
+    assert canvas.undo()
+    assert canvas.get_object(table.id) is None
+    assert canvas.get_cell(x, y) == Cell()
+    canvas.perform_checkpoint()
+    assert canvas.db.get_object(table.id) is None
+    assert canvas.redo()
+    assert canvas.get_object(table.id) is not None
+    assert canvas.get_cell(x, y) == cell
+    canvas.close()
+
+def test_history_survives_restart(db_path):
+    """Test that undo groups are rebuilt from the journal and from the undo table."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    type_text(canvas, 0, 0, "saved")
+    canvas.perform_checkpoint()
+    canvas.history.seal()
+    type_text(canvas, 0, 1, "tail")
+    canvas.flush_journal()
+    canvas.db.close()
+
+    reopened = Canvas(db_path)
+    reopened.load()
+    assert reopened.undo()
+    assert row(reopened, 0, 1, 4) == "    "
+    assert reopened.undo()
+    assert row(reopened, 0, 0, 5) == "     "
+    reopened.close()
+
+    reopened = Canvas(db_path)
+    reopened.load()
+    assert row(reopened, 0, 0, 5) == "     "
+    assert reopened.redo() is False
+    assert reopened.undo() is False
+    reopened.close()
+
+def test_redo_after_checkpoint_survives_a_crash(db_path):
+    """Test that a redo in the journal tail of a group undone before the checkpoint can be undone after recovery."""
+    canvas = Canvas(db_path)
+    canvas.load()
+    type_text(canvas, 0, 0, "abc")
+    assert canvas.undo()
+    canvas.perform_checkpoint()
+    assert canvas.redo()
+    canvas.flush_journal()
+    canvas.db.close()
+
+    reopened = Canvas(db_path)
+    reopened.load()
+    assert row(reopened, 0, 0, 3) == "abc"
+    assert reopened.undo()
+    assert row(reopened, 0, 0, 3) == "   "
+    assert reopened.redo()
+    assert row(reopened, 0, 0, 3) == "abc"
+    reopened.close()
+
+def test_history_pages_beyond_limit(db_path, monkeypatch):
+    """Test that groups evicted from memory are stored and paged back in on undo."""
+    monkeypatch.setattr(model, "UNDO_LIMIT", 4)
+    canvas = Canvas(db_path)
+    canvas.load()
+    for y in range(10):
+        type_text(canvas, 0, y, "ab")
+        canvas.history.seal()
+    assert len(canvas.history.groups) == 4
+    canvas.perform_checkpoint()
+    for _ in range(10):
+        assert canvas.undo()
+    assert not canvas.undo()
+    assert all(row(canvas, 0, y, 2) == "  " for y in range(10))
+    canvas.close()
+
+def test_group_pack_round_trip():
+    """Test that a group keeps plain and styled edits and its ops through pack/unpack."""
+    group = UndoGroup()
+    group.add_cell(1, 2, [" ", None, None, None], ["a", None, None, None])
+    group.add_op({"type": "CREATE_OBJECT", "obj_data": {"id": "t1"}, "old_cells": []})
+    group.add_cell(3, 4, ["b", None, None, None], ["c", 1, 2, "t1"])
+    restored = UndoGroup.unpack(group.pack())
+    assert restored.forward_ops() == group.forward_ops()
+    assert restored.inverse_ops() == group.inverse_ops()
+    assert [op["type"] for op in restored.inverse_ops()] == ["SET_CELL", "DELETE_OBJECT", "SET_CELL"]